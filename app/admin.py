@@ -0,0 +1,156 @@
+import pandas as pd
+import streamlit as st
+from utils.corpora import get_corpus_cache
+from utils.resilience import get_admission
+from utils.singleflight import singleflight_stats
+from utils.tracing import get_tracer
+
+# Chat turn stages in pipeline order; any other recorded stage is listed after
+STAGE_ORDER = [
+    "chat_turn",
+    "retrieve",
+    "embedding",
+    "chroma_query",
+    "bm25",
+    "generate",
+    "safety_check",
+    "language_detection",
+    "translation",
+    "generation",
+    "render_app",
+    "render_chat",
+    "render_scatter",
+]
+
+# Reruns of the whole page and of each fragment
+RENDER_STAGES = ["render_app", "render_chat", "render_scatter"]
+
+
+def render_admin():
+    """
+    Latency per stage, render cost, admission control, corpus cache and
+    coalesced requests of this process. Each section renders on its own,
+    so a fresh process still shows the ones with data.
+    """
+    tracer = get_tracer()
+    stats = tracer.stage_stats()
+
+    st.title("Latência por etapa")
+    if stats:
+        names = [n for n in STAGE_ORDER if n in stats]
+        names += sorted(n for n in stats if n not in STAGE_ORDER)
+
+        stats_df = pd.DataFrame(
+            [
+                {
+                    "stage": name,
+                    "count": stats[name]["count"],
+                    "p50 (ms)": round(stats[name]["p50_ms"], 1),
+                    "p95 (ms)": round(stats[name]["p95_ms"], 1),
+                }
+                for name in names
+            ]
+        )
+
+        st.caption(f"Janela móvel das últimas {tracer.window} medições por etapa.")
+        st.dataframe(stats_df, hide_index=True, use_container_width=True)
+        st.bar_chart(stats_df.set_index("stage")[["p50 (ms)", "p95 (ms)"]])
+    else:
+        st.info("Ainda não há pedidos registados neste processo.")
+
+    renders = [s for s in tracer.recent_spans() if s["name"] in RENDER_STAGES]
+    if renders:
+        st.subheader("Custo por interação")
+        render_df = pd.DataFrame(
+            [
+                {
+                    "rerun": s["name"],
+                    "cpu (ms)": s["attributes"].get("cpu_ms"),
+                    "payload (KB)": s["attributes"].get("payload_bytes", 0) / 1024,
+                }
+                for s in renders
+            ]
+        )
+        summary = render_df.groupby("rerun").agg(["median", "max"]).round(1)
+        summary.columns = [f"{column} {stat}" for column, stat in summary.columns]
+        summary.insert(0, "count", render_df.groupby("rerun").size())
+        st.dataframe(summary.reset_index(), hide_index=True, use_container_width=True)
+
+    admission = get_admission().stats()
+    st.subheader("Controlo de admissão")
+    cols = st.columns(5)
+    cols[0].metric("Em fila", admission["queue_depth"])
+    cols[1].metric("Fila máxima", admission["max_queue_depth"])
+    cols[2].metric("Em curso", admission["in_flight"])
+    cols[3].metric("Espera p95 (ms)", round(admission["p95_ms"], 1))
+    cols[4].metric("Recusados", admission["rejected"])
+
+    corpora = get_corpus_cache().stats()
+    st.subheader("Coleções em memória")
+    cols = st.columns(5)
+    cols[0].metric(
+        "Memória (MB)",
+        f"{corpora['bytes'] / 1e6:.0f} / {corpora['max_bytes'] / 1e6:.0f}",
+    )
+    cols[1].metric(
+        "Acertos (%)",
+        round(100 * corpora["hits"] / max(corpora["hits"] + corpora["misses"], 1), 1),
+    )
+    cols[2].metric("Carregamentos", corpora["loads"])
+    cols[3].metric("Carga média (s)", round(corpora["mean_load_s"], 1))
+    cols[4].metric("Expulsões", corpora["evictions"])
+    if corpora["corpora"]:
+        st.dataframe(
+            pd.DataFrame(
+                [
+                    {"collection": c["name"], "MB": round(c["bytes"] / 1e6, 1)}
+                    for c in corpora["corpora"][::-1]
+                ]
+            ),
+            hide_index=True,
+            use_container_width=True,
+        )
+
+    flights = singleflight_stats()
+    if flights:
+        st.subheader("Pedidos idênticos partilhados")
+        st.dataframe(
+            pd.DataFrame(
+                [
+                    {
+                        "request": name,
+                        "calls": counts["calls"],
+                        "coalesced": counts["coalesced"],
+                        "coalesced (%)": round(
+                            100 * counts["coalesced"] / max(counts["calls"], 1), 1
+                        ),
+                        "in flight": counts["in_flight"],
+                    }
+                    for name, counts in flights.items()
+                ]
+            ),
+            hide_index=True,
+            use_container_width=True,
+        )
+
+    recent = tracer.recent_spans()[-100:][::-1]
+    if recent:
+        with st.expander("Spans recentes"):
+            st.dataframe(
+                pd.DataFrame(
+                    [
+                        {
+                            "stage": s["name"],
+                            "trace": s["trace_id"][:8],
+                            "duration (ms)": round(s["duration_ms"], 1),
+                            "attributes": s["attributes"],
+                        }
+                        for s in recent
+                    ]
+                ),
+                hide_index=True,
+                use_container_width=True,
+            )
+
+    if st.button("Atualizar"):
+        st.rerun()
@@ -1,18 +1,37 @@
 import argparse
+import hmac
+import logging
 import os
 import sys
+import uuid
 
 import numpy as np
 import pandas as pd
 import streamlit as st
 import umap
+from admin import render_admin
 from dotenv import load_dotenv
 from pages.main_cols.chat import render_chat_column
 from pages.main_cols.scatter import render_visualization_column
+from utils.batching import EmbeddingBatcher
 from utils.config import load_config, save_config
+from utils.corpora import (
+    Corpus,
+    configure_corpus_cache,
+    get_corpus_cache,
+    resolve_collections,
+)
 from utils.embeddings import OpenAIEmbedding
 from utils.generator import OpenAIGenerator
+from utils.highlights import NeighbourTable, build_row_index, row_positions
+from utils.knn_graph import KNNGraph
+from utils.render_metrics import measure_render
+from utils.resilience import configure_admission
 from utils.retriever import ChromaDBRetriever
+from utils.spatial import GridIndex
+from utils.tracing import configure_tracing
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
@@ -36,116 +55,270 @@ def parse_args():
     return parser.parse_args()
 
 
+# Per-session state that belongs to the collection being viewed
+COLLECTION_STATE = [
+    "messages",
+    "generator",
+    "highlighted_indices",
+    "highlight_active",
+    "selected_categories",
+    "selected_years",
+    "selected_topics",
+]
+
+
+def requested_collection(args, collections):
+    """Collection named by the ?collection= URL parameter, or the default."""
+    name = st.query_params.get("collection", args.collection_name)
+    if name not in collections:
+        st.warning(
+            f"Coleção '{name}' desconhecida. A mostrar '{args.collection_name}'."
+        )
+        return args.collection_name
+    return name
+
+
 # Initialize session state for chat history
 def init_session_state():
     args = st.session_state.args
     config = st.session_state.config
 
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-
-    if "retriever" not in st.session_state:
-        retriever, generator = get_retriever(args, config)
+    collections = resolve_collections(config, args.collection_name, args.db_path)
+    name = requested_collection(args, collections)
 
-        st.session_state.retriever = retriever
-        st.session_state.generator = generator
+    # Switching collections starts over: highlights and filters are rows
+    # and values of the previous corpus
+    if st.session_state.get("collection_name") != name:
+        for key in COLLECTION_STATE:
+            st.session_state.pop(key, None)
+        st.session_state.collection_name = name
 
-    if "df" not in st.session_state:
-        try:
-            client = retriever.client
+    if "messages" not in st.session_state:
+        st.session_state.messages = []
 
-            collection = client.get_collection(args.collection_name)
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
 
-            # Retrieve all documents and their embeddings
-            results = collection.get(include=["embeddings", "documents", "metadatas"])
+    if "generator" not in st.session_state:
+        st.session_state.generator = OpenAIGenerator(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            model=config.get("model", os.getenv("DEFAULT_COMPLETION_MODEL")),
+            temperature=config.get("temperature", 0.7),
+            cache_namespace=name,
+        )
 
-            # Access all embeddings
-            embeddings = results["embeddings"]
+    # Read from the cache on every full rerun, so a session never holds on
+    # to an evicted corpus for longer than one interaction
+    with st.spinner("A carregar a coleção..."):
+        corpus = get_corpus_cache().get(
+            name, lambda: load_corpus(name, collections[name], config)
+        )
+    bind_corpus(corpus)
 
-            # If you need to access the documents and metadata as well
-            documents = results["documents"]
-            result_meta = results["metadatas"]
 
-            embeddings_path = "./data/embeddings/"
+@st.cache_resource
+def init_tracing(jsonl_path, otel_endpoint):
+    """Configure the process-wide tracer once, shared by all sessions."""
+    return configure_tracing(jsonl_path=jsonl_path, otel_endpoint=otel_endpoint)
 
-            embeddings, umap_df, projections = initialize_data(
-                embeddings_path, collection, results
-            )
-            st.session_state.embeddings = embeddings
-            st.session_state.df = umap_df
-            st.session_state.umap_projection = projections
 
-        except Exception as e:
-            # print(3)
-            df = None
-            st.session_state.df = None
+@st.cache_resource
+def init_admission(max_concurrent, rate_per_s, max_queue, max_wait):
+    """Configure the process-wide upstream admission control once."""
+    return configure_admission(
+        max_concurrent=max_concurrent,
+        rate_per_s=rate_per_s,
+        max_queue=max_queue,
+        max_wait=max_wait,
+    )
 
-        embeddings, umap_df, projections = initialize_data(
-            embeddings_path, collection, results
-        )
-        st.session_state.embeddings = embeddings
-        st.session_state.df = umap_df
-        st.session_state.umap_projection = projections
 
+@st.cache_resource
+def init_corpus_cache(max_bytes, max_entries):
+    """Configure the process-wide cache of loaded corpora once."""
+    return configure_corpus_cache(max_bytes=max_bytes, max_entries=max_entries)
 
-def get_retriever(args, config):
 
-    # Initialize components
+@st.cache_resource
+def get_embedding_client(model, dimensions, batch_window_ms):
+    """
+    Embedding client shared by all sessions, so that concurrent queries
+    can be micro-batched into one request.
+    """
     embedding = OpenAIEmbedding(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        model=config.get("embedding_model", os.getenv("DEFAULT_EMBEDDING_MODEL")),
+        api_key=os.getenv("OPENAI_API_KEY"), model=model, dimensions=dimensions
     )
+    if not batch_window_ms:
+        return embedding
+    return EmbeddingBatcher(embedding, window_ms=batch_window_ms)
 
-    retriever = ChromaDBRetriever(
-        db_path=args.db_path,
-        collection_name=args.collection_name,
-        embedding=embedding,
-    )
 
-    generator = OpenAIGenerator(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        model=config.get("model", os.getenv("DEFAULT_COMPLETION_MODEL")),
-        temperature=config.get("temperature", 0.7),
+def get_retriever(name, settings, config):
+    """Retriever of one collection, with the indexes set for it."""
+    embedding = get_embedding_client(
+        config.get("embedding_model", os.getenv("DEFAULT_EMBEDDING_MODEL")),
+        config.get("embedding_dimensions"),
+        config.get("embedding_batch_window_ms", 10),
     )
 
-    return retriever, generator
-
+    return ChromaDBRetriever(
+        db_path=settings["db_path"],
+        collection_name=name,
+        embedding=embedding,
+        bm25_path=settings.get("bm25_index_path"),
+        vector_index_path=settings.get("vector_index_path"),
+        filter_index_path=settings.get("filter_index_path"),
+        hierarchy_path=settings.get("hierarchy_index_path"),
+        context_tokens=config.get("context_tokens", 1500),
+        topics_path=settings.get("topics_path"),
+    )
 
-def initialize_data(embeddings_path, collection, results):
-    """Initialize data if not already in session state."""
-    if st.session_state.df is None:
-        with st.spinner("Generating documents and embeddings..."):
 
-            umap_path = os.path.join(embeddings_path, "umap_metadata.csv")
-            umap_df = pd.read_csv(umap_path)
+def load_projection(umap_path, collection_ids):
+    """
+    Projection table with the hover text, the Chroma id → row map and
+    every row's position in collection.get() order precomputed. Sessions
+    never modify it: highlights are kept per session as row index arrays.
+    """
+    umap_df = pd.read_csv(umap_path)
+    umap_df["hover_text"] = (
+        "Fonte: "
+        + umap_df["source_name"].astype(str)
+        + "<br>"
+        + umap_df["tstamp"].astype(str)
+        + "<br>Arquivo: "
+        + umap_df["linkToArchive"].astype(str)
+        + "<br>URL: "
+        + umap_df["linkToNoFrame"].astype(str)
+    )
+    row_index = build_row_index(umap_df, collection_ids)
+    positions = row_positions(row_index, collection_ids, len(umap_df))
+    return umap_df, row_index, positions
+
+
+def load_neighbours(graph_path, row_index, n_rows, k):
+    """
+    "More like this" table from the kNN graph built by utils/knn_graph.py;
+    None when there is no graph.
+    """
+    if not graph_path or not os.path.exists(os.path.join(graph_path, "graph.json")):
+        return None
+    return NeighbourTable.from_graph(KNNGraph.load(graph_path), row_index, n_rows, k)
+
+
+def load_topic_layer(topics, row_index, umap_df):
+    """
+    Topic of every projection row and the map position of every topic
+    label; None when there are no topics.
+    """
+    if topics is None:
+        return None
+    row_topics = topics.row_topics(row_index, len(umap_df))
+    positions = topics.label_positions(
+        umap_df["x"].to_numpy(), umap_df["y"].to_numpy(), row_topics
+    )
+    return row_topics, positions
 
-            projections = umap_df[["x", "y"]].values
 
-            categs = umap_df["source_name"].unique().tolist() + ["Current Query"]
-            umap_df["_highlighted"] = False
+def load_corpus(name, settings, config):
+    """
+    Load one collection for the corpus cache: its retriever, documents,
+    projection and the indexes over them. Runs once per collection while
+    the corpus stays cached, and is shared by all sessions viewing it.
+    """
+    retriever = get_retriever(name, settings, config)
 
-            # print(umap_df.columns, categs)
+    # Embeddings are not copied: the retriever's vector index holds them
+    results = retriever.client.get_collection(name).get(
+        include=["documents", "metadatas"]
+    )
+    logger.info("Retrieved %d documents from '%s'", len(results["ids"]), name)
+
+    umap_path = os.path.join(settings["embeddings_path"], "umap_metadata.csv")
+    umap_df, row_index, positions = load_projection(umap_path, results["ids"])
+
+    return Corpus(
+        name,
+        retriever,
+        results["documents"],
+        results["metadatas"],
+        umap_df,
+        row_index,
+        positions,
+        spatial=GridIndex.build(umap_df["x"].to_numpy(), umap_df["y"].to_numpy()),
+        neighbours=load_neighbours(
+            settings.get("knn_graph_path"),
+            row_index,
+            len(umap_df),
+            config.get("similar_top_k", 5),
+        ),
+        topic_layer=load_topic_layer(retriever.topics, row_index, umap_df),
+    )
 
-            # print("-------------------------------")
 
-            # Retrieve all documents and their embeddings
-            results = collection.get(include=["embeddings", "documents", "metadatas"])
-            # Access all embeddings
-            embeddings = results["embeddings"]
+def bind_corpus(corpus):
+    """Point the session at a loaded corpus, where the columns read it."""
+    st.session_state.retriever = corpus.retriever
+    st.session_state.df = corpus.umap_df
+    # Embeddings stay in Chroma unless the retriever has a local vector index
+    if corpus.retriever.vector_index is not None:
+        st.session_state.embeddings = corpus.retriever.vector_index
+    else:
+        st.session_state.pop("embeddings", None)
+    st.session_state.umap_projection = corpus.umap_df[["x", "y"]].values
+    st.session_state.documents = corpus.documents
+    st.session_state.metadata = corpus.metadata
+    st.session_state.row_index = corpus.row_index
+    st.session_state.row_positions = corpus.row_positions
+    st.session_state.spatial = corpus.spatial
+    st.session_state.neighbours = corpus.neighbours
+    st.session_state.topics = corpus.retriever.topics
+    st.session_state.topic_layer = corpus.topic_layer
+
+
+def admin_requested():
+    """
+    Whether the URL opens the admin view, ?admin=<ADMIN_TOKEN>. Without
+    the ADMIN_TOKEN secret the view is disabled.
+    """
+    token = os.getenv("ADMIN_TOKEN")
+    given = st.query_params.get("admin")
+    return bool(token) and given is not None and hmac.compare_digest(given, token)
+
+
+def init_process(config):
+    """Configure the tracer, admission control and corpus cache of the process."""
+    init_tracing(config.get("trace_jsonl_path"), config.get("otel_endpoint"))
+    init_admission(
+        config.get("upstream_max_concurrent", 16),
+        config.get("upstream_rate_per_s", 20),
+        config.get("upstream_max_queue", 64),
+        config.get("upstream_max_wait_s", 10),
+    )
+    init_corpus_cache(
+        config.get("corpus_cache_bytes", 4_000_000_000),
+        config.get("corpus_cache_entries", 4),
+    )
 
-            # embeddings, df, projections = initialize_data()
 
-            # Print information about the embeddings
-            print(f"Retrieved {len(embeddings)} embeddings")
-            print(f"Dimension of embeddings: {embeddings.shape}")
-            # st.session_state.embeddings = embeddings
-            st.session_state.documents = results["documents"]
-            st.session_state.metadata = results["metadatas"]
+def main():
+    if admin_requested():
+        # Not a render span: the admin view is not part of the exhibit
+        st.set_page_config(
+            page_title="Admin",
+            page_icon="./app/assets/flower_square.png",
+            layout="wide",
+        )
+        init_process(load_config())
+        render_admin()
+        return
 
-            return embeddings, umap_df, projections
+    # Full reruns; the chat and visualization columns also rerun on their own
+    with measure_render("render_app"):
+        render_app()
 
 
-def main():
+def render_app():
     # Get the parent directory
     parent_directory = os.path.abspath(os.path.join(os.getcwd(), os.pardir))
 
@@ -179,6 +352,8 @@ def main():
     st.session_state.config = config
     st.session_state.args = args
 
+    init_process(config)
+
     # Initialize session state
     init_session_state()
     # print(11)
@@ -195,7 +370,7 @@ def main():
         with col2:
             # Initialize session state variables if they don't exist
             if "highlighted_indices" not in st.session_state:
-                st.session_state.highlighted_indices = []
+                st.session_state.highlighted_indices = np.empty(0, dtype=np.int64)
             if "highlight_active" not in st.session_state:
                 st.session_state.highlight_active = False
 
@@ -0,0 +1,253 @@
+import argparse
+import gzip
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+# Stored once per page, keyed by parent_id
+PARENT_COLUMNS = [
+    "parent_id",
+    "source",
+    "parent_title",
+    "parent_originalURL",
+    "parent_linkToArchive",
+    "parent_linkToNoFrame",
+    "parent_tstamp",
+    "parent_linkToScreenshot",
+]
+# Stored once per child
+CHILD_COLUMNS = ["parent_id", "child_id", "link", "text"]
+# Keys of a JsonDataProcessor entry, in order
+ENTRY_COLUMNS = [
+    "source",
+    "link",
+    "text",
+    "child_id",
+    "parent_id",
+    "parent_title",
+    "parent_originalURL",
+    "parent_linkToArchive",
+    "parent_linkToNoFrame",
+    "parent_tstamp",
+    "parent_linkToScreenshot",
+]
+
+FORMATS = ("json", "parquet", "jsonl")
+# File suffix of the children and parents tables of the columnar formats
+TABLE_SUFFIXES = {"parquet": "parquet", "jsonl": "jsonl.gz"}
+
+
+def split_entries(
+    entries: List[Dict[str, Any]],
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Split JsonDataProcessor entries into a child table and a parent table.
+
+    Args:
+        entries (List[Dict[str, Any]]): Output of JsonDataProcessor.process_file
+
+    Returns:
+        Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]: Child rows and one
+            row per parent
+    """
+    children, parents = [], {}
+    for entry in entries:
+        children.append({column: entry[column] for column in CHILD_COLUMNS})
+        if entry["parent_id"] not in parents:
+            parents[entry["parent_id"]] = {
+                column: entry[column] for column in PARENT_COLUMNS
+            }
+    return children, list(parents.values())
+
+
+def output_paths(output_dir: str, base_name: str, fmt: str) -> Dict[str, str]:
+    """
+    Files written for a processed input file.
+
+    Args:
+        output_dir (str): Output directory
+        base_name (str): Input file name without extension
+        fmt (str): "json", "parquet" or "jsonl"
+
+    Returns:
+        Dict[str, str]: Path of every table ("entries" for json, "children"
+            and "parents" otherwise)
+    """
+    stem = os.path.join(output_dir, f"processed_{base_name}")
+    if fmt == "json":
+        return {"entries": f"{stem}.json"}
+    suffix = TABLE_SUFFIXES[fmt]
+    return {table: f"{stem}.{table}.{suffix}" for table in ("children", "parents")}
+
+
+def parents_path(children_path: str) -> str:
+    """
+    Parents table written next to a children table by write_corpus.
+
+    Args:
+        children_path (str): processed_<name>.children.<suffix>
+
+    Returns:
+        str: processed_<name>.parents.<suffix> in the same directory
+    """
+    directory, name = os.path.split(children_path)
+    for suffix in TABLE_SUFFIXES.values():
+        children_name = f".children.{suffix}"
+        if name.endswith(children_name):
+            stem = name[: -len(children_name)]
+            return os.path.join(directory, f"{stem}.parents.{suffix}")
+    raise ValueError(f"Not a children table: {children_path}")
+
+
+def _write_table(rows: List[Dict[str, Any]], columns: List[str], path: str) -> None:
+    if path.endswith(".parquet"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = (
+            pa.Table.from_pylist(rows)
+            if rows
+            else pa.table({column: pa.array([], pa.string()) for column in columns})
+        )
+        pq.write_table(table, path, compression="zstd")
+        return
+
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False))
+            f.write("\n")
+
+
+def write_corpus(
+    entries: List[Dict[str, Any]], output_dir: str, base_name: str, fmt: str
+) -> Dict[str, str]:
+    """
+    Write processed entries in one of the output formats.
+
+    Args:
+        entries (List[Dict[str, Any]]): Output of JsonDataProcessor.process_file
+        output_dir (str): Output directory
+        base_name (str): Input file name without extension
+        fmt (str): "json" (one object per child, as before), "parquet"
+            (zstd) or "jsonl" (gzip); the last two keep parents in a
+            separate table
+
+    Returns:
+        Dict[str, str]: Paths written
+    """
+    paths = output_paths(output_dir, base_name, fmt)
+    if fmt == "json":
+        with open(paths["entries"], "w", encoding="utf-8") as f:
+            json.dump(entries, f, ensure_ascii=False, indent=2)
+        return paths
+
+    children, parents = split_entries(entries)
+    _write_table(children, CHILD_COLUMNS, paths["children"])
+    _write_table(parents, PARENT_COLUMNS, paths["parents"])
+    return paths
+
+
+def _read_table(path: str, columns: List[str]) -> pd.DataFrame:
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+
+        return pq.read_table(path, columns=columns).to_pandas()
+
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    return pd.DataFrame(rows, columns=columns)
+
+
+def read_corpus(path: str, columns: Optional[Sequence[str]] = None) -> pd.DataFrame:
+    """
+    Load processed entries, reading only the requested columns.
+
+    Args:
+        path (str): A processed_*.json file, or the children table of the
+            other formats (its parents table is found next to it)
+        columns (Optional[Sequence[str]], optional): Entry columns to load,
+            e.g. ["text", "parent_title"]. Defaults to all of them.
+
+    Returns:
+        pd.DataFrame: One row per child, in file order
+    """
+    columns = list(columns or ENTRY_COLUMNS)
+
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return pd.DataFrame(json.load(f), columns=columns)
+
+    child_columns = [c for c in CHILD_COLUMNS if c in columns]
+    parent_columns = [c for c in PARENT_COLUMNS if c in columns and c != "parent_id"]
+    if parent_columns and "parent_id" not in child_columns:
+        child_columns.append("parent_id")
+
+    children = _read_table(path, child_columns)
+    if parent_columns:
+        parents = _read_table(parents_path(path), ["parent_id"] + parent_columns)
+        children = children.merge(parents, on="parent_id", how="left")
+    return children[columns]
+
+
+def benchmark(entries: List[Dict[str, Any]], columns: Sequence[str]) -> Dict[str, Any]:
+    """
+    Size on disk and load time of every output format.
+
+    Args:
+        entries (List[Dict[str, Any]]): Processed entries
+        columns (Sequence[str]): Columns of the partial load, e.g. ["text"]
+
+    Returns:
+        Dict[str, Any]: bytes, write_s, load_s and load_columns_s per format
+    """
+    report = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for fmt in FORMATS:
+            start = time.perf_counter()
+            paths = write_corpus(entries, tmp_dir, "benchmark", fmt)
+            write_s = time.perf_counter() - start
+
+            path = paths.get("entries") or paths["children"]
+            start = time.perf_counter()
+            read_corpus(path)
+            load_s = time.perf_counter() - start
+            start = time.perf_counter()
+            read_corpus(path, columns)
+            load_columns_s = time.perf_counter() - start
+
+            report[fmt] = {
+                "bytes": sum(os.path.getsize(p) for p in paths.values()),
+                "write_s": write_s,
+                "load_s": load_s,
+                "load_columns_s": load_columns_s,
+            }
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Compare the output formats of processed corpora"
+    )
+    parser.add_argument("path", help="A processed_*.json file")
+    parser.add_argument(
+        "--columns",
+        nargs="+",
+        default=["text", "parent_title"],
+        help="Columns of the partial load",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    with open(args.path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    print(json.dumps(benchmark(entries, args.columns), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,504 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.resilience import RetryPolicy
+
+ARQUIVO_URL = "https://arquivo.pt"
+
+# Page fields JsonDataProcessor.process_file reads, besides children
+PAGE_FIELDS = [
+    "tstamp",
+    "title",
+    "originalURL",
+    "linkToArchive",
+    "linkToNoFrame",
+    "linkToScreenshot",
+]
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class FetchError(Exception):
+    """A request still failed after all retries."""
+
+
+class HostRateLimiter:
+    """
+    Spaces out the requests sent to each host, shared by all the tasks of
+    an event loop. A 429 pauses the host for its Retry-After.
+    """
+
+    def __init__(self, rate_per_s: float):
+        """
+        Initialize the limiter.
+
+        Args:
+            rate_per_s (float): Requests per second per host; 0 disables the limit
+        """
+        self.interval = 1.0 / rate_per_s if rate_per_s > 0 else 0.0
+        self._next: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def wait(self, host: str) -> None:
+        """Sleep until the host may receive another request."""
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            now = asyncio.get_running_loop().time()
+            start = max(now, self._next.get(host, now))
+            self._next[host] = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+    def pause(self, host: str, seconds: float) -> None:
+        """Send nothing to the host for the next seconds."""
+        resume = asyncio.get_running_loop().time() + seconds
+        self._next[host] = max(self._next.get(host, resume), resume)
+
+
+class ResponseCache:
+    """
+    Bodies of earlier responses with their ETag / Last-Modified, so a
+    refresh sends conditional requests and unchanged pages cost a 304.
+    """
+
+    def __init__(self, cache_dir: Optional[str]):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir (Optional[str]): Directory of the cache; None disables it
+        """
+        self.cache_dir = cache_dir
+        self.index: Dict[str, Dict[str, str]] = {}
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            index_path = os.path.join(cache_dir, "index.json")
+            if os.path.exists(index_path):
+                with open(index_path, "r", encoding="utf-8") as f:
+                    self.index = json.load(f)
+
+    def validators(self, url: str) -> Dict[str, str]:
+        """Conditional request headers for a cached URL."""
+        entry = self.index.get(url, {})
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def load(self, url: str) -> Optional[bytes]:
+        entry = self.index.get(url)
+        if not entry:
+            return None
+        with open(os.path.join(self.cache_dir, entry["file"]), "rb") as f:
+            return f.read()
+
+    def store(self, url: str, response: httpx.Response) -> None:
+        etag = response.headers.get("etag")
+        last_modified = response.headers.get("last-modified")
+        if not self.cache_dir or not (etag or last_modified):
+            return
+        filename = hashlib.sha1(url.encode("utf-8")).hexdigest()
+        with open(os.path.join(self.cache_dir, filename), "wb") as f:
+            f.write(response.content)
+        self.index[url] = {
+            "file": filename,
+            "etag": etag or "",
+            "last_modified": last_modified or "",
+        }
+
+    def save(self) -> None:
+        if self.cache_dir:
+            _write_json(os.path.join(self.cache_dir, "index.json"), self.index)
+
+
+def _write_json(path: str, data: Any) -> None:
+    """Write JSON atomically, so an interrupted run leaves the old file."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def split_paragraphs(text: str, min_chars: int = 20) -> List[str]:
+    """
+    Split extracted page text into the paragraphs stored as children.
+
+    Args:
+        text (str): Text of the page, one block per line
+        min_chars (int, optional): Shorter lines (menus, captions) are dropped.
+            Defaults to 20.
+
+    Returns:
+        List[str]: Paragraphs
+    """
+    lines = (" ".join(line.split()) for line in text.splitlines())
+    return [line for line in lines if len(line) >= min_chars]
+
+
+class ArquivoFetcher:
+    """
+    Fetches pages from the Arquivo.pt TextSearch and CDX APIs into the
+    {tstamp: {title, linkToArchive, ..., children}} files under data/res.
+    """
+
+    def __init__(
+        self,
+        base_url: str = ARQUIVO_URL,
+        concurrency: int = 4,
+        rate_per_s: float = 2.0,
+        retry_policy: Optional[RetryPolicy] = None,
+        cache_dir: Optional[str] = None,
+        timeout: float = 30.0,
+        min_chars: int = 20,
+    ):
+        """
+        Initialize the fetcher.
+
+        Args:
+            base_url (str, optional): Arquivo.pt, or a server replaying it.
+                Links to arquivo.pt in responses are rewritten to it.
+            concurrency (int, optional): Requests in flight. Defaults to 4.
+            rate_per_s (float, optional): Requests per second per host. Defaults to 2.0.
+            retry_policy (Optional[RetryPolicy], optional): Backoff for 429,
+                5xx and connection errors. Defaults to 5 attempts.
+            cache_dir (Optional[str], optional): Response cache for conditional
+                requests. Defaults to None.
+            timeout (float, optional): Request timeout in seconds. Defaults to 30.0.
+            min_chars (int, optional): Shortest paragraph kept. Defaults to 20.
+        """
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.limiter = HostRateLimiter(rate_per_s)
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=5, max_delay=30.0)
+        self.cache = ResponseCache(cache_dir)
+        self.timeout = timeout
+        self.min_chars = min_chars
+        self.stats = {"requests": 0, "not_modified": 0, "retries": 0, "failed": 0}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> "ArquivoFetcher":
+        self._client = httpx.AsyncClient(timeout=self.timeout, follow_redirects=True)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self._client.aclose()
+        self.cache.save()
+
+    def _rebase(self, url: str) -> str:
+        if url.startswith(ARQUIVO_URL):
+            return self.base_url + url[len(ARQUIVO_URL) :]
+        return url
+
+    async def get(self, url: str, params: Optional[Dict[str, Any]] = None) -> bytes:
+        """
+        GET a URL within the concurrency and per-host rate limits, retrying
+        throttled and failed requests and revalidating cached responses.
+
+        Args:
+            url (str): URL, possibly pointing at arquivo.pt
+            params (Optional[Dict[str, Any]], optional): Query parameters
+
+        Returns:
+            bytes: Response body
+
+        Raises:
+            FetchError: The request failed on every attempt
+        """
+        url = str(httpx.URL(self._rebase(url)).copy_merge_params(params or {}))
+        host = urlsplit(url).netloc
+
+        for attempt in range(1, self.retry_policy.max_attempts + 1):
+            try:
+                async with self._semaphore:
+                    # Take a rate slot only once a connection is free: slots
+                    # taken while queued would have passed by then, and the
+                    # queued requests would go out back to back
+                    await self.limiter.wait(host)
+                    self.stats["requests"] += 1
+                    response = await self._client.get(
+                        url, headers=self.cache.validators(url)
+                    )
+                if response.status_code == 304:
+                    self.stats["not_modified"] += 1
+                    return self.cache.load(url)
+                if response.status_code in RETRY_STATUSES:
+                    response.raise_for_status()
+                if response.status_code >= 400:
+                    raise FetchError(f"GET {url} returned {response.status_code}")
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                if attempt == self.retry_policy.max_attempts:
+                    self.stats["failed"] += 1
+                    raise FetchError(f"GET {url} failed: {e}") from e
+                delay = self.retry_policy.delay(attempt, e)
+                if getattr(e, "response", None) is not None:
+                    if e.response.status_code == 429:
+                        self.limiter.pause(host, delay)
+                self.stats["retries"] += 1
+                await asyncio.sleep(delay)
+                continue
+
+            self.cache.store(url, response)
+            return response.content
+
+        raise FetchError(f"GET {url} failed")
+
+    async def search(
+        self,
+        query: str,
+        site: Optional[str] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        max_items: int = 500,
+        page_size: int = 50,
+    ) -> List[Dict[str, Any]]:
+        """
+        Archived pages matching a full-text query (TextSearch API).
+
+        Args:
+            query (str): Search terms
+            site (Optional[str], optional): Restrict to a site, e.g. "publico.pt"
+            start (Optional[str], optional): Earliest capture, e.g. "1996"
+            end (Optional[str], optional): Latest capture, e.g. "2024"
+            max_items (int, optional): Most results returned. Defaults to 500.
+            page_size (int, optional): Results per request. Defaults to 50.
+
+        Returns:
+            List[Dict[str, Any]]: response_items of the API
+        """
+        params = {"q": query, "maxItems": page_size, "prettyPrint": "false"}
+        if site:
+            params["siteSearch"] = site
+        if start:
+            params["from"] = start
+        if end:
+            params["to"] = end
+
+        items = []
+        url: Optional[str] = f"{self.base_url}/textsearch"
+        while url and len(items) < max_items:
+            body = json.loads(await self.get(url, params))
+            page = body.get("response_items") or []
+            items.extend(page)
+            # next_page carries every parameter
+            url, params = (body.get("next_page") if page else None), None
+        return items[:max_items]
+
+    async def captures(
+        self, url: str, start: Optional[str] = None, end: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Archived captures of one URL (CDX API) as TextSearch items, one per
+        distinct content digest.
+
+        Args:
+            url (str): Original URL, e.g. a Wikipedia article
+            start (Optional[str], optional): Earliest capture
+            end (Optional[str], optional): Latest capture
+
+        Returns:
+            List[Dict[str, Any]]: Items with the page fields and linkToExtractedText
+        """
+        params = {"url": url, "output": "json"}
+        if start:
+            params["from"] = start
+        if end:
+            params["to"] = end
+        body = await self.get(f"{self.base_url}/wayback/cdx", params)
+
+        rows, digests = [], set()
+        for line in body.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            if row.get("status", "200") != "200" or row.get("digest") in digests:
+                continue
+            digests.add(row.get("digest"))
+            rows.append(row)
+
+        metadata = await asyncio.gather(
+            *[
+                self.get(
+                    f"{self.base_url}/textsearch",
+                    {"metadata": f"{row['url']}/{row['timestamp']}"},
+                )
+                for row in rows
+            ]
+        )
+        items = []
+        for body in metadata:
+            items.extend(json.loads(body).get("response_items") or [])
+        return items
+
+    async def fetch_page(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Download the extracted text of an archived page.
+
+        Args:
+            item (Dict[str, Any]): TextSearch item
+
+        Returns:
+            Dict[str, Any]: Page in the data/res layout
+        """
+        text = (await self.get(item["linkToExtractedText"])).decode("utf-8")
+        link = item.get("linkToNoFrame") or item.get("linkToArchive", "")
+        page = {field: str(item.get(field, "")) for field in PAGE_FIELDS}
+        page["children"] = [
+            {"text": paragraph, "link": link}
+            for paragraph in split_paragraphs(text, self.min_chars)
+        ]
+        return page
+
+    async def fetch_to_file(
+        self,
+        items: List[Dict[str, Any]],
+        output_path: str,
+        refresh: bool = False,
+        checkpoint_every: int = 20,
+    ) -> Dict[str, int]:
+        """
+        Fetch pages into a data/res JSON file, resuming an interrupted run:
+        pages already in the file are skipped unless refreshing.
+
+        Args:
+            items (List[Dict[str, Any]]): TextSearch items to fetch
+            output_path (str): JSON file, e.g. data/res/publico/arquivo.json
+            refresh (bool, optional): Fetch pages already in the file again,
+                with conditional requests. Defaults to False.
+            checkpoint_every (int, optional): Pages between saves. Defaults to 20.
+
+        Returns:
+            Dict[str, int]: fetched, skipped and failed page counts
+        """
+        pages: Dict[str, Dict[str, Any]] = {}
+        if os.path.exists(output_path):
+            with open(output_path, "r", encoding="utf-8") as f:
+                pages = json.load(f)
+        os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+        keys = {page["linkToArchive"]: key for key, page in pages.items()}
+        todo = [
+            item
+            for item in {item["linkToArchive"]: item for item in items}.values()
+            if refresh or item["linkToArchive"] not in keys
+        ]
+        counts = {"fetched": 0, "skipped": len(items) - len(todo), "failed": 0}
+
+        async def fetch(item):
+            try:
+                page = await self.fetch_page(item)
+            except FetchError as e:
+                print(f"Skipping {item['linkToArchive']}: {e}")
+                counts["failed"] += 1
+                return
+
+            # Files are keyed by tstamp; a second page captured the same second
+            # gets a suffix
+            key = keys.get(page["linkToArchive"])
+            if key is None:
+                key, n = page["tstamp"], 1
+                while key in pages:
+                    key, n = f"{page['tstamp']}_{n}", n + 1
+                keys[page["linkToArchive"]] = key
+            pages[key] = page
+            counts["fetched"] += 1
+            if counts["fetched"] % checkpoint_every == 0:
+                _write_json(output_path, pages)
+                self.cache.save()
+
+        await asyncio.gather(*[fetch(item) for item in todo])
+        _write_json(output_path, dict(sorted(pages.items())))
+        return counts
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Fetch archived pages from Arquivo.pt into data/res"
+    )
+    parser.add_argument(
+        "--source",
+        type=str,
+        required=True,
+        help="Source directory under --data_dir, e.g. publico or wiki_rev",
+    )
+    parser.add_argument("--query", type=str, help="Full-text search terms")
+    parser.add_argument("--site", type=str, help="Restrict the search to a site")
+    parser.add_argument(
+        "--url", type=str, action="append", help="Fetch every capture of a URL"
+    )
+    parser.add_argument("--from", dest="start", type=str, help="e.g. 1996")
+    parser.add_argument("--to", dest="end", type=str, help="e.g. 2024")
+    parser.add_argument("--max_items", type=int, default=500)
+    parser.add_argument("--data_dir", type=str, default="./data/res")
+    parser.add_argument(
+        "--output_name",
+        type=str,
+        default="arquivo.json",
+        help="File written under <data_dir>/<source>",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default="./data/arquivo_cache",
+        help="Response cache for conditional requests",
+    )
+    parser.add_argument("--base_url", type=str, default=ARQUIVO_URL)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--rate_per_s", type=float, default=2.0)
+    parser.add_argument(
+        "--refresh", action="store_true", help="Re-fetch pages already in the file"
+    )
+    return parser.parse_args()
+
+
+async def run(args) -> None:
+    async with ArquivoFetcher(
+        base_url=args.base_url,
+        concurrency=args.concurrency,
+        rate_per_s=args.rate_per_s,
+        cache_dir=args.cache_dir,
+    ) as fetcher:
+        items = []
+        if args.query:
+            items += await fetcher.search(
+                args.query, args.site, args.start, args.end, args.max_items
+            )
+        for url in args.url or []:
+            items += await fetcher.captures(url, args.start, args.end)
+
+        output_path = os.path.join(args.data_dir, args.source, args.output_name)
+        counts = await fetcher.fetch_to_file(items, output_path, args.refresh)
+
+    print(
+        f"{len(items)} pages found: {counts['fetched']} fetched, "
+        f"{counts['skipped']} already in {output_path}, {counts['failed']} failed"
+    )
+    print(
+        f"{fetcher.stats['requests']} requests, {fetcher.stats['not_modified']} "
+        f"not modified, {fetcher.stats['retries']} retried"
+    )
+
+
+def main():
+    args = parse_args()
+    if not args.query and not args.url:
+        raise SystemExit("Pass --query and/or --url")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
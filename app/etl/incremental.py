@@ -0,0 +1,744 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import nltk
+import numpy as np
+import pandas as pd
+from nltk.tokenize import sent_tokenize
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from etl.preprocess import JsonDataProcessor
+from utils.hierarchy import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Crawl directories under data/res and their source_name (see 01_ETL.ipynb)
+SOURCE_CATEGORIES = {
+    "wiki_guerra_colonial_portuguesa": "Wikipedia PT",
+    "wiki_rev": "Wikipedia PT",
+    "wiki_estado_novo": "Wikipedia PT",
+    "publico": "Publico",
+    "50anos25abril": "Web",
+    "wiki_processo": "Wikipedia PT",
+    "wiki_constituicao": "Wikipedia PT",
+    "wiki_movimento_das_forcas_armadas": "Wikipedia PT",
+    "expresso": "Expresso",
+    "wiki_junta_de_salvacao_nacional": "Wikipedia PT",
+}
+
+# Page fields copied into the metadata map and umap_metadata.csv
+PAGE_FIELDS = [
+    "tstamp",
+    "title",
+    "originalURL",
+    "linkToArchive",
+    "linkToNoFrame",
+    "linkToScreenshot",
+]
+
+# Below the 8191-token input limit of the text-embedding-3 models
+MAX_CHUNK_TOKENS = 8000
+
+
+def normalize_text(text: str) -> str:
+    """
+    Canonical form of a chunk for change detection: Unicode NFC with
+    every run of whitespace collapsed, so re-wrapping a page is no change.
+
+    Args:
+        text (str): Chunk text
+
+    Returns:
+        str: Normalized text
+    """
+    return " ".join(unicodedata.normalize("NFC", text or "").split())
+
+
+def content_hash(text: str) -> str:
+    """
+    SHA-256 of the normalized chunk text.
+
+    Args:
+        text (str): Chunk text
+
+    Returns:
+        str: Hex digest
+    """
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def _sentences(text: str) -> List[str]:
+    try:
+        return sent_tokenize(text)
+    except LookupError:
+        # The sentence tokenizer's data is downloaded on first use
+        nltk.download("punkt_tab", quiet=True)
+        return sent_tokenize(text)
+
+
+def chunk_text(text: str, max_tokens: int = MAX_CHUNK_TOKENS) -> List[Tuple[str, int]]:
+    """
+    Split a text into chunks of whole sentences under the embedding input
+    limit, like chunk_text in 01_ETL.ipynb: sentences are accumulated while
+    the chunk stays within max_tokens cl100k_base tokens. A longer sentence
+    becomes a chunk of its own.
+
+    Args:
+        text (str): Preprocessed text
+        max_tokens (int, optional): Tokens per chunk. Defaults to 8000.
+
+    Returns:
+        List[Tuple[str, int]]: (text, token count) of every chunk
+    """
+    chunks = []
+    current, current_tokens = [], 0
+    for sentence in _sentences(text):
+        tokens = count_tokens(sentence)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append((" ".join(current), current_tokens))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        chunks.append((" ".join(current), current_tokens))
+    return chunks
+
+
+def _duplicate_key(text: str) -> str:
+    """Letters-only, accent-folded text; equal keys are duplicate chunks."""
+    text = re.sub(r"<.*?>", "", text.replace("{html}", ""))
+    text = unicodedata.normalize("NFKD", text.replace("\n", " ").replace("\r", " "))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = re.sub(r"http\S+", "", text)
+    return re.sub(r"[^A-Za-z\s]", "", text).lower().strip()
+
+
+def page_key(page: Dict[str, Any], source_name: str) -> str:
+    """Stable identity of a crawled page: its Arquivo.pt link."""
+    return page.get("linkToArchive") or (
+        f"{source_name}/{page.get('tstamp', '')}/{page.get('originalURL', '')}"
+    )
+
+
+def crawl_scope(
+    data_dir: str, source_categories: Dict[str, str] = SOURCE_CATEGORIES
+) -> Tuple[Set[str], List[str]]:
+    """
+    Sources the crawl covers, and the crawl directories it lacks.
+
+    Args:
+        data_dir (str): Directory with one subdirectory of JSON files per crawl
+        source_categories (Dict[str, str], optional): Subdirectory → source_name
+
+    Returns:
+        Tuple[Set[str], List[str]]: source_names with at least one crawl
+            directory, and the missing subdirectories
+    """
+    sources, missing = set(), []
+    for source_dir, source_name in source_categories.items():
+        if os.path.isdir(os.path.join(data_dir, source_dir)):
+            sources.add(source_name)
+        else:
+            missing.append(source_dir)
+    return sources, missing
+
+
+def read_crawl(
+    data_dir: str, source_categories: Dict[str, str] = SOURCE_CATEGORIES
+) -> Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]:
+    """
+    Parse the crawl JSON files into chunks the way the ETL notebook does,
+    dropping duplicate texts within a source (the latest capture is kept).
+
+    Args:
+        data_dir (str): Directory with one subdirectory of JSON files per crawl
+        source_categories (Dict[str, str], optional): Subdirectory → source_name
+
+    Returns:
+        Tuple[List[Dict[str, Any]], Dict[str, Dict[str, Any]]]: Chunks (text,
+            link, tstamp, page_key and a chunk_key stable across crawls) and
+            the metadata of every page, by page key
+    """
+    chunks, pages = [], {}
+
+    for source_dir, source_name in source_categories.items():
+        source_path = os.path.join(data_dir, source_dir)
+        if not os.path.isdir(source_path):
+            continue
+
+        source_chunks = []
+        for filename in sorted(os.listdir(source_path)):
+            if not filename.endswith(".json"):
+                continue
+            file_path = os.path.join(source_path, filename)
+            with open(file_path, "r", encoding="utf-8") as f:
+                crawl = json.load(f)
+
+            for tstamp, page in crawl.items():
+                key = page_key(page, source_name)
+                pages[key] = {
+                    **{field: page.get(field, "") for field in PAGE_FIELDS},
+                    "filepath": file_path,
+                    "source_name": source_name,
+                }
+                for i, child in enumerate(page.get("children") or []):
+                    text = JsonDataProcessor.preprocess_text(child.get("text", ""))
+                    for j, (chunk, _) in enumerate(chunk_text(text)):
+                        source_chunks.append(
+                            {
+                                "chunk_key": f"{key}#{i}.{j}",
+                                "page_key": key,
+                                "text": chunk,
+                                "link": child.get("link", ""),
+                                "tstamp": str(tstamp),
+                            }
+                        )
+
+        latest = {}
+        for chunk in sorted(source_chunks, key=lambda c: c["tstamp"]):
+            latest[_duplicate_key(chunk["text"])] = chunk
+        chunks.extend(
+            c for c in source_chunks if latest[_duplicate_key(c["text"])] is c
+        )
+
+    return chunks, pages
+
+
+def assign_meta_ids(
+    meta_map: Dict[str, Dict[str, Any]],
+    pages: Dict[str, Dict[str, Any]],
+    used: Set[str],
+    sources: Optional[Set[str]] = None,
+) -> Tuple[Dict[str, Dict[str, Any]], Dict[str, int], Dict[str, int]]:
+    """
+    Update the metadata map (metadata.json, keyed by m_id) with the crawled
+    pages: known pages keep their m_id, new pages get the next free one and
+    pages of the crawled sources without chunks are dropped. Pages of other
+    sources are kept as they are.
+
+    Args:
+        meta_map (Dict[str, Dict[str, Any]]): Current map
+        pages (Dict[str, Dict[str, Any]]): Crawled page metadata, by page key
+        used (Set[str]): Keys of the pages that still have chunks
+        sources (Set[str], optional): source_names the crawl covers.
+            Defaults to None (all).
+
+    Returns:
+        Tuple[Dict[str, Dict[str, Any]], Dict[str, int], Dict[str, int]]: The
+            new map, the m_id of every page key, and counts of added, updated
+            and removed pages
+    """
+    known = {
+        page_key(meta, meta.get("source_name", "")): int(m_id)
+        for m_id, meta in meta_map.items()
+    }
+    next_id = max((int(m_id) for m_id in meta_map), default=0) + 1
+
+    new_map = {
+        m_id: meta
+        for m_id, meta in meta_map.items()
+        if sources is not None and meta.get("source_name") not in sources
+    }
+    m_ids = {}
+    counts = {"added": 0, "updated": 0, "removed": 0}
+    for key, meta in pages.items():
+        if key not in used:
+            continue
+        m_id = known.get(key)
+        if m_id is None:
+            m_id, next_id = next_id, next_id + 1
+            counts["added"] += 1
+        elif meta_map[str(m_id)] != meta:
+            counts["updated"] += 1
+        new_map[str(m_id)] = meta
+        m_ids[key] = m_id
+
+    counts["removed"] = len(meta_map) - (len(new_map) - counts["added"])
+    return new_map, m_ids, counts
+
+
+def plan_changes(
+    ids: Sequence[str],
+    hashes: Sequence[str],
+    chunk_keys: Sequence[Optional[str]],
+    chunks: List[Dict[str, Any]],
+    deletable: Optional[Sequence[bool]] = None,
+) -> Dict[str, list]:
+    """
+    Match crawled chunks against the stored ones. A stored chunk with the
+    same content hash is unchanged (wherever it moved); otherwise a stored
+    chunk with the same chunk_key has changed; anything else is new, and
+    stored chunks matched by nothing have vanished. Vanished chunks are
+    deleted only if deletable, i.e. their source was crawled.
+
+    Args:
+        ids (Sequence[str]): Stored chunk ids
+        hashes (Sequence[str]): Their content hashes
+        chunk_keys (Sequence[Optional[str]]): Their chunk keys, None if unknown
+        chunks (List[Dict[str, Any]]): Crawled chunks with a content_hash
+        deletable (Sequence[bool], optional): Whether each stored chunk may be
+            deleted. Defaults to None (all).
+
+    Returns:
+        Dict[str, list]: unchanged and changed (id, chunk) pairs, added
+            chunks, deleted ids and kept ids (vanished but not deletable)
+    """
+    by_hash: Dict[str, List[str]] = {}
+    for doc_id, digest in zip(ids, hashes):
+        by_hash.setdefault(digest, []).append(doc_id)
+    by_key = {key: doc_id for doc_id, key in zip(ids, chunk_keys) if key}
+
+    claimed: Set[str] = set()
+    unchanged, pending = [], []
+    for chunk in chunks:
+        candidates = [
+            i for i in by_hash.get(chunk["content_hash"], []) if i not in claimed
+        ]
+        own = by_key.get(chunk["chunk_key"])
+        doc_id = own if own in candidates else next(iter(candidates), None)
+        if doc_id is None:
+            pending.append(chunk)
+        else:
+            claimed.add(doc_id)
+            unchanged.append((doc_id, chunk))
+
+    changed, added = [], []
+    for chunk in pending:
+        doc_id = by_key.get(chunk["chunk_key"])
+        if doc_id is not None and doc_id not in claimed:
+            claimed.add(doc_id)
+            changed.append((doc_id, chunk))
+        else:
+            added.append(chunk)
+
+    if deletable is None:
+        deletable = [True] * len(ids)
+    vanished = [
+        (doc_id, ok) for doc_id, ok in zip(ids, deletable) if doc_id not in claimed
+    ]
+    return {
+        "unchanged": unchanged,
+        "changed": changed,
+        "added": added,
+        "deleted": [doc_id for doc_id, ok in vanished if ok],
+        "kept": [doc_id for doc_id, ok in vanished if not ok],
+    }
+
+
+def _chunk_metadata(chunk: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "link": chunk["link"],
+        "m_id": chunk["m_id"],
+        "content_hash": chunk["content_hash"],
+        "chunk_key": chunk["chunk_key"],
+    }
+
+
+def apply_plan(
+    collection, plan: Dict[str, list], embedding, batch_size: int = 100
+) -> Tuple[Dict[str, List[float]], int]:
+    """
+    Write a plan to the collection: embed and upsert changed and new
+    chunks, rewrite the metadata of unchanged chunks where it differs
+    (no embedding needed) and delete vanished chunks.
+
+    Args:
+        collection: ChromaDB collection
+        plan (Dict[str, list]): Result of plan_changes(); new chunks are
+            given an "id"
+        embedding: Embedding client with get_embeddings()
+        batch_size (int, optional): Chunks embedded per request. Defaults to 100.
+
+    Returns:
+        Tuple[Dict[str, List[float]], int]: New embeddings by id, and the
+            number of chunks whose metadata was rewritten
+    """
+    stored = {}
+    unchanged_ids = [doc_id for doc_id, _ in plan["unchanged"]]
+    for start in range(0, len(unchanged_ids), 1000):
+        batch = collection.get(
+            ids=unchanged_ids[start : start + 1000], include=["metadatas"]
+        )
+        stored.update(zip(batch["ids"], batch["metadatas"]))
+
+    relabelled = [
+        (doc_id, _chunk_metadata(chunk))
+        for doc_id, chunk in plan["unchanged"]
+        if (stored.get(doc_id) or {}) != _chunk_metadata(chunk)
+    ]
+    for start in range(0, len(relabelled), 1000):
+        batch = relabelled[start : start + 1000]
+        collection.update(
+            ids=[doc_id for doc_id, _ in batch],
+            metadatas=[metadata for _, metadata in batch],
+        )
+
+    to_embed = plan["changed"] + [(chunk["id"], chunk) for chunk in plan["added"]]
+    embeddings = {}
+    for start in range(0, len(to_embed), batch_size):
+        batch = to_embed[start : start + batch_size]
+        vectors = embedding.get_embeddings([chunk["text"] for _, chunk in batch])
+        collection.upsert(
+            ids=[doc_id for doc_id, _ in batch],
+            documents=[chunk["text"] for _, chunk in batch],
+            embeddings=vectors,
+            metadatas=[_chunk_metadata(chunk) for _, chunk in batch],
+        )
+        embeddings.update((doc_id, v) for (doc_id, _), v in zip(batch, vectors))
+
+    if plan["deleted"]:
+        collection.delete(ids=plan["deleted"])
+
+    return embeddings, len(relabelled)
+
+
+def _nearest_rows(
+    collection, anchor_ids: List[str], queries: np.ndarray, k: int, batch_size: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """k nearest anchors of every query, streaming anchor embeddings in batches."""
+    best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+    best_dists = np.zeros((len(queries), 0))
+    query_norms = (queries**2).sum(axis=1)[:, None]
+
+    for start in range(0, len(anchor_ids), batch_size):
+        batch = collection.get(
+            ids=anchor_ids[start : start + batch_size], include=["embeddings"]
+        )
+        # get() does not keep the requested order
+        order = {doc_id: row for row, doc_id in enumerate(batch["ids"])}
+        rows = np.array([order[i] for i in anchor_ids[start : start + batch_size]])
+        vectors = np.asarray(batch["embeddings"], dtype=np.float32)[rows]
+
+        dists = query_norms - 2 * queries @ vectors.T + (vectors**2).sum(axis=1)
+        batch_rows = np.broadcast_to(np.arange(start, start + len(rows)), dists.shape)
+        best_rows = np.hstack([best_rows, batch_rows])
+        best_dists = np.hstack([best_dists, dists])
+        if best_dists.shape[1] > k:
+            keep = np.argpartition(best_dists, k - 1, axis=1)[:, :k]
+            best_rows = np.take_along_axis(best_rows, keep, axis=1)
+            best_dists = np.take_along_axis(best_dists, keep, axis=1)
+
+    return best_rows, np.maximum(best_dists, 0)
+
+
+def update_projection(
+    umap_df: pd.DataFrame,
+    collection,
+    previous_ids: List[str],
+    meta_map: Dict[str, Dict[str, Any]],
+    plan: Dict[str, list],
+    embeddings: Dict[str, List[float]],
+    neighbours: int = 5,
+    batch_size: int = 1000,
+) -> pd.DataFrame:
+    """
+    Update umap_metadata.csv without refitting UMAP: rows of vanished and
+    changed chunks are dropped, and new or changed chunks are placed at
+    the distance-weighted mean position of their nearest projected
+    neighbours in embedding space. Refit from scratch now and then.
+
+    Args:
+        umap_df (pd.DataFrame): Current projection table
+        collection: ChromaDB collection, already updated
+        previous_ids (List[str]): Chunk ids in collection.get() order before
+            the update, which the table's index column refers to
+        meta_map (Dict[str, Dict[str, Any]]): Updated metadata map
+        plan (Dict[str, list]): The applied plan
+        embeddings (Dict[str, List[float]]): Embeddings of the upserted chunks
+        neighbours (int, optional): Neighbours averaged per new point. Defaults to 5.
+        batch_size (int, optional): Anchor embeddings fetched per request.
+
+    Returns:
+        pd.DataFrame: Updated table, with a chunk_id column
+    """
+    df = umap_df.copy()
+    if "chunk_id" not in df.columns:
+        df["chunk_id"] = df["index"].map(dict(enumerate(previous_ids)))
+
+    collection_rows = {
+        doc_id: i for i, doc_id in enumerate(collection.get(include=[])["ids"])
+    }
+    moved = df["chunk_id"].isin(
+        {doc_id for doc_id, _ in plan["changed"]} | set(plan["deleted"])
+    )
+    # Rows of chunks missing before this update, e.g. from an older table
+    stale = ~moved & ~df["chunk_id"].isin(collection_rows.keys())
+    if stale.any():
+        logger.warning(
+            "Dropping %d projection rows of chunks the collection does not have",
+            int(stale.sum()),
+        )
+    df = df[~moved & ~stale]
+
+    placed = plan["changed"] + [(chunk["id"], chunk) for chunk in plan["added"]]
+    if placed and len(df):
+        queries = np.asarray(
+            [embeddings[doc_id] for doc_id, _ in placed], dtype=np.float32
+        )
+        rows, dists = _nearest_rows(
+            collection, df["chunk_id"].tolist(), queries, neighbours, batch_size
+        )
+        weights = 1.0 / (np.sqrt(dists) + 1e-6)
+        weights /= weights.sum(axis=1, keepdims=True)
+        xy = df[["x", "y"]].to_numpy()
+        positions = np.einsum("qk,qkd->qd", weights, xy[rows])
+
+        new_rows = pd.DataFrame(
+            {
+                "chunk_id": [doc_id for doc_id, _ in placed],
+                "x": positions[:, 0],
+                "y": positions[:, 1],
+            }
+        )
+        df = pd.concat([df, new_rows], ignore_index=True)
+
+    m_ids = {doc_id: chunk["m_id"] for doc_id, chunk in plan["unchanged"] + placed}
+    meta_ids = df["chunk_id"].map(m_ids)
+    if "meta_id" in df.columns:
+        # Chunks of sources outside the crawl keep their page
+        meta_ids = meta_ids.fillna(df["meta_id"])
+    df["meta_id"] = meta_ids
+
+    # Rows whose page is not in the metadata map
+    known = (
+        df["meta_id"]
+        .map(lambda m_id: pd.notna(m_id) and str(int(m_id)) in meta_map)
+        .astype(bool)
+    )
+    if not known.all():
+        logger.warning(
+            "Dropping %d projection rows without a page in the metadata map",
+            int((~known).sum()),
+        )
+    df = df[known].copy()
+    df["meta_id"] = df["meta_id"].astype(int)
+    df["index"] = df["chunk_id"].map(collection_rows).astype(int)
+    for field in PAGE_FIELDS + ["filepath", "source_name"]:
+        df[field] = df["meta_id"].map(lambda m_id: meta_map[str(m_id)][field])
+
+    return df.reset_index(drop=True)
+
+
+def ingest(
+    data_dir: str,
+    collection,
+    embedding,
+    embeddings_path: str,
+    source_categories: Dict[str, str] = SOURCE_CATEGORIES,
+    batch_size: int = 100,
+    dry_run: bool = False,
+    allow_deletions: bool = False,
+) -> Dict[str, int]:
+    """
+    Bring a collection, metadata.json and umap_metadata.csv up to date with
+    a re-crawl, embedding only new or changed chunks. Only chunks of the
+    sources in the crawl can be deleted.
+
+    Args:
+        data_dir (str): Crawl directory (see read_crawl)
+        collection: ChromaDB collection
+        embedding: Embedding client with get_embeddings()
+        embeddings_path (str): Directory of metadata.json and umap_metadata.csv
+        source_categories (Dict[str, str], optional): Subdirectory → source_name
+        batch_size (int, optional): Chunks embedded per request. Defaults to 100.
+        dry_run (bool, optional): Only report what would change. Defaults to False.
+        allow_deletions (bool, optional): Proceed when the crawl is empty or
+            lacks source directories, deleting the chunks of crawled sources
+            it no longer has. Defaults to False.
+
+    Returns:
+        Dict[str, int]: What changed
+
+    Raises:
+        ValueError: The crawl is empty or incomplete and deletions are not allowed
+    """
+    sources, missing = crawl_scope(data_dir, source_categories)
+    chunks, pages = read_crawl(data_dir, source_categories)
+    if not allow_deletions and (missing or not chunks):
+        problem = f"missing {', '.join(missing)}" if missing else "no chunks were read"
+        raise ValueError(
+            f"Incomplete crawl in {data_dir} ({problem}). Ingesting it would "
+            "delete stored chunks; rerun with --allow-deletions to do so anyway."
+        )
+
+    meta_path = os.path.join(embeddings_path, "metadata.json")
+    meta_map = {}
+    if os.path.exists(meta_path):
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta_map = json.load(f)
+
+    stored = collection.get(include=["documents", "metadatas"])
+    metadatas = [m or {} for m in stored["metadatas"]]
+    # A stored chunk's source is that of its page in the current map
+    stored_sources = [
+        meta_map.get(str(m.get("m_id")), {}).get("source_name") for m in metadatas
+    ]
+
+    meta_map, m_ids, page_counts = assign_meta_ids(
+        meta_map, pages, {chunk["page_key"] for chunk in chunks}, sources
+    )
+    for chunk in chunks:
+        chunk["m_id"] = m_ids[chunk["page_key"]]
+        chunk["content_hash"] = content_hash(chunk["text"])
+
+    plan = plan_changes(
+        stored["ids"],
+        [
+            m.get("content_hash") or content_hash(doc)
+            for doc, m in zip(stored["documents"], metadatas)
+        ],
+        [m.get("chunk_key") for m in metadatas],
+        chunks,
+        [source in sources for source in stored_sources],
+    )
+
+    report = {
+        "chunks": len(chunks),
+        "unchanged": len(plan["unchanged"]),
+        "changed": len(plan["changed"]),
+        "added": len(plan["added"]),
+        "deleted": len(plan["deleted"]),
+        "kept": len(plan["kept"]),
+        "pages_added": page_counts["added"],
+        "pages_updated": page_counts["updated"],
+        "pages_removed": page_counts["removed"],
+    }
+    if dry_run:
+        return report
+
+    suffixes = [
+        int(i.rsplit("_", 1)[-1]) for i in stored["ids"] if re.fullmatch(r"doc_\d+", i)
+    ]
+    next_id = max(suffixes, default=-1) + 1
+    for offset, chunk in enumerate(plan["added"]):
+        chunk["id"] = f"doc_{next_id + offset}"
+
+    embeddings, report["relabelled"] = apply_plan(
+        collection, plan, embedding, batch_size
+    )
+    report["embedded"] = len(embeddings)
+
+    os.makedirs(embeddings_path, exist_ok=True)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta_map, f, indent=2, ensure_ascii=False)
+
+    umap_path = os.path.join(embeddings_path, "umap_metadata.csv")
+    if os.path.exists(umap_path):
+        umap_df = update_projection(
+            pd.read_csv(umap_path),
+            collection,
+            stored["ids"],
+            meta_map,
+            plan,
+            embeddings,
+        )
+        umap_df.to_csv(umap_path, index=False)
+
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Re-ingest a crawl, embedding only new or changed chunks"
+    )
+    parser.add_argument(
+        "--data_dir",
+        type=str,
+        default="./data/res",
+        help="Directory with one subdirectory of crawl JSON files per source",
+    )
+    parser.add_argument(
+        "--db_path",
+        type=str,
+        default="./data/chroma_cravo",
+        help="Path to ChromaDB directory",
+    )
+    parser.add_argument(
+        "--collection_name",
+        type=str,
+        default="cravo",
+        help="Name of the ChromaDB collection",
+    )
+    parser.add_argument(
+        "--embeddings_path",
+        type=str,
+        default="./data/embeddings",
+        help="Directory of metadata.json and umap_metadata.csv",
+    )
+    parser.add_argument("--batch_size", type=int, default=100)
+    parser.add_argument(
+        "--dry_run", action="store_true", help="Only report what would change"
+    )
+    parser.add_argument(
+        "--allow-deletions",
+        action="store_true",
+        help="Ingest an empty crawl or one missing source directories, "
+        "deleting the stored chunks it no longer has",
+    )
+    return parser.parse_args()
+
+
+def main():
+    import chromadb
+    from chromadb.config import Settings
+    from dotenv import load_dotenv
+    from utils.embeddings import OpenAIEmbedding
+
+    load_dotenv()
+    args = parse_args()
+
+    client = chromadb.PersistentClient(
+        path=args.db_path, settings=Settings(anonymized_telemetry=False)
+    )
+    embedding = OpenAIEmbedding(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model=os.getenv("DEFAULT_EMBEDDING_MODEL", "text-embedding-3-small"),
+    )
+
+    try:
+        report = ingest(
+            args.data_dir,
+            client.get_or_create_collection(args.collection_name),
+            embedding,
+            args.embeddings_path,
+            batch_size=args.batch_size,
+            dry_run=args.dry_run,
+            allow_deletions=args.allow_deletions,
+        )
+    except ValueError as e:
+        sys.exit(str(e))
+
+    print(
+        f"{report['chunks']} chunks: {report['unchanged']} unchanged, "
+        f"{report['changed']} changed, {report['added']} added, "
+        f"{report['deleted']} deleted, {report['kept']} kept from sources "
+        "outside the crawl"
+    )
+    print(
+        f"Pages: {report['pages_added']} added, {report['pages_updated']} updated, "
+        f"{report['pages_removed']} removed"
+    )
+    if args.dry_run:
+        return
+
+    print(
+        f"Embedded {report['embedded']} chunks; rewrote the metadata of "
+        f"{report['relabelled']} unchanged chunks"
+    )
+    print(
+        "Rebuild the BM25, filter and vector indexes (and the hierarchy "
+        "index, if used) to pick up the changes"
+    )
+
+
+if __name__ == "__main__":
+    main()
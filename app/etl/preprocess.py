@@ -1,8 +1,15 @@
 import json
 import os
 import re
+import sys
 from typing import Any, Dict, List, Optional
 
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from etl.corpus_io import FORMATS, output_paths, write_corpus
+from etl.extract import extract_text, is_html
+
 
 class JsonDataProcessor:
     """
@@ -10,7 +17,12 @@ class JsonDataProcessor:
     Handles either a single file or all JSON files in a directory.
     """
 
-    def __init__(self, input_path: str, output_dir: Optional[str] = None):
+    def __init__(
+        self,
+        input_path: str,
+        output_dir: Optional[str] = None,
+        output_format: str = "json",
+    ):
         """
         Initialize the processor with input and output paths.
 
@@ -18,8 +30,14 @@ class JsonDataProcessor:
             input_path (str): Path to either a JSON file or a directory containing JSON files
             output_dir (str, optional): Directory to save output files. If None,
                                         uses the same directory as the input.
+            output_format (str, optional): "json" (one object per child),
+                                        "parquet" or "jsonl"; see etl/corpus_io.py.
+                                        Defaults to "json".
         """
+        if output_format not in FORMATS:
+            raise ValueError(f"Unknown output format: {output_format}")
         self.input_path = input_path
+        self.output_format = output_format
 
         # Set default output directory if not provided
         if output_dir is None:
@@ -61,10 +79,12 @@ class JsonDataProcessor:
         else:
             print(f"Error: {self.input_path} is not a valid JSON file or directory")
 
-    def preprocess_text(self, text: str) -> str:
+    @staticmethod
+    def preprocess_text(text: str) -> str:
         """
-        Preprocess text by removing HTML tags, normalizing line breaks,
-        and cleaning up whitespace.
+        Preprocess text by extracting the text of HTML (without scripts,
+        navigation and other boilerplate), normalizing line breaks, and
+        cleaning up whitespace.
 
         Args:
             text (str): Raw text from the JSON file
@@ -75,8 +95,10 @@ class JsonDataProcessor:
         if not text:
             return ""
 
-        # Remove HTML tags if present
-        text = re.sub(r"<[^>]+>", "", text)
+        # Extract the text of HTML if present
+        text = text.replace("{html}", "")
+        if is_html(text):
+            text = extract_text(text)
 
         # Normalize line breaks
         text = text.replace("\r\n", "\n").replace("\r", "\n")
@@ -174,13 +196,15 @@ class JsonDataProcessor:
             print(f"No processed data to save for {file_path}")
             return
 
-        # Create output filename based on input filename
+        # Create output filenames based on input filename
         base_name = os.path.splitext(os.path.basename(file_path))[0]
-        output_file = os.path.join(self.output_dir, f"processed_{base_name}.json")
+        paths = output_paths(self.output_dir, base_name, self.output_format)
+        output_file = ", ".join(paths.values())
 
         try:
-            with open(output_file, "w", encoding="utf-8") as f:
-                json.dump(self.processed_data, f, ensure_ascii=False, indent=2)
+            write_corpus(
+                self.processed_data, self.output_dir, base_name, self.output_format
+            )
             print(f"Processed {len(self.processed_data)} entries from {file_path}")
             print(f"Output saved to {output_file}")
         except Exception as e:
@@ -221,11 +245,18 @@ def main():
         "input_path", help="Path to a JSON file or directory containing JSON files"
     )
     parser.add_argument("--output-dir", "-o", help="Directory to save output files")
+    parser.add_argument(
+        "--format",
+        "-f",
+        choices=sorted(FORMATS),
+        default="json",
+        help="Output format; parquet and jsonl store parent fields once per page",
+    )
 
     args = parser.parse_args()
 
     # Create and run the processor
-    processor = JsonDataProcessor(args.input_path, args.output_dir)
+    processor = JsonDataProcessor(args.input_path, args.output_dir, args.format)
     processor.run()
 
 
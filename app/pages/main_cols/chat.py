@@ -1,6 +1,21 @@
 import time
 
+import numpy as np
 import streamlit as st
+from utils.highlights import rows_for_ids
+from utils.render_metrics import measure_render
+from utils.resilience import UPSTREAM_UNAVAILABLE, BusyError, deadline, upstream_session
+from utils.tracing import span
+
+UNAVAILABLE_MESSAGE = (
+    "O serviço está temporariamente indisponível. "
+    "Por favor, tente novamente dentro de momentos."
+)
+
+BUSY_MESSAGE = (
+    "O Professor Cravo está a responder a muitas perguntas ao mesmo tempo. "
+    "Por favor, tente novamente dentro de alguns segundos."
+)
 
 # import streamlit as st
 
@@ -80,10 +95,59 @@ import streamlit as st
 #         st.session_state.messages.append({"role": "assistant", "content": response})
 
 
+def active_filters():
+    """
+    Retrieval filters matching the scatter column's category, year and
+    topic selection. Unrestricted selections are left out.
+
+    Returns:
+        dict: Keyword arguments for ChromaDBRetriever.retrieve
+    """
+    filters = {}
+    df = st.session_state.df
+
+    categories = st.session_state.get("selected_categories")
+    if categories is not None and set(categories) != set(df["source_name"].unique()):
+        filters["sources"] = list(categories)
+
+    years = st.session_state.get("selected_years")
+    if years is not None:
+        all_years = df["tstamp"].astype(str).str[:4].astype(int)
+        if years[0] > all_years.min():
+            filters["start"] = str(years[0])
+        if years[1] < all_years.max():
+            filters["end"] = str(years[1])
+
+    topics = st.session_state.get("selected_topics")
+    if topics:
+        filters["topics"] = [int(topic) for topic in topics]
+
+    return filters
+
+
+@st.fragment
 def render_chat_column():
     """
     Renders the right column with embedding chat functionality.
     Chat input at top, conversation history below.
+
+    Runs as a fragment: sending a message reruns only this column, plus
+    the whole page when the answer changes the highlighted points.
+    """
+    with measure_render("render_chat"):
+        highlight_changed = _render_chat()
+
+    if highlight_changed:
+        st.rerun(scope="app")
+
+
+def _render_chat() -> bool:
+    """
+    Render the chat and answer a new message, if any.
+
+    Returns:
+        bool: Whether the highlighted points changed, so the visualization
+            column must be redrawn
     """
     st.title("Pergunte ao Passado")
 
@@ -91,29 +155,45 @@ def render_chat_column():
     prompt = st.chat_input("Introduza a sua mensagem:")
 
     if prompt:
+        highlight_before = (
+            st.session_state.get("highlight_active", False),
+            tuple(st.session_state.get("highlighted_indices", ())),
+        )
+
         # Add user message to chat history
         st.session_state.messages.append({"role": "user", "content": prompt})
 
-        # Get response
-        with st.spinner("Thinking..."):
-            # Retrieve relevant documents with metadata
-            relevant_docs = st.session_state.retriever.retrieve(prompt, top_k=5)
-
-            # Generate response with document sources and metadata
-            response, relevant = st.session_state.generator.generate_response(
-                prompt, relevant_docs
-            )
-
-            # Update dataframe highlighting
-            df = st.session_state.df
-            df["_highlighted"] = False
-
+        # Get response, with one time budget for every upstream call in the turn
+        turn_deadline = st.session_state.config.get("turn_deadline_s", 30)
+        with st.spinner("Thinking..."), span("chat_turn"), deadline(
+            turn_deadline
+        ), upstream_session(st.session_state.session_id):
+            try:
+                # Retrieve relevant documents with metadata, from the sources
+                # and years selected in the visualization column
+                filters = active_filters()
+                with span("retrieve", top_k=5, **filters):
+                    relevant_docs = st.session_state.retriever.retrieve(
+                        prompt, top_k=5, **filters
+                    )
+
+                # Generate response with document sources and metadata
+                with span("generate"):
+                    response, relevant = st.session_state.generator.generate_response(
+                        prompt, relevant_docs
+                    )
+            except BusyError:
+                response, relevant = BUSY_MESSAGE, False
+            except UPSTREAM_UNAVAILABLE:
+                response, relevant = UNAVAILABLE_MESSAGE, False
+
+            # Highlight the sources' rows of the (shared, unmodified) projection
             if relevant:
-                highlight_ids = [int(doc["id"].split("_")[-1]) for doc in relevant_docs]
-                df.loc[highlight_ids, "_highlighted"] = True
-                st.session_state.df = df
                 st.session_state.highlight_active = True
-                st.session_state.highlighted_indices = highlight_ids
+                st.session_state.highlighted_indices = rows_for_ids(
+                    [doc["id"] for doc in relevant_docs],
+                    st.session_state.get("row_index", {}),
+                )
 
                 # Prepare sources text
                 relevant_text = (
@@ -132,13 +212,21 @@ def render_chat_column():
             else:
                 full_response = response
                 st.session_state.highlight_active = False
-                st.session_state.highlighted_indices = []
+                st.session_state.highlighted_indices = np.empty(0, dtype=np.int64)
 
         # Add assistant response to chat history
         st.session_state.messages.append(
             {"role": "assistant", "content": full_response}
         )
 
+        highlight_after = (
+            st.session_state.highlight_active,
+            tuple(st.session_state.highlighted_indices),
+        )
+        if highlight_after != highlight_before:
+            # The history is drawn by the full rerun
+            return True
+
     # Display conversation history below input
     st.markdown("---")
 
@@ -155,6 +243,8 @@ def render_chat_column():
             else:
                 st.markdown(message["content"])
 
+    return False
+
 
 # def render_chat_column():
 #     """
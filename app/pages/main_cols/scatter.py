@@ -3,8 +3,10 @@ from typing import Dict, List, Tuple
 import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import streamlit as st
 import umap
+from utils.render_metrics import measure_render
 
 
 def generate_random_indices(max_index, count):
@@ -29,14 +31,16 @@ def toggle_highlight(highlighted_indices):
     """
     if st.session_state.highlight_active:
         # Turn off highlighting
-        st.session_state.highlighted_indices = []
+        st.session_state.highlighted_indices = np.empty(0, dtype=np.int64)
         st.session_state.highlight_active = False
     else:
         # Turn on highlighting with new random indices
         # max_index = len(st.session_state.df)
         # # Generate around 10% of the data points, or at least 5
         # num_to_highlight = 5
-        st.session_state.highlighted_indices = highlighted_indices
+        st.session_state.highlighted_indices = np.asarray(
+            highlighted_indices, dtype=np.int64
+        )
         st.session_state.highlight_active = True
 
 
@@ -79,18 +83,18 @@ def create_base_plot(df, scatter_args, marker_size, reduced_opacity=False):
     return fig
 
 
-def highlight_query_points(fig, df):
+def highlight_query_points(fig, df, rows):
     """
     Add highlighted query points to the figure.
 
     Args:
         fig: Plotly figure to add traces to
         df: DataFrame containing the data
+        rows (np.ndarray): Row positions of the points to highlight
     """
     HIGHLIGHT_MARKER_SIZE = 20
 
-    indices = df[df["_highlighted"] == True].index
-    highlighted_df = df.iloc[indices]
+    highlighted_df = df.iloc[rows]
     # Create a new trace for highlighted points with specified size
     for category in highlighted_df["source_name"].unique():
         category_df = highlighted_df[highlighted_df["source_name"] == category]
@@ -117,10 +121,19 @@ def highlight_query_points(fig, df):
             )
 
 
+@st.fragment
 def render_visualization_column():
     """
     Renders the left column with embedding visualization functionality.
+
+    Runs as a fragment: selecting points or changing the filters reruns
+    only this column. The chat reads the filters from session state.
     """
+    with measure_render("render_scatter"):
+        _render_visualization()
+
+
+def _render_visualization():
     st.title("Arquivo dos Cravos")
 
     # Define constants for marker sizing
@@ -130,14 +143,8 @@ def render_visualization_column():
     df = st.session_state.df
     categs = df["source_name"].unique().tolist()
 
-    df["hover_text"] = df.apply(
-        lambda row: f"Fonte: {row['source_name']}<br>"
-        + f"{row['tstamp']}<br>"
-        + f"Arquivo: {row['linkToArchive']}<br>"
-        + f"URL: {row['linkToNoFrame']}",
-        axis=1,
-    )
-
+    # df is shared by all sessions and never modified; hover_text is
+    # precomputed by load_projection()
     # print(df.columns)
 
     # Define scatter plot arguments
@@ -166,15 +173,68 @@ def render_visualization_column():
 
     with controls_container:
 
-        # UI controls for category selection
+        # UI controls for category selection; the chat retrieves from the
+        # same selection through st.session_state.selected_categories
         categories = st.multiselect(
             "Select categories to display:",
             options=categs,
             default=categs,
+            key="selected_categories",
         )
 
-    # Filter dataframe based on selected categories
-    filtered_df = df[df["source_name"].isin(categories)]
+        # Capture years, read by the chat through st.session_state.selected_years
+        years = df["tstamp"].astype(str).str[:4].astype(int)
+        if years.min() < years.max():
+            first_year, last_year = st.slider(
+                "Período:",
+                min_value=int(years.min()),
+                max_value=int(years.max()),
+                value=(int(years.min()), int(years.max())),
+                key="selected_years",
+            )
+        else:
+            first_year = last_year = int(years.min())
+
+        # Topic facet, read by the chat through st.session_state.selected_topics
+        topics = st.session_state.get("topics")
+        selected_topics = []
+        if topics is not None:
+            selected_topics = st.multiselect(
+                "Tópicos:",
+                options=list(range(topics.n_topics)),
+                format_func=lambda topic: topics.labels[topic],
+                key="selected_topics",
+            )
+            show_topic_labels = st.checkbox(
+                "Mostrar tópicos", value=True, key="show_topic_labels"
+            )
+
+    # Filter dataframe based on selected categories and years
+    visible = (
+        df["source_name"].isin(categories) & years.between(first_year, last_year)
+    ).to_numpy()
+    topic_layer = st.session_state.get("topic_layer")
+    if selected_topics and topic_layer is not None:
+        visible &= np.isin(topic_layer[0], selected_topics)
+
+    # Highlighted rows that pass the filters; overlays are built from these only
+    highlighted = np.asarray(st.session_state.highlighted_indices, dtype=np.int64)
+    highlighted = highlighted[visible[highlighted]]
+
+    spatial = st.session_state.spatial
+    viewport = None
+    if st.session_state.highlight_active and len(highlighted):
+        viewport = highlight_viewport(spatial, highlighted)
+
+    # Only the points worth drawing at this zoom are sent to the browser
+    filtered_df = df.iloc[
+        plotted_rows(
+            spatial,
+            visible,
+            viewport,
+            st.session_state.config.get("max_plot_points", 20000),
+        )
+    ]
     col1, col2 = st.columns([2, 1])
 
     with col1:
@@ -190,9 +250,14 @@ def render_visualization_column():
         # Highlight query points if they exist
 
         # Add highlighted random points if active
-        if st.session_state.highlight_active and st.session_state.highlighted_indices:
-            highlight_query_points(fig, filtered_df)
-            focus_on_highlights(fig, filtered_df, st.session_state.highlighted_indices)
+        if st.session_state.highlight_active and len(highlighted):
+            highlight_query_points(fig, df, highlighted)
+            focus_on_highlights(fig, viewport)
+
+        if topics is not None and topic_layer is not None and show_topic_labels:
+            add_topic_labels(
+                fig, topics.labels, topic_layer[1], selected_topics or None
+            )
 
         fig = apply_theme(fig)
 
@@ -211,23 +276,28 @@ def render_visualization_column():
         with metadata_container:
             # print("st.session_state.metadata")
             # print(st.session_state.color_palette)
-            if selected_points and selected_points["selection"]["points"]:
-                # Display multiple points horizontally if multiple are selected
-                num_points = len(selected_points["selection"]["points"])
+            selected = (
+                resolve_selection(selected_points["selection"], spatial, visible)
+                if selected_points
+                else np.empty(0, dtype=np.int64)
+            )
+            if len(selected):
+                # Display up to 3 points horizontally if several are selected
+                num_points = len(selected)
                 if num_points > 1:
+                    st.caption(f"{num_points} pontos selecionados")
                     cols = st.columns(min(num_points, 3))  # Max 3 columns
 
-                for i, point in enumerate(selected_points["selection"]["points"]):
-                    point_index = point["point_index"]
+                for i, point_index in enumerate(selected[:3]):
                     selected_row = df.iloc[point_index]
 
                     # If multiple points, use columns
                     if num_points > 1:
-                        col_idx = i % 3
-                        with cols[col_idx]:
+                        with cols[i]:
                             display_metadata_card(selected_row, point_index)
                     else:
                         display_metadata_card(selected_row, point_index)
+                        display_similar_documents(point_index)
             else:
                 st.info("Clique num ponto do gráfico para ver os seus detalhes aqui.")
 
@@ -275,46 +345,166 @@ def display_metadata_card(selected_row, point_index):
     )
 
 
-def focus_on_highlights(fig, df, indices):
+def display_similar_documents(point_index):
     """
-    Adjust the plot's axes range to focus on the highlighted points.
+    "More like this": the nearest chunks of the clicked point, read from
+    the precomputed neighbour table, with a button that highlights them on
+    the map.
+    """
+    neighbours = st.session_state.get("neighbours")
+    if neighbours is None:
+        return
+    rows, distances = neighbours.lookup(point_index)
+    if not len(rows):
+        return
 
-    Args:
-        fig (plotly.graph_objects.Figure): Figure to update
-        df (pandas.DataFrame): DataFrame containing the data
-        indices (list): List of indices for highlighted points
+    df = st.session_state.df
+    positions = st.session_state.row_positions
+    st.markdown("**Documentos semelhantes**")
+    for row, distance in zip(rows, distances):
+        neighbour = df.iloc[row]
+        tstamp = str(neighbour["tstamp"])
+        content = ""
+        if positions[row] >= 0:
+            content = ".".join(
+                st.session_state.documents[positions[row]].split(".")[:1]
+            )
+        st.markdown(
+            f"- **{neighbour['source_name']}** ({tstamp[:4]}, "
+            f"{1 - distance:.0%} semelhante) {content} ... "
+            f"[Ler mais]({neighbour['linkToArchive']})"
+        )
+
+    if st.button("Destacar no mapa", key=f"similar_{point_index}"):
+        st.session_state.highlighted_indices = np.concatenate(
+            [[point_index], rows]
+        ).astype(np.int64)
+        st.session_state.highlight_active = True
+        # Highlights are drawn by this fragment only
+        st.rerun(scope="fragment")
+
+
+def add_topic_labels(fig, labels, positions, selected=None):
     """
-    ZOOM_BUFFER_PERCENTAGE = 0.15
+    Overview layer: one text label per topic at the centre of its points.
 
-    if not indices:
+    Args:
+        fig (plotly.graph_objects.Figure): Figure to add the layer to
+        labels (List[str]): Label of every topic
+        positions (np.ndarray): (n_topics, 2) label positions, NaN to skip
+        selected (List[int], optional): Only label these topics
+    """
+    topics = [
+        topic
+        for topic in (selected if selected else range(len(labels)))
+        if not np.isnan(positions[topic]).any()
+    ]
+    if not topics:
         return
+    fig.add_trace(
+        go.Scatter(
+            x=positions[topics, 0],
+            y=positions[topics, 1],
+            text=[labels[topic] for topic in topics],
+            mode="text",
+            textfont=dict(size=14),
+            hoverinfo="skip",
+            showlegend=False,
+        )
+    )
 
-    # Get the subset of data for highlighted points
-    highlighted_df = df.iloc[indices]
 
-    if highlighted_df.empty:
-        return
+def resolve_selection(selection, spatial, visible):
+    """
+    Rows of a plot selection. Box and lasso selections are resolved from
+    their geometry, so points thinned out of the plot are included; clicked
+    points are hit-tested by coordinates, since point_index counts within
+    a trace.
+
+    Args:
+        selection (dict): The "selection" of st.plotly_chart's return value
+        spatial (utils.spatial.GridIndex): Index over the projection
+        visible (np.ndarray): Boolean mask of the rows passing the filters
+
+    Returns:
+        np.ndarray: Row positions, in selection order for clicks
+    """
+    if selection.get("box") or selection.get("lasso"):
+        rows = [
+            spatial.query_box(
+                (min(box["x"]), max(box["x"]), min(box["y"]), max(box["y"])),
+                visible,
+            )
+            for box in selection.get("box", [])
+        ] + [
+            spatial.query_lasso(lasso["x"], lasso["y"], visible)
+            for lasso in selection.get("lasso", [])
+        ]
+        return np.unique(np.concatenate(rows)).astype(np.int64)
+
+    rows = [spatial.nearest(p["x"], p["y"], visible) for p in selection["points"]]
+    return np.asarray([row for row in rows if row >= 0], dtype=np.int64)
+
+
+def plotted_rows(spatial, visible, viewport, max_points):
+    """
+    Rows to draw: everything visible, thinned evenly across the map above
+    max_points. When the view is focused on highlights, the focused region
+    is drawn in full and a sparser sample of the rest is kept for context.
+
+    Args:
+        spatial (utils.spatial.GridIndex): Index over the projection
+        visible (np.ndarray): Boolean mask of the rows passing the filters
+        viewport (tuple): (x0, x1, y0, y1) of the focused view, or None
+        max_points (int): Cap on the points drawn
+
+    Returns:
+        np.ndarray: Sorted row positions
+    """
+    if viewport is None:
+        return spatial.cull(None, max_points, visible)
+    inside = spatial.cull(viewport, max_points, visible)
+    context = spatial.cull(None, max_points // 4, visible)
+    return np.union1d(inside, context)
 
-    # Calculate min/max x and y values for highlighted points
-    min_x = highlighted_df["x"].min()
-    max_x = highlighted_df["x"].max()
-    min_y = highlighted_df["y"].min()
-    max_y = highlighted_df["y"].max()
 
-    # Calculate range to add buffer space
-    x_range = max_x - min_x
-    y_range = max_y - min_y
+def highlight_viewport(spatial, indices):
+    """
+    Range around the highlighted points, with a buffer so the view is not
+    zoomed too tight.
+
+    Args:
+        spatial (utils.spatial.GridIndex): Index over the projection
+        indices (np.ndarray): Row positions of the highlighted points
+
+    Returns:
+        tuple: (x0, x1, y0, y1), or None without highlights
+    """
+    ZOOM_BUFFER_PERCENTAGE = 0.15
+
+    bounds = spatial.bounds(indices)
+    if bounds is None:
+        return None
+    min_x, max_x, min_y, max_y = bounds
 
     # Add buffer to prevent zooming too tight
-    buffer_x = max(x_range * ZOOM_BUFFER_PERCENTAGE, 0.5)
-    buffer_y = max(y_range * ZOOM_BUFFER_PERCENTAGE, 0.5)
+    buffer_x = max((max_x - min_x) * ZOOM_BUFFER_PERCENTAGE, 0.5)
+    buffer_y = max((max_y - min_y) * ZOOM_BUFFER_PERCENTAGE, 0.5)
+    return min_x - buffer_x, max_x + buffer_x, min_y - buffer_y, max_y + buffer_y
 
-    # Calculate final axis ranges with buffer
-    x_min = min_x - buffer_x
-    x_max = max_x + buffer_x
-    y_min = min_y - buffer_y
-    y_max = max_y + buffer_y
 
+def focus_on_highlights(fig, viewport):
+    """
+    Adjust the plot's axes range to focus on the highlighted points.
+
+    Args:
+        fig (plotly.graph_objects.Figure): Figure to update
+        viewport (tuple): (x0, x1, y0, y1) from highlight_viewport()
+    """
+    if viewport is None:
+        return
+
+    x_min, x_max, y_min, y_max = viewport
     # Update figure's x and y axis ranges
     fig.update_layout(
         xaxis=dict(range=[x_min, x_max]), yaxis=dict(range=[y_min, y_max])
@@ -0,0 +1,186 @@
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Dict, List, Optional, Tuple
+
+from utils.embeddings import OpenAIEmbedding
+from utils.resilience import DeadlineExceededError, remaining_time
+from utils.singleflight import get_group
+from utils.tracing import current_span, span, traced
+
+# Text, caller's future, enqueue time and the caller's context (deadline,
+# admission session and current span)
+Request = Tuple[str, Future, float, contextvars.Context]
+
+
+def _resolve(future: Future, result=None, error: Optional[Exception] = None) -> None:
+    """Complete a caller's future unless the caller already gave up on it."""
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
+
+
+class EmbeddingBatcher:
+    """
+    Collects query embeddings requested by concurrent sessions within a
+    short window and sends them upstream as a single multi-input request.
+    Callers block on a future until their vector comes back.
+
+    Drop-in replacement for OpenAIEmbedding wherever get_embedding is used.
+    """
+
+    def __init__(
+        self,
+        embedding: OpenAIEmbedding,
+        window_ms: float = 10.0,
+        max_batch: int = 64,
+        max_in_flight: int = 4,
+    ):
+        """
+        Initialize the batcher.
+
+        Args:
+            embedding (OpenAIEmbedding): Client used for the batched requests
+            window_ms (float, optional): How long the first query of a batch waits
+                for others. Defaults to 10.
+            max_batch (int, optional): Inputs per request. Defaults to 64.
+            max_in_flight (int, optional): Batch requests sent concurrently, so a
+                slow response does not hold back the next window. Defaults to 4.
+        """
+        self.embedding = embedding
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+
+        self._queue: "queue.Queue[Request]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._senders = ThreadPoolExecutor(
+            max_workers=max_in_flight, thread_name_prefix="embedding-batch"
+        )
+        self.batches = 0
+        self.batched_inputs = 0
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._dispatch_forever, name="embedding-batcher", daemon=True
+                )
+                self._thread.start()
+
+    @traced("embedding")
+    def get_embedding(self, text: str) -> List[float]:
+        """
+        Get the embedding of a single text through the shared batch.
+        Concurrent requests for the same text share one batch slot.
+
+        Args:
+            text (str): Text to embed
+
+        Returns:
+            List[float]: Embedding vector
+
+        Raises:
+            DeadlineExceededError: The turn's budget ran out while waiting
+        """
+        # Not the "embedding" group: its leaders return raw responses
+        (embedding, batch_size), coalesced = get_group("batched_embedding").do(
+            (self.embedding.model, self.embedding.dimensions, text),
+            lambda: self._submit(text),
+        )
+        current_span().set("coalesced", coalesced)
+        current_span().set("batch_size", batch_size)
+        return embedding
+
+    def _submit(self, text: str) -> Tuple[List[float], int]:
+        """Queue a text for the next batch and wait for its vector."""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((text, future, time.perf_counter(), contextvars.copy_context()))
+
+        try:
+            return future.result(timeout=remaining_time())
+        except FutureTimeoutError:
+            future.cancel()
+            raise DeadlineExceededError("Timed out waiting for a batched embedding")
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Bulk requests are already batched: pass them straight through."""
+        return self.embedding.get_embeddings(texts)
+
+    def _collect(self) -> List[Request]:
+        """Block for the first request, then gather others until the window ends."""
+        batch = [self._queue.get()]
+        window_end = time.perf_counter() + self.window_ms / 1000
+
+        while len(batch) < self.max_batch:
+            timeout = window_end - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _dispatch_forever(self) -> None:
+        while True:
+            batch = [item for item in self._collect() if not item[1].cancelled()]
+            if batch:
+                self._senders.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch: List[Request]) -> None:
+        """
+        Send the batch in the context of the caller with the least time
+        left, so the request keeps its deadline, admission session and span.
+        """
+
+        def time_left(request: Request) -> float:
+            left = request[3].run(remaining_time)
+            return float("inf") if left is None else left
+
+        min(batch, key=time_left)[3].run(self._send, batch)
+
+    def _send(self, batch: List[Request]) -> None:
+        """Send one request for the batch and resolve every caller's future."""
+        # Identical queries in the same window share one input
+        unique_texts: Dict[str, int] = {}
+        for text, *_ in batch:
+            unique_texts.setdefault(text, len(unique_texts))
+
+        oldest_wait_ms = (
+            time.perf_counter() - min(request[2] for request in batch)
+        ) * 1000
+        try:
+            with span(
+                "embedding_batch",
+                inputs=len(unique_texts),
+                callers=len(batch),
+                queue_ms=oldest_wait_ms,
+            ) as batch_span:
+                response = self.embedding.request_embeddings(list(unique_texts))
+                batch_span.set("tokens", response.usage.total_tokens)
+        except Exception as e:
+            for _, future, *_ in batch:
+                _resolve(future, error=e)
+            return
+
+        with self._lock:
+            self.batches += 1
+            self.batched_inputs += len(batch)
+
+        vectors = [item.embedding for item in response.data]
+        for text, future, *_ in batch:
+            _resolve(future, result=(vectors[unique_texts[text]], len(batch)))
+
+    @property
+    def average_batch_size(self) -> Optional[float]:
+        """Callers served per upstream request so far."""
+        return self.batched_inputs / self.batches if self.batches else None
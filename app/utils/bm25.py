@@ -0,0 +1,384 @@
+import argparse
+import os
+import re
+import sys
+import unicodedata
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.embeddings import OpenAIEmbedding
+from utils.evaluation import evaluate_search, load_labeled_queries
+
+# Short list of Portuguese function words that carry no retrieval signal
+STOPWORDS = frozenset(
+    """
+    a ao aos as com como da das de do dos e ela ele em entre era foi ha isso
+    mais mas na nas no nos o os ou para pela pelas pelo pelos por que se sem
+    ser sua suas seu seus so sobre tambem um uma umas uns
+    """.split()
+)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def fold_accents(text: str) -> str:
+    """
+    Lowercase a text and strip diacritics ("Spínola" -> "spinola").
+
+    Args:
+        text (str): Text to fold
+
+    Returns:
+        str: Accent-folded, lowercase text
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return text.lower()
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split a text into accent-folded tokens, dropping stopwords.
+
+    Args:
+        text (str): Text to tokenize
+
+    Returns:
+        List[str]: List of tokens
+    """
+    if not text:
+        return []
+    return [t for t in TOKEN_PATTERN.findall(fold_accents(text)) if t not in STOPWORDS]
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[str]], k: int = 60
+) -> List[Tuple[str, float]]:
+    """
+    Fuse several ranked id lists with reciprocal-rank fusion.
+
+    Args:
+        rankings (Sequence[Sequence[str]]): Ranked lists of document ids, best first
+        k (int, optional): RRF damping constant. Defaults to 60.
+
+    Returns:
+        List[Tuple[str, float]]: (id, fused score) pairs sorted by descending score
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def _pack_strings(strings: Sequence[str]) -> np.ndarray:
+    """Pack strings into a single newline-separated UTF-8 byte array."""
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def _unpack_strings(packed: np.ndarray) -> List[str]:
+    """Inverse of _pack_strings."""
+    if packed.size == 0:
+        return []
+    return packed.tobytes().decode("utf-8").split("\n")
+
+
+class BM25Index:
+    """
+    Okapi BM25 inverted index over accent-folded tokens.
+
+    Postings are stored in CSR layout: the postings of the i-th term are
+    ``doc_rows[term_offsets[i]:term_offsets[i + 1]]`` with matching term
+    frequencies in ``term_freqs``.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        terms: List[str],
+        term_offsets: np.ndarray,
+        doc_rows: np.ndarray,
+        term_freqs: np.ndarray,
+        doc_lengths: np.ndarray,
+        k1: float = 1.5,
+        b: float = 0.75,
+    ):
+        """
+        Initialize the index from its CSR arrays.
+
+        Args:
+            ids (List[str]): Document ids, indexed by row
+            terms (List[str]): Vocabulary, indexed by term number
+            term_offsets (np.ndarray): Start offset of each term's postings (len(terms) + 1)
+            doc_rows (np.ndarray): Document row of each posting
+            term_freqs (np.ndarray): Term frequency of each posting
+            doc_lengths (np.ndarray): Token count of each document
+            k1 (float, optional): BM25 term frequency saturation. Defaults to 1.5.
+            b (float, optional): BM25 length normalization. Defaults to 0.75.
+        """
+        self.ids = ids
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self.doc_rows = doc_rows
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+
+        self.vocab = {term: i for i, term in enumerate(terms)}
+
+        # Precompute the per-posting BM25 impact so a query is a gather + bincount
+        n_docs = max(len(ids), 1)
+        avg_len = float(doc_lengths.mean()) if len(doc_lengths) else 1.0
+        doc_freqs = np.diff(term_offsets).astype(np.float32)
+        idf = np.log(1.0 + (n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        norm = k1 * (1.0 - b + b * doc_lengths / max(avg_len, 1e-9))
+        tf = term_freqs.astype(np.float32)
+        term_of_posting = np.repeat(np.arange(len(terms)), np.diff(term_offsets))
+        self.impacts = (
+            idf[term_of_posting] * tf * (k1 + 1.0) / (tf + norm[doc_rows])
+        ).astype(np.float32)
+
+    @classmethod
+    def build(
+        cls,
+        ids: List[str],
+        documents: List[str],
+        k1: float = 1.5,
+        b: float = 0.75,
+    ) -> "BM25Index":
+        """
+        Build an index from raw documents.
+
+        Args:
+            ids (List[str]): Document ids
+            documents (List[str]): Document texts, aligned with ids
+            k1 (float, optional): BM25 term frequency saturation. Defaults to 1.5.
+            b (float, optional): BM25 length normalization. Defaults to 0.75.
+
+        Returns:
+            BM25Index: The built index
+        """
+        postings: Dict[str, Dict[int, int]] = {}
+        doc_lengths = np.zeros(len(documents), dtype=np.int32)
+
+        for row, text in enumerate(documents):
+            tokens = tokenize(text)
+            doc_lengths[row] = len(tokens)
+            for token in tokens:
+                term_postings = postings.setdefault(token, {})
+                term_postings[row] = term_postings.get(row, 0) + 1
+
+        terms = sorted(postings)
+        term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        doc_rows = []
+        term_freqs = []
+        for i, term in enumerate(terms):
+            rows = sorted(postings[term])
+            doc_rows.extend(rows)
+            term_freqs.extend(postings[term][r] for r in rows)
+            term_offsets[i + 1] = term_offsets[i] + len(rows)
+
+        return cls(
+            ids=list(ids),
+            terms=terms,
+            term_offsets=term_offsets,
+            doc_rows=np.asarray(doc_rows, dtype=np.int32),
+            term_freqs=np.minimum(np.asarray(term_freqs), 65535).astype(np.uint16),
+            doc_lengths=doc_lengths,
+            k1=k1,
+            b=b,
+        )
+
+    def save(self, path: str) -> None:
+        """
+        Save the index as a compressed .npz file.
+
+        Args:
+            path (str): Destination path
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(
+            path,
+            ids=_pack_strings(self.ids),
+            terms=_pack_strings(self.terms),
+            term_offsets=self.term_offsets,
+            doc_rows=self.doc_rows,
+            term_freqs=self.term_freqs,
+            doc_lengths=self.doc_lengths,
+            params=np.array([self.k1, self.b], dtype=np.float32),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        """
+        Load an index saved with save().
+
+        Args:
+            path (str): Path to the .npz file
+
+        Returns:
+            BM25Index: The loaded index
+        """
+        with np.load(path) as data:
+            k1, b = data["params"].tolist()
+            return cls(
+                ids=_unpack_strings(data["ids"]),
+                terms=_unpack_strings(data["terms"]),
+                term_offsets=data["term_offsets"],
+                doc_rows=data["doc_rows"],
+                term_freqs=data["term_freqs"],
+                doc_lengths=data["doc_lengths"],
+                k1=k1,
+                b=b,
+            )
+
+    def search(
+        self, query: str, top_k: int = 10, mask: Optional[np.ndarray] = None
+    ) -> List[Tuple[str, float]]:
+        """
+        Score documents against a query.
+
+        Args:
+            query (str): Query text
+            top_k (int, optional): Number of results. Defaults to 10.
+            mask (np.ndarray, optional): Boolean mask of the documents to score
+
+        Returns:
+            List[Tuple[str, float]]: (id, score) pairs sorted by descending score
+        """
+        term_ids = [self.vocab[t] for t in set(tokenize(query)) if t in self.vocab]
+        if not term_ids:
+            return []
+
+        slices = [
+            slice(self.term_offsets[t], self.term_offsets[t + 1]) for t in term_ids
+        ]
+        rows = np.concatenate([self.doc_rows[s] for s in slices])
+        impacts = np.concatenate([self.impacts[s] for s in slices])
+
+        if mask is not None:
+            keep = mask[rows]
+            rows, impacts = rows[keep], impacts[keep]
+            if len(rows) == 0:
+                return []
+
+        # Sum impacts per document, touching only matching postings
+        unique_rows, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=impacts)
+
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+
+        return [(self.ids[unique_rows[i]], float(scores[i])) for i in best]
+
+
+def build_from_collection(collection, batch_size: int = 1000) -> BM25Index:
+    """
+    Build a BM25 index from every document in a ChromaDB collection.
+
+    Args:
+        collection: ChromaDB collection
+        batch_size (int, optional): Documents fetched per request. Defaults to 1000.
+
+    Returns:
+        BM25Index: The built index
+    """
+    ids, documents = [], []
+    offset = 0
+    while True:
+        batch = collection.get(include=["documents"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        documents.extend(doc or "" for doc in batch["documents"])
+        offset += len(batch["ids"])
+
+    return BM25Index.build(ids, documents)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build or evaluate the BM25 index of a ChromaDB collection"
+    )
+    parser.add_argument(
+        "--db_path",
+        type=str,
+        default="./data/chroma_cravo",
+        help="Path to ChromaDB directory",
+    )
+    parser.add_argument(
+        "--collection_name",
+        type=str,
+        default="cravo",
+        help="Name of the ChromaDB collection",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./data/embeddings/bm25_index.npz",
+        help="Path of the index file",
+    )
+    parser.add_argument(
+        "--eval",
+        type=str,
+        default=None,
+        help="Labeled query set (JSON) to evaluate vector, BM25 and hybrid search on",
+    )
+    parser.add_argument("--top_k", type=int, default=5, help="Cutoff for recall@k")
+    return parser.parse_args()
+
+
+def main():
+    from dotenv import load_dotenv
+
+    # utils.retriever imports this module
+    from utils.retriever import ChromaDBRetriever
+
+    load_dotenv()
+    args = parse_args()
+
+    embedding = OpenAIEmbedding(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model=os.getenv("DEFAULT_EMBEDDING_MODEL", "text-embedding-3-small"),
+    )
+    retriever = ChromaDBRetriever(
+        db_path=args.db_path,
+        collection_name=args.collection_name,
+        embedding=embedding,
+    )
+
+    if args.eval is None:
+        index = build_from_collection(retriever.collection)
+        index.save(args.output)
+        print(f"Indexed {len(index.ids)} documents, {len(index.terms)} terms")
+        print(f"Index saved to {args.output}")
+        return
+
+    retriever.bm25 = BM25Index.load(args.output)
+    queries = load_labeled_queries(args.eval)
+
+    search_fns = {
+        "vector": lambda q, k: [
+            doc["id"]
+            for doc in retriever._vector_search(retriever.embedding.get_embedding(q), k)
+        ],
+        "bm25": lambda q, k: [doc_id for doc_id, _ in retriever.bm25.search(q, k)],
+        "hybrid": lambda q, k: [doc["id"] for doc in retriever.retrieve(q, top_k=k)],
+    }
+    for name, search_fn in search_fns.items():
+        report = evaluate_search(queries, search_fn, k=args.top_k)
+        print(
+            f"{name:>7}: recall@{args.top_k}={report['recall']:.3f} "
+            f"mrr={report['mrr']:.3f} p50={report['p50_ms']:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
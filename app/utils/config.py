@@ -5,10 +5,33 @@ from typing import Any, Dict
 # Default configuration
 DEFAULT_CONFIG = {
     "embedding_model": "text-embedding-3-small",
+    "embedding_dimensions": None,
+    "embedding_batch_window_ms": 10,
     "model": "gpt-4o",
     "temperature": 0.7,
     "top_k": 3,
     "max_tokens": 1000,
+    "bm25_index_path": "./data/embeddings/bm25_index.npz",
+    "vector_index_path": None,
+    "filter_index_path": "./data/embeddings/filter_index.npz",
+    "hierarchy_index_path": None,
+    "knn_graph_path": "./data/embeddings/knn_graph",
+    "similar_top_k": 5,
+    "max_plot_points": 20000,
+    "topics_path": "./data/embeddings/topics",
+    # Other collections served by ?collection=<name>, each with its own
+    # db_path, embeddings_path and index paths
+    "collections": {},
+    "corpus_cache_bytes": 4_000_000_000,
+    "corpus_cache_entries": 4,
+    "context_tokens": 1500,
+    "trace_jsonl_path": None,
+    "otel_endpoint": None,
+    "turn_deadline_s": 30,
+    "upstream_max_concurrent": 16,
+    "upstream_rate_per_s": 20,
+    "upstream_max_queue": 64,
+    "upstream_max_wait_s": 10,
 }
 
 # Path to configuration file
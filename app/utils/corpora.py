@@ -0,0 +1,308 @@
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+from utils.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Index paths of the config that belong to one collection
+INDEX_SETTINGS = [
+    "bm25_index_path",
+    "vector_index_path",
+    "filter_index_path",
+    "hierarchy_index_path",
+    "knn_graph_path",
+    "topics_path",
+]
+DEFAULT_EMBEDDINGS_PATH = "./data/embeddings/"
+
+
+def estimate_bytes(value: Any, _seen: Optional[set] = None) -> int:
+    """
+    Approximate memory held by a value: arrays, data frames, strings and
+    containers, and the attributes of this app's own classes. Objects are
+    counted once. Memory-mapped arrays live in the page cache and are not
+    counted, nor is anything held inside ChromaDB's client.
+
+    Args:
+        value (Any): Value to measure
+
+    Returns:
+        int: Bytes
+    """
+    seen = set() if _seen is None else _seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    if isinstance(value, np.memmap):
+        return 0
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(
+            estimate_bytes(k, seen) + estimate_bytes(v, seen) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(estimate_bytes(item, seen) for item in value)
+    if type(value).__module__.startswith("utils.") and hasattr(value, "__dict__"):
+        return sys.getsizeof(value) + estimate_bytes(vars(value), seen)
+    return sys.getsizeof(value)
+
+
+class Corpus:
+    """
+    Everything loaded for one collection: its retriever, documents and
+    projection, and the indexes built on them. Shared by every session
+    viewing the collection and never modified by them.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        retriever,
+        documents: list,
+        metadata: list,
+        umap_df: pd.DataFrame,
+        row_index: Dict[str, int],
+        row_positions: np.ndarray,
+        spatial=None,
+        neighbours=None,
+        topic_layer=None,
+    ):
+        """
+        Initialize the corpus.
+
+        Args:
+            name (str): Collection name
+            retriever (ChromaDBRetriever): Retriever of the collection
+            documents (list): Chunk texts in collection.get() order
+            metadata (list): Chunk metadata in collection.get() order
+            umap_df (pd.DataFrame): Projection table
+            row_index (Dict[str, int]): Chunk id → projection row
+            row_positions (np.ndarray): collection.get() position of every row
+            spatial (GridIndex, optional): Grid index over the projection
+            neighbours (NeighbourTable, optional): "More like this" table
+            topic_layer (tuple, optional): Topic of every row and label positions
+        """
+        self.name = name
+        self.retriever = retriever
+        self.documents = documents
+        self.metadata = metadata
+        self.umap_df = umap_df
+        self.row_index = row_index
+        self.row_positions = row_positions
+        self.spatial = spatial
+        self.neighbours = neighbours
+        self.topic_layer = topic_layer
+
+    def memory_bytes(self) -> int:
+        """Approximate memory held by the corpus."""
+        return estimate_bytes(self)
+
+
+class CorpusCache:
+    """
+    Loaded corpora by collection name, least recently used first. Corpora
+    are loaded lazily on first request (concurrent requests share one
+    load) and evicted once the cache holds more than max_bytes or
+    max_entries. The most recent corpus is always kept, even when it alone
+    exceeds max_bytes. An evicted corpus is freed once no session still
+    references it.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 4_000_000_000,
+        max_entries: int = 4,
+        sizeof: Callable[[Any], int] = estimate_bytes,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes (int, optional): Memory budget. Defaults to 4 GB.
+            max_entries (int, optional): Corpora kept at most. Defaults to 4.
+            sizeof (Callable[[Any], int], optional): Measures a loaded corpus.
+                Defaults to estimate_bytes.
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.sizeof = sizeof
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._loads = SingleFlight("corpus_load")
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+        self.load_seconds = 0.0
+
+    def get(self, name: str, loader: Callable[[], Any]) -> Any:
+        """
+        The corpus of a collection, loaded on a miss.
+
+        Args:
+            name (str): Collection name
+            loader (Callable[[], Any]): Loads the corpus
+
+        Returns:
+            Any: The corpus
+        """
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return self._entries[name][0]
+            self.misses += 1
+
+        corpus, _ = self._loads.do(name, lambda: self._load(name, loader))
+        return corpus
+
+    def _load(self, name: str, loader: Callable[[], Any]) -> Any:
+        # A load that finished between the miss and this call was stored
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                return self._entries[name][0]
+
+        start = time.perf_counter()
+        corpus = loader()
+        elapsed = time.perf_counter() - start
+        size = self.sizeof(corpus)
+        logger.info(
+            "Loaded corpus '%s' (%.1f MB) in %.2f s", name, size / 1e6, elapsed
+        )
+
+        with self._lock:
+            self.loads += 1
+            self.load_seconds += elapsed
+            self._entries[name] = (corpus, size)
+            self._entries.move_to_end(name)
+            while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries
+                or self._total_bytes() > self.max_bytes
+            ):
+                evicted, (_, evicted_size) = self._entries.popitem(last=False)
+                self.evictions += 1
+                self.evicted_bytes += evicted_size
+                logger.info(
+                    "Evicted corpus '%s' (%.1f MB)", evicted, evicted_size / 1e6
+                )
+        return corpus
+
+    def _total_bytes(self) -> int:
+        return sum(size for _, size in self._entries.values())
+
+    def evict(self, name: str) -> bool:
+        """
+        Drop a corpus, e.g. after its collection was re-ingested.
+
+        Args:
+            name (str): Collection name
+
+        Returns:
+            bool: Whether it was cached
+        """
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry is None:
+                return False
+            self.evictions += 1
+            self.evicted_bytes += entry[1]
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Counters since the process started.
+
+        Returns:
+            Dict[str, Any]: Cached corpora (least recent first) with their
+                size, total and maximum bytes, hits, misses, loads,
+                evictions, evicted bytes and mean load time
+        """
+        with self._lock:
+            return {
+                "corpora": [
+                    {"name": name, "bytes": size}
+                    for name, (_, size) in self._entries.items()
+                ],
+                "bytes": self._total_bytes(),
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "evicted_bytes": self.evicted_bytes,
+                "mean_load_s": self.load_seconds / self.loads if self.loads else 0.0,
+            }
+
+
+def resolve_collections(
+    config: Dict[str, Any], default_name: str, default_db_path: str
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Settings of every collection the app serves. The default collection
+    uses the config's index paths; the others, listed under "collections"
+    in the config, only the paths they set, so an index of one collection
+    is never used for another.
+
+    Args:
+        config (Dict[str, Any]): Application configuration
+        default_name (str): --collection_name
+        default_db_path (str): --db_path
+
+    Returns:
+        Dict[str, Dict[str, Any]]: db_path, embeddings_path and index paths
+            by collection name
+    """
+    collections = {
+        default_name: {
+            "db_path": default_db_path,
+            "embeddings_path": DEFAULT_EMBEDDINGS_PATH,
+            **{key: config.get(key) for key in INDEX_SETTINGS},
+        }
+    }
+    for name, overrides in (config.get("collections") or {}).items():
+        base = collections.get(name) or {
+            "db_path": default_db_path,
+            "embeddings_path": f"{DEFAULT_EMBEDDINGS_PATH}{name}/",
+            **{key: None for key in INDEX_SETTINGS},
+        }
+        collections[name] = {**base, **overrides}
+    return collections
+
+
+_cache = CorpusCache()
+
+
+def configure_corpus_cache(**kwargs) -> CorpusCache:
+    """
+    Replace the process-wide corpus cache.
+
+    Args:
+        **kwargs: CorpusCache arguments
+
+    Returns:
+        CorpusCache: The new cache
+    """
+    global _cache
+    _cache = CorpusCache(**kwargs)
+    return _cache
+
+
+def get_corpus_cache() -> CorpusCache:
+    """Return the process-wide corpus cache."""
+    return _cache
@@ -1,14 +1,30 @@
 import argparse
+import functools
+import hashlib
+import json
 import os
 import sys
+from typing import Any, Dict, List, Optional
 
 import chromadb
+import numpy as np
+from chromadb.config import Settings
 from dotenv import load_dotenv
 from openai import OpenAI
 
 # Add parent directory to path to import modules
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from utils.bm25 import tokenize
+
+SAMPLE_DOCS = [
+    "This is a sample document about artificial intelligence.",
+    "ChromaDB is a vector database for storing and querying embeddings.",
+    "Retrieval-Augmented Generation combines search and text generation.",
+    "Streamlit is a framework for building data applications quickly.",
+    "OpenAI provides APIs for embedding and text generation.",
+]
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Create a test ChromaDB collection")
@@ -25,18 +41,136 @@ def parse_args():
         "--sample_docs",
         type=str,
         nargs="+",
-        default=[
-            "This is a sample document about artificial intelligence.",
-            "ChromaDB is a vector database for storing and querying embeddings.",
-            "Retrieval-Augmented Generation combines search and text generation.",
-            "Streamlit is a framework for building data applications quickly.",
-            "OpenAI provides APIs for embedding and text generation.",
-        ],
+        default=SAMPLE_DOCS,
         help="Sample documents to add to the collection",
     )
+    parser.add_argument(
+        "--from_json",
+        type=str,
+        default=None,
+        help="Load documents from a JSON list of {content, metadata, id} "
+        "(e.g. notebooks/demo_relevant.json) instead of --sample_docs",
+    )
+    parser.add_argument(
+        "--fake_embeddings",
+        action="store_true",
+        help="Use deterministic offline embeddings instead of the OpenAI API",
+    )
+    parser.add_argument(
+        "--dimensions",
+        type=int,
+        default=256,
+        help="Dimension of the fake embeddings",
+    )
     return parser.parse_args()
 
 
+@functools.lru_cache(maxsize=65536)
+def _token_vector(token: str, dimensions: int) -> np.ndarray:
+    """Pseudo-random vector seeded by the token's hash."""
+    seed = int.from_bytes(hashlib.md5(token.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dimensions)
+
+
+def fake_embedding(text: str, dimensions: int = 256) -> List[float]:
+    """
+    Deterministic offline embedding: the normalized sum of one pseudo-random
+    vector per accent-folded token, so texts sharing words end up close.
+
+    Args:
+        text (str): Text to embed
+        dimensions (int, optional): Embedding dimension. Defaults to 256.
+
+    Returns:
+        List[float]: Embedding vector
+    """
+    vector = np.zeros(dimensions)
+    for token in tokenize(text):
+        vector += _token_vector(token, dimensions)
+
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+
+    return vector.tolist()
+
+
+class FakeEmbedding:
+    """
+    Drop-in replacement for OpenAIEmbedding that never calls the API.
+    """
+
+    def __init__(self, dimensions: int = 256):
+        """
+        Initialize the fake embedding client.
+
+        Args:
+            dimensions (int, optional): Embedding dimension. Defaults to 256.
+        """
+        self.dimensions = dimensions
+        self.model = "fake"
+
+    def get_embedding(self, text: str) -> List[float]:
+        return fake_embedding(text, self.dimensions)
+
+    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return [fake_embedding(text, self.dimensions) for text in texts]
+
+
+def load_json_documents(path: str) -> Dict[str, List[Any]]:
+    """
+    Load documents saved in the retriever's output format.
+
+    Args:
+        path (str): Path to a JSON list of {content, metadata, id}
+
+    Returns:
+        Dict[str, List[Any]]: documents, metadatas and ids
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        items = json.load(f)
+
+    return {
+        "documents": [item["content"] for item in items],
+        "metadatas": [item.get("metadata") or None for item in items],
+        "ids": [item["id"] for item in items],
+    }
+
+
+def create_collection(
+    client,
+    collection_name: str,
+    docs: List[str],
+    embeddings: List[List[float]],
+    ids: Optional[List[str]] = None,
+    metadatas: Optional[List[Dict[str, Any]]] = None,
+):
+    """
+    Create (or extend) a collection with the given documents.
+
+    Args:
+        client: ChromaDB client
+        collection_name (str): Name of the collection
+        docs (List[str]): Documents
+        embeddings (List[List[float]]): Embeddings aligned with docs
+        ids (List[str], optional): Document ids. Defaults to doc_0, doc_1, ...
+        metadatas (List[Dict[str, Any]], optional): Metadata aligned with docs
+
+    Returns:
+        The ChromaDB collection
+    """
+    collection = client.get_or_create_collection(name=collection_name)
+
+    collection.add(
+        documents=docs,
+        embeddings=embeddings,
+        ids=ids or [f"doc_{i}" for i in range(len(docs))],
+        metadatas=metadatas,
+    )
+
+    return collection
+
+
 def get_embeddings(api_key, texts, model="text-embedding-3-large"):
     """
     Get embeddings for the provided texts using OpenAI API.
@@ -60,41 +194,41 @@ def main():
 
     # Check if OpenAI API key is available
     openai_api_key = os.getenv("OPENAI_API_KEY")
-    if not openai_api_key:
+    if not openai_api_key and not args.fake_embeddings:
         print("Error: OPENAI_API_KEY environment variable is not set.")
         print("Please set it in the .env file or export it in your environment.")
+        print("Use --fake_embeddings to build an offline test collection.")
         sys.exit(1)
 
     # Create database directory if it doesn't exist
     os.makedirs(args.db_path, exist_ok=True)
 
     # Initialize ChromaDB client
-    client = chromadb.PersistentClient(path=args.db_path)
+    client = chromadb.PersistentClient(
+        path=args.db_path, settings=Settings(anonymized_telemetry=False)
+    )
 
-    # Create or get collection
-    try:
-        collection = client.get_collection(name=args.collection_name)
-        print(
-            f"Collection '{args.collection_name}' already exists. Adding documents..."
-        )
-    except ValueError:
-        collection = client.create_collection(name=args.collection_name)
-        print(f"Created new collection '{args.collection_name}'.")
+    # Load documents
+    if args.from_json:
+        loaded = load_json_documents(args.from_json)
+        docs, ids, metadatas = loaded["documents"], loaded["ids"], loaded["metadatas"]
+    else:
+        docs, ids, metadatas = args.sample_docs, None, None
 
-    # Get embeddings for the sample documents
-    docs = args.sample_docs
+    # Get embeddings for the documents
     try:
-        embeddings = get_embeddings(openai_api_key, docs)
+        if args.fake_embeddings:
+            embeddings = FakeEmbedding(args.dimensions).get_embeddings(docs)
+        else:
+            embeddings = get_embeddings(openai_api_key, docs)
     except Exception as e:
         print(f"Error getting embeddings: {e}")
         sys.exit(1)
 
     # Add documents to the collection
     try:
-        collection.add(
-            documents=docs,
-            embeddings=embeddings,
-            ids=[f"doc_{i}" for i in range(len(docs))],
+        collection = create_collection(
+            client, args.collection_name, docs, embeddings, ids, metadatas
         )
         print(f"Added {len(docs)} documents to the collection.")
     except Exception as e:
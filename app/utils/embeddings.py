@@ -1,7 +1,9 @@
-from typing import List
+from typing import Any, List, Optional, Union
 
 import openai
-from tenacity import retry, stop_after_attempt, wait_exponential
+from utils.resilience import RetryPolicy, call_upstream
+from utils.singleflight import get_group
+from utils.tracing import current_span, traced
 
 
 class OpenAIEmbedding:
@@ -9,7 +11,14 @@ class OpenAIEmbedding:
     Class for creating embeddings using OpenAI API.
     """
 
-    def __init__(self, api_key: str, model: str = "text-embedding-3-large"):
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "text-embedding-3-large",
+        base_url: Optional[str] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        dimensions: Optional[int] = None,
+    ):
         """
         Initialize the OpenAI embedding client.
 
@@ -17,17 +26,60 @@ class OpenAIEmbedding:
             api_key (str): OpenAI API key
             model (str, optional): OpenAI embedding model name.
                 Defaults to "text-embedding-3-large".
+            base_url (str, optional): Alternative API endpoint, e.g. the local
+                stub server. Defaults to None (OPENAI_BASE_URL or the public API).
+            retry_policy (RetryPolicy, optional): Per-call retry policy.
+                Defaults to None (utils.resilience.DEFAULT_RETRY_POLICY).
+            dimensions (int, optional): Shortened output width, supported by the
+                text-embedding-3 models. Must match the width of the stored
+                embeddings. Defaults to None (the model's full width).
         """
         self.api_key = api_key
         self.model = model
+        self.base_url = base_url
+        self.retry_policy = retry_policy
+        self.dimensions = dimensions
         openai.api_key = api_key
+        self._client = None
+
+    @property
+    def client(self) -> openai.OpenAI:
+        """Shared API client, created on first use."""
+        if self._client is None:
+            # Retries are handled by call_upstream, not by the client
+            self._client = openai.OpenAI(
+                api_key=self.api_key, base_url=self.base_url, max_retries=0
+            )
+        return self._client
+
+    def _create(self, texts, **kwargs):
+        """Embeddings request, with the shortened width when one is set."""
+        if self.dimensions is not None:
+            kwargs["dimensions"] = self.dimensions
+        return self.client.embeddings.create(input=texts, model=self.model, **kwargs)
+
+    def request_embeddings(self, texts: Union[str, List[str]]) -> Any:
+        """
+        Send one embeddings request through the retry policy and circuit
+        breaker, without opening a span of its own.
+
+        Args:
+            texts (Union[str, List[str]]): Text or texts to embed
+
+        Returns:
+            Any: The API response
+        """
+        return call_upstream(
+            "embeddings",
+            lambda **kw: self._create(texts, **kw),
+            self.retry_policy,
+        )
 
-    @retry(
-        stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10)
-    )
+    @traced("embedding")
     def get_embedding(self, text: str) -> List[float]:
         """
-        Get embedding for a single text.
+        Get embedding for a single text. Concurrent requests for the same
+        text share one upstream call.
 
         Args:
             text (str): Text to embed
@@ -35,18 +87,20 @@ class OpenAIEmbedding:
         Returns:
             List[float]: Embedding vector
         """
-        client = openai.OpenAI(api_key=self.api_key)
-
-        response = client.embeddings.create(input=text, model=self.model)
+        response, coalesced = get_group("embedding").do(
+            (self.model, self.dimensions, text),
+            lambda: self.request_embeddings(text),
+        )
+        current_span().set("coalesced", coalesced)
+        if not coalesced:
+            current_span().set("tokens", response.usage.total_tokens)
 
         # Extract the embedding from the response
         embedding = response.data[0].embedding
 
         return embedding
 
-    @retry(
-        stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10)
-    )
+    @traced("embedding")
     def get_embeddings(self, texts: List[str]) -> List[List[float]]:
         """
         Get embeddings for multiple texts.
@@ -57,9 +111,9 @@ class OpenAIEmbedding:
         Returns:
             List[List[float]]: List of embedding vectors
         """
-        client = openai.OpenAI(api_key=self.api_key)
-
-        response = client.embeddings.create(input=texts, model=self.model)
+        current_span().set("inputs", len(texts))
+        response = self.request_embeddings(texts)
+        current_span().set("tokens", response.usage.total_tokens)
 
         # Extract the embeddings from the response
         embeddings = [item.embedding for item in response.data]
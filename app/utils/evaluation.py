@@ -0,0 +1,109 @@
+import json
+import time
+from typing import Any, Callable, Dict, List, Sequence
+
+import numpy as np
+
+
+def recall_at_k(retrieved: Sequence[str], relevant: Sequence[str], k: int) -> float:
+    """
+    Fraction of the relevant ids found in the first k retrieved ids.
+
+    Args:
+        retrieved (Sequence[str]): Retrieved ids, best first
+        relevant (Sequence[str]): Ground-truth relevant ids
+        k (int): Cutoff
+
+    Returns:
+        float: Recall at k
+    """
+    if not relevant:
+        return 0.0
+    hits = set(retrieved[:k]) & set(relevant)
+    return len(hits) / len(set(relevant))
+
+
+def reciprocal_rank(retrieved: Sequence[str], relevant: Sequence[str]) -> float:
+    """
+    Reciprocal of the rank of the first relevant id (0 if none was retrieved).
+
+    Args:
+        retrieved (Sequence[str]): Retrieved ids, best first
+        relevant (Sequence[str]): Ground-truth relevant ids
+
+    Returns:
+        float: Reciprocal rank
+    """
+    relevant = set(relevant)
+    for rank, doc_id in enumerate(retrieved, 1):
+        if doc_id in relevant:
+            return 1.0 / rank
+    return 0.0
+
+
+def latency_percentiles(latencies_ms: Sequence[float]) -> Dict[str, float]:
+    """
+    Summarize latencies as p50/p95/p99.
+
+    Args:
+        latencies_ms (Sequence[float]): Latencies in milliseconds
+
+    Returns:
+        Dict[str, float]: p50_ms, p95_ms and p99_ms
+    """
+    if len(latencies_ms) == 0:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+    p50, p95, p99 = np.percentile(np.asarray(latencies_ms), [50, 95, 99])
+    return {"p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+def load_labeled_queries(path: str) -> List[Dict[str, Any]]:
+    """
+    Load a labeled query set.
+
+    The file is a JSON list of ``{"query": str, "relevant_ids": [str, ...]}``.
+
+    Args:
+        path (str): Path to the JSON file
+
+    Returns:
+        List[Dict[str, Any]]: Labeled queries
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def evaluate_search(
+    queries: List[Dict[str, Any]],
+    search_fn: Callable[[str, int], List[str]],
+    k: int = 5,
+) -> Dict[str, float]:
+    """
+    Run a search function over a labeled query set.
+
+    Args:
+        queries (List[Dict[str, Any]]): Labeled queries (see load_labeled_queries)
+        search_fn (Callable[[str, int], List[str]]): Returns ranked ids for (query, k)
+        k (int, optional): Cutoff for recall. Defaults to 5.
+
+    Returns:
+        Dict[str, float]: Mean recall@k, MRR and latency percentiles
+    """
+    recalls, rranks, latencies = [], [], []
+
+    for item in queries:
+        start = time.perf_counter()
+        retrieved = search_fn(item["query"], k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+        recalls.append(recall_at_k(retrieved, item["relevant_ids"], k))
+        rranks.append(reciprocal_rank(retrieved, item["relevant_ids"]))
+
+    report = {
+        "recall": float(np.mean(recalls)) if recalls else 0.0,
+        "mrr": float(np.mean(rranks)) if rranks else 0.0,
+        "queries": len(queries),
+    }
+    report.update(latency_percentiles(latencies))
+
+    return report
@@ -0,0 +1,306 @@
+import argparse
+import os
+from typing import Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+# Arquivo.pt timestamps are YYYYMMDDhhmmss
+TSTAMP_DIGITS = 14
+
+
+def parse_tstamp(value: Union[str, int, None], upper: bool = False) -> Optional[int]:
+    """
+    Normalize a possibly partial Arquivo.pt timestamp ("1974", "19740425",
+    19740425000000) to a 14-digit integer.
+
+    Args:
+        value (Union[str, int, None]): Timestamp or prefix of one
+        upper (bool, optional): Pad as the end of a range (with 9s) rather
+            than the start (with 0s). Defaults to False.
+
+    Returns:
+        Optional[int]: The timestamp, or None when value is empty
+    """
+    if value is None or value == "":
+        return None
+    digits = "".join(c for c in str(value) if c.isdigit())[:TSTAMP_DIGITS]
+    return int(digits.ljust(TSTAMP_DIGITS, "9" if upper else "0"))
+
+
+class MetadataFilterIndex:
+    """
+    Precomputed filters over the chunks of a collection: one packed bitset
+    per source_name and the rows sorted by tstamp. Filters resolve to a
+    boolean row mask before any scoring happens.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        m_ids: np.ndarray,
+        sources: List[str],
+        source_bits: np.ndarray,
+        tstamp_order: np.ndarray,
+        tstamp_sorted: np.ndarray,
+    ):
+        """
+        Initialize the filter index.
+
+        Args:
+            ids (List[str]): Chunk ids, indexed by row
+            m_ids (np.ndarray): (n,) parent metadata id of every row
+            sources (List[str]): Source names, indexed like source_bits
+            source_bits (np.ndarray): (n_sources, ceil(n / 8)) packed row bitsets
+            tstamp_order (np.ndarray): (n,) rows sorted by timestamp
+            tstamp_sorted (np.ndarray): (n,) timestamps in that order
+        """
+        self.ids = ids
+        self.m_ids = m_ids
+        self.sources = sources
+        self.source_bits = source_bits
+        self.tstamp_order = tstamp_order
+        self.tstamp_sorted = tstamp_sorted
+        self._id_to_row = None
+
+    @classmethod
+    def build(
+        cls,
+        ids: List[str],
+        m_ids: Sequence[int],
+        source_names: Sequence[str],
+        tstamps: Sequence[Union[str, int]],
+    ) -> "MetadataFilterIndex":
+        """
+        Build the bitsets and timestamp index.
+
+        Args:
+            ids (List[str]): Chunk ids
+            m_ids (Sequence[int]): Parent metadata id of every chunk
+            source_names (Sequence[str]): Source of every chunk
+            tstamps (Sequence[Union[str, int]]): Capture timestamp of every chunk
+
+        Returns:
+            MetadataFilterIndex: The built index
+        """
+        source_names = np.asarray(source_names, dtype=object)
+        sources = sorted(set(source_names.tolist()))
+        source_bits = (
+            np.stack([np.packbits(source_names == source) for source in sources])
+            if sources
+            else np.zeros((0, 0), dtype=np.uint8)
+        )
+
+        values = np.array([parse_tstamp(t) or 0 for t in tstamps], dtype=np.int64)
+        tstamp_order = np.argsort(values, kind="stable")
+
+        return cls(
+            list(ids),
+            np.asarray(m_ids, dtype=np.int64),
+            sources,
+            source_bits,
+            tstamp_order.astype(np.int64),
+            values[tstamp_order],
+        )
+
+    def save(self, path: str) -> None:
+        """
+        Save the index as a compressed .npz file.
+
+        Args:
+            path (str): Output path
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(
+            path,
+            ids=np.array(self.ids),
+            m_ids=self.m_ids,
+            sources=np.array(self.sources),
+            source_bits=self.source_bits,
+            tstamp_order=self.tstamp_order,
+            tstamp_sorted=self.tstamp_sorted,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "MetadataFilterIndex":
+        """
+        Load an index saved with save().
+
+        Args:
+            path (str): Path to the .npz file
+
+        Returns:
+            MetadataFilterIndex: The loaded index
+        """
+        with np.load(path) as data:
+            return cls(
+                ids=data["ids"].tolist(),
+                m_ids=data["m_ids"],
+                sources=data["sources"].tolist(),
+                source_bits=data["source_bits"],
+                tstamp_order=data["tstamp_order"],
+                tstamp_sorted=data["tstamp_sorted"],
+            )
+
+    def mask(
+        self,
+        sources: Optional[Sequence[str]] = None,
+        start: Union[str, int, None] = None,
+        end: Union[str, int, None] = None,
+    ) -> Optional[np.ndarray]:
+        """
+        Rows matching every given filter.
+
+        Args:
+            sources (Sequence[str], optional): Allowed source names. None for any.
+            start (Union[str, int], optional): Earliest tstamp, inclusive
+            end (Union[str, int], optional): Latest tstamp, inclusive
+
+        Returns:
+            Optional[np.ndarray]: (n,) boolean mask, or None when nothing is filtered
+        """
+        n = len(self.ids)
+        result = None
+
+        if sources is not None and set(sources) != set(self.sources):
+            # OR the packed bitsets: 8 rows per byte
+            selected = [i for i, s in enumerate(self.sources) if s in set(sources)]
+            bits = (
+                np.bitwise_or.reduce(self.source_bits[selected], axis=0)
+                if selected
+                else (np.zeros((n + 7) // 8, dtype=np.uint8))
+            )
+            result = np.unpackbits(bits, count=n).astype(bool)
+
+        low, high = parse_tstamp(start), parse_tstamp(end, upper=True)
+        if low is not None or high is not None:
+            lo = 0 if low is None else np.searchsorted(self.tstamp_sorted, low, "left")
+            hi = (
+                n
+                if high is None
+                else np.searchsorted(self.tstamp_sorted, high, "right")
+            )
+            in_range = np.zeros(n, dtype=bool)
+            in_range[self.tstamp_order[lo:hi]] = True
+            result = in_range if result is None else result & in_range
+
+        return result
+
+    def positions(self, ids: Sequence[str]) -> np.ndarray:
+        """
+        Filter rows of the given ids, to align another index's row order
+        with this one: ``mask[positions(other.ids)]`` is a mask over the
+        other index's rows.
+
+        Args:
+            ids (Sequence[str]): Ids in the other index's order
+
+        Returns:
+            np.ndarray: Row of every id, or -1 when it is unknown here
+        """
+        if self._id_to_row is None:
+            self._id_to_row = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        return np.array([self._id_to_row.get(i, -1) for i in ids], dtype=np.int64)
+
+    def align(self, mask: np.ndarray, positions: np.ndarray) -> np.ndarray:
+        """
+        Reorder a mask from this index's rows to another index's rows.
+
+        Args:
+            mask (np.ndarray): Mask over this index's rows
+            positions (np.ndarray): Result of positions() for the other index
+
+        Returns:
+            np.ndarray: Mask over the other index's rows; unknown ids are excluded
+        """
+        return np.where(positions >= 0, mask[positions], False)
+
+
+def build_from_collection(collection, umap_df: pd.DataFrame, batch_size: int = 1000):
+    """
+    Build the filter index of a collection, joining the chunks' m_id
+    metadata with the source_name and tstamp columns of umap_metadata.csv.
+
+    Args:
+        collection: ChromaDB collection
+        umap_df (pd.DataFrame): Table with meta_id, source_name and tstamp columns
+        batch_size (int, optional): Chunks fetched per request. Defaults to 1000.
+
+    Returns:
+        MetadataFilterIndex: The built index
+    """
+    by_meta_id: Dict[int, tuple] = {
+        int(row.meta_id): (str(row.source_name), str(row.tstamp))
+        for row in umap_df[["meta_id", "source_name", "tstamp"]].itertuples()
+    }
+
+    ids, m_ids, source_names, tstamps = [], [], [], []
+    offset = 0
+    while True:
+        batch = collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+        if not batch["ids"]:
+            break
+        for doc_id, metadata in zip(batch["ids"], batch["metadatas"]):
+            m_id = int((metadata or {}).get("m_id", -1))
+            source_name, tstamp = by_meta_id.get(m_id, ("", ""))
+            ids.append(doc_id)
+            m_ids.append(m_id)
+            source_names.append(source_name)
+            tstamps.append(tstamp)
+        offset += len(batch["ids"])
+
+    return MetadataFilterIndex.build(ids, m_ids, source_names, tstamps)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build the source/date filter index of a ChromaDB collection"
+    )
+    parser.add_argument(
+        "--db_path",
+        type=str,
+        default="./data/chroma_cravo",
+        help="Path to ChromaDB directory",
+    )
+    parser.add_argument(
+        "--collection_name",
+        type=str,
+        default="cravo",
+        help="Name of the ChromaDB collection",
+    )
+    parser.add_argument(
+        "--umap_path",
+        type=str,
+        default="./data/embeddings/umap_metadata.csv",
+        help="CSV with meta_id, source_name and tstamp columns",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./data/embeddings/filter_index.npz",
+        help="Output path for the filter index",
+    )
+    return parser.parse_args()
+
+
+def main():
+    import chromadb
+    from chromadb.config import Settings
+
+    args = parse_args()
+
+    client = chromadb.PersistentClient(
+        path=args.db_path, settings=Settings(anonymized_telemetry=False)
+    )
+    collection = client.get_collection(args.collection_name)
+
+    index = build_from_collection(collection, pd.read_csv(args.umap_path))
+    index.save(args.output)
+    print(
+        f"Indexed {len(index.ids)} chunks from {len(index.sources)} sources "
+        f"into {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
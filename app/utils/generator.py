@@ -1,9 +1,31 @@
 import json
+import logging
 import re
-from typing import Any, Dict, List
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
 
 import openai
-from tenacity import retry, stop_after_attempt, wait_exponential
+from utils.resilience import (
+    PRIORITY_ANSWER,
+    PRIORITY_AUXILIARY,
+    UPSTREAM_UNAVAILABLE,
+    BusyError,
+    RetryPolicy,
+    call_upstream,
+)
+from utils.singleflight import get_group
+from utils.tracing import current_span, span
+
+logger = logging.getLogger(__name__)
+
+
+def _record_usage(active_span, response) -> None:
+    """Copy token usage from a chat completion onto a span."""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        active_span.set("prompt_tokens", usage.prompt_tokens)
+        active_span.set("completion_tokens", usage.completion_tokens)
 
 
 class OpenAIGenerator:
@@ -11,7 +33,20 @@ class OpenAIGenerator:
     Class for generating responses using OpenAI API.
     """
 
-    def __init__(self, api_key: str, model: str = "gpt-4o", temperature: float = 0.7):
+    # Recent answers shared by all sessions, served when generation is down
+    ANSWER_CACHE_SIZE = 256
+    _answer_cache: "OrderedDict[tuple, str]" = OrderedDict()
+    _answer_cache_lock = threading.Lock()
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "gpt-4o",
+        temperature: float = 0.7,
+        base_url: Optional[str] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        cache_namespace: str = "",
+    ):
         """
         Initialize the OpenAI generator.
 
@@ -19,15 +54,41 @@ class OpenAIGenerator:
             api_key (str): OpenAI API key
             model (str, optional): OpenAI model name. Defaults to "gpt-4o".
             temperature (float, optional): Temperature for generation. Defaults to 0.7.
+            base_url (str, optional): Alternative API endpoint, e.g. the local
+                stub server. Defaults to None (OPENAI_BASE_URL or the public API).
+            retry_policy (RetryPolicy, optional): Per-call retry policy.
+                Defaults to None (utils.resilience.DEFAULT_RETRY_POLICY).
+            cache_namespace (str, optional): Separates the cached answers of
+                generators answering from different collections. Defaults to "".
         """
         self.api_key = api_key
         self.model = model
         self.temperature = temperature
+        self.base_url = base_url
+        self.retry_policy = retry_policy
+        self.cache_namespace = cache_namespace
         openai.api_key = api_key
+        self._client = None
+
+    @property
+    def client(self) -> openai.OpenAI:
+        """Shared API client, created on first use."""
+        if self._client is None:
+            # Retries are handled by call_upstream, not by the client
+            self._client = openai.OpenAI(
+                api_key=self.api_key, base_url=self.base_url, max_retries=0
+            )
+        return self._client
+
+    def _chat(self, priority: int = PRIORITY_AUXILIARY, **request) -> Any:
+        """Send one chat completion request with per-call retries."""
+        return call_upstream(
+            "chat",
+            lambda **kw: self.client.chat.completions.create(**request, **kw),
+            self.retry_policy,
+            priority,
+        )
 
-    @retry(
-        stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10)
-    )
     def generate_response(self, query: str, documents: List[Dict[str, Any]]) -> str:
         """
         Generate a response based on the query and retrieved documents.
@@ -36,11 +97,26 @@ class OpenAIGenerator:
             query (str): User query
             documents (List[Dict[str, Any]]): Retrieved documents with metadata
 
+        Each upstream call is retried on its own (see utils.resilience); if
+        the answer itself cannot be generated, a cached answer to the same
+        question and documents or a degraded answer built from the documents
+        is returned.
+        Concurrent identical requests (same question and documents) share
+        one safety check, translation and generation.
+
         Returns:
             str: Generated response
         """
-        client = openai.OpenAI(api_key=self.api_key)
-
+        key = self._cache_key(query, documents) + (self.temperature,)
+        result, coalesced = get_group("generate").do(
+            key, lambda: self._generate_response(query, documents)
+        )
+        current_span().set("coalesced", coalesced)
+        return result
+
+    def _generate_response(
+        self, query: str, documents: List[Dict[str, Any]]
+    ) -> Tuple[str, bool]:
         # Create the context from documents with metadata
         context_items = []
         for i, doc in enumerate(documents):
@@ -48,9 +124,11 @@ class OpenAIGenerator:
             content = doc.get("content", "")
             metadata = doc.get("metadata", {})
             doc_id = doc.get("id", f"doc_{i}")
-            similarity = 1.0 - (
-                doc.get("distance", 0) or 0
-            )  # Convert distance to similarity score
+            # Convert distance to similarity score; BM25-only hits have none
+            distance = doc.get("distance")
+            relevance = (
+                "" if distance is None else f" (Relevance: {1.0 - distance:.2f})"
+            )
 
             # Format metadata as string
             metadata_str = ""
@@ -61,7 +139,9 @@ class OpenAIGenerator:
                     metadata_str = "\nMetadata: " + str(metadata)
 
             # Format the document entry with its metadata and similarity score
-            context_item = f"Document ID: {doc_id} (Relevance: {similarity:.2f})\nContent: {content}{metadata_str}\n"
+            context_item = (
+                f"Document ID: {doc_id}{relevance}\nContent: {content}{metadata_str}\n"
+            )
             context_items.append(context_item)
 
         context = "\n\n".join(context_items)
@@ -76,23 +156,84 @@ class OpenAIGenerator:
             # Normal LLM processing with both prompts
 
             # Generate response
-            response = client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": system_prompt,
-                    },
-                    {"role": "user", "content": user_prompt},
-                ],
-                temperature=self.temperature,
-                max_tokens=2000,
-            )
+            with span("generation", model=self.model) as generation_span:
+                try:
+                    response = self._chat(
+                        priority=PRIORITY_ANSWER,
+                        model=self.model,
+                        messages=[
+                            {
+                                "role": "system",
+                                "content": system_prompt,
+                            },
+                            {"role": "user", "content": user_prompt},
+                        ],
+                        temperature=self.temperature,
+                        max_tokens=2000,
+                    )
+                except UPSTREAM_UNAVAILABLE as e:
+                    logger.warning("Generation unavailable: %s", e)
+                    generation_span.set("degraded", True)
+                    return self.degraded_response(query, documents), True
+
+                _record_usage(generation_span, response)
 
             generated_response = response.choices[0].message.content
+            self._remember_answer(query, documents, generated_response)
 
             return generated_response, True
 
+    def _cache_key(self, query: str, documents: List[Dict[str, Any]]) -> tuple:
+        # The retrieved ids capture the source, date and topic filters, so
+        # an answer is never served for documents it was not based on
+        return (
+            self.cache_namespace,
+            self.model,
+            " ".join(query.lower().split()),
+            tuple(doc.get("id") for doc in documents),
+        )
+
+    def _remember_answer(
+        self, query: str, documents: List[Dict[str, Any]], answer: str
+    ) -> None:
+        key = self._cache_key(query, documents)
+        with self._answer_cache_lock:
+            self._answer_cache[key] = answer
+            self._answer_cache.move_to_end(key)
+            while len(self._answer_cache) > self.ANSWER_CACHE_SIZE:
+                self._answer_cache.popitem(last=False)
+
+    def degraded_response(self, query: str, documents: List[Dict[str, Any]]) -> str:
+        """
+        Answer without the completion model: a cached answer to the same
+        question over the same documents if there is one, otherwise
+        excerpts of the retrieved documents.
+
+        Args:
+            query (str): User query
+            documents (List[Dict[str, Any]]): Retrieved documents with metadata
+
+        Returns:
+            str: Degraded response
+        """
+        with self._answer_cache_lock:
+            cached = self._answer_cache.get(self._cache_key(query, documents))
+        current_span().set("cache_hit", cached is not None)
+
+        if cached is not None:
+            return cached
+
+        excerpts = []
+        for i, doc in enumerate(documents, 1):
+            sentences = doc.get("content", "").split(". ")
+            excerpts.append(f"[{i}] {'. '.join(sentences[:2]).strip()} ...")
+
+        return (
+            "O Professor Cravo está com dificuldades em responder neste momento. "
+            "Entretanto, estes são os excertos mais relevantes dos documentos:\n\n"
+            + "\n\n".join(excerpts)
+        )
+
     # def chat_prompt(self, context, query):
     def chat_prompt(self, context, query):
         """
@@ -100,7 +241,8 @@ class OpenAIGenerator:
         """
 
         # Safety check first
-        safety_result = self.check_user_input_safety(query)
+        with span("safety_check"):
+            safety_result = self.check_user_input_safety(query)
 
         if not safety_result["is_safe"]:
             # Return safety response instead of normal prompt
@@ -112,7 +254,6 @@ class OpenAIGenerator:
         processed_query, original_lang = self.translate_if_needed(query)
 
         # Determine response language instruction
-        print("Determine response language instruction")
 
         if original_lang == "en":
             language_instruction = (
@@ -173,13 +314,40 @@ LIMITAÇÕES:
 - Mantém sempre rigor histórico e factual"""
         return user_prompt, system_prompt
 
+    def label_topic(self, keywords: List[str], examples: List[str]) -> str:
+        """
+        Short Portuguese name for a topic cluster, used by utils/topics.py.
+
+        Args:
+            keywords (List[str]): The topic's most distinctive words
+            examples (List[str]): Chunks closest to the topic centroid
+
+        Returns:
+            str: Label of a few words
+        """
+        excerpts = "\n".join(f"- {text[:300]}" for text in examples)
+        prompt = f"""Dá um nome curto (2 a 5 palavras, em português europeu) ao tema comum destes documentos. Responde apenas com o nome.
+
+Palavras-chave: {", ".join(keywords)}
+
+Excertos:
+{excerpts}"""
+
+        with span("topic_label") as label_span:
+            response = self._chat(
+                model=self.model,
+                messages=[{"role": "user", "content": prompt}],
+                max_tokens=20,
+                temperature=0,
+            )
+            _record_usage(label_span, response)
+        return response.choices[0].message.content.strip().strip('".')
+
     def translate_if_needed(self, query):
         """
         Detects language and translates English queries to European Portuguese.
         Returns the processed query and original language.
         """
-        client = openai.OpenAI(api_key=self.api_key)
-
         try:
             # Detect original language
             detection_prompt = f"""What language is this text written in? Respond with only the language code (en, pt, es, fr, etc.):
@@ -188,12 +356,14 @@ Text: "{query}"
 
 Language code:"""
 
-            detection_response = client.chat.completions.create(
-                model="gpt-3.5-turbo",
-                messages=[{"role": "user", "content": detection_prompt}],
-                max_tokens=10,
-                temperature=0,
-            )
+            with span("language_detection") as detection_span:
+                detection_response = self._chat(
+                    model="gpt-3.5-turbo",
+                    messages=[{"role": "user", "content": detection_prompt}],
+                    max_tokens=10,
+                    temperature=0,
+                )
+                _record_usage(detection_span, detection_response)
 
             original_lang = (
                 detection_response.choices[0].message.content.strip().lower()
@@ -203,32 +373,34 @@ Language code:"""
 
             # Translate if English
             if original_lang == "en":
-                print("Detected EN")
+                logger.debug("Detected EN")
                 translation_prompt = f"""Translate the following English text to European Portuguese (Portugal variant, not Brazilian Portuguese):
 
     English text: "{query}"
 
     Portuguese translation:"""
 
-                translation_response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": translation_prompt}],
-                    max_tokens=200,
-                    temperature=0,
-                )
+                with span("translation") as translation_span:
+                    translation_response = self._chat(
+                        model="gpt-3.5-turbo",
+                        messages=[{"role": "user", "content": translation_prompt}],
+                        max_tokens=200,
+                        temperature=0,
+                    )
+                    _record_usage(translation_span, translation_response)
 
                 translated_query = translation_response.choices[
                     0
                 ].message.content.strip()
-                print(f"Original query (EN): {query}")
-                print(f"Translated query (PT): {translated_query}")
+                logger.info("Original query (EN): %s", query)
+                logger.info("Translated query (PT): %s", translated_query)
                 return translated_query, original_lang
             else:
-                print(f"Query used as-is ({original_lang}): {query}")
+                logger.info("Query used as-is (%s): %s", original_lang, query)
                 return query, original_lang
 
         except Exception as e:
-            print(f"Translation error: {e}. Using original query.")
+            logger.warning("Translation error: %s. Using original query.", e)
             return query, "unknown"
 
     def check_user_input_safety(self, user_input):
@@ -286,6 +458,7 @@ Language code:"""
 
         # Quick check first
         quick_result = quick_pattern_check(user_input)
+        current_span().set("pattern_match", quick_result["pattern_match"])
         if quick_result["pattern_match"]:
             return {
                 "is_safe": False,
@@ -295,8 +468,6 @@ Language code:"""
 
         # AI-based analysis for more nuanced detection
         try:
-            client = openai.OpenAI(api_key=self.api_key)
-
             analysis_prompt = f"""Analyze this text for two types of harmful content:
 
     1. SELF-HARM: Expressions of suicidal ideation, self-injury, or requests for methods to harm oneself
@@ -309,12 +480,13 @@ Language code:"""
     CONFIDENCE: [low/medium/high]
     REASONING: [brief explanation]"""
 
-            response = client.chat.completions.create(
+            response = self._chat(
                 model="gpt-3.5-turbo",
                 messages=[{"role": "user", "content": analysis_prompt}],
                 max_tokens=150,
                 temperature=0,
             )
+            _record_usage(current_span(), response)
 
             result = response.choices[0].message.content.strip()
 
@@ -340,8 +512,11 @@ Language code:"""
                 "confidence": confidence,
             }
 
+        except BusyError:
+            # Skipping the check under load would let unsafe input through
+            raise
         except Exception as e:
-            print(f"Safety check error: {e}")
+            logger.warning("Safety check error: %s", e)
             # Fail safe - if AI check fails, rely on pattern matching
             return {"is_safe": True, "risk_type": None, "confidence": "low"}
 
@@ -0,0 +1,453 @@
+import argparse
+import os
+import re
+import sys
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import tiktoken
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.embeddings import OpenAIEmbedding
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+# Target size of the child chunks that are embedded and matched
+DEFAULT_CHILD_TOKENS = 128
+
+# Tokenizer of the OpenAI embedding and chat models, as in the ETL notebook
+ENCODING_NAME = "cl100k_base"
+
+
+def count_tokens(text: str) -> int:
+    """
+    Number of cl100k_base tokens in a text.
+
+    Args:
+        text (str): Text to measure
+
+    Returns:
+        int: Number of tokens
+    """
+    # Archived pages may contain "<|endoftext|>" as plain text
+    return len(tiktoken.get_encoding(ENCODING_NAME).encode(text, disallowed_special=()))
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split a text on sentence-ending punctuation and blank lines."""
+    sentences = []
+    for paragraph in re.split(r"\n\s*\n", text or ""):
+        sentences.extend(s.strip() for s in SENTENCE_BOUNDARY.split(paragraph))
+    return [s for s in sentences if s]
+
+
+def split_children(text: str, child_tokens: int = DEFAULT_CHILD_TOKENS) -> List[str]:
+    """
+    Split a chunk into consecutive child chunks of whole sentences.
+
+    Args:
+        text (str): Chunk text
+        child_tokens (int, optional): Target tokens per child. Defaults to 128.
+
+    Returns:
+        List[str]: Child texts, in order
+    """
+    children, current, current_tokens = [], [], 0
+    for sentence in split_sentences(text):
+        tokens = count_tokens(sentence)
+        if current and current_tokens + tokens > child_tokens:
+            children.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        children.append(" ".join(current))
+    return children
+
+
+class HierarchyIndex:
+    """
+    Child-to-parent index for small-to-big retrieval. Small child chunks
+    are matched; a parent groups the children of every chunk sharing an
+    m_id (one Arquivo.pt page), stored contiguously so that the children
+    of parent p are rows ``parent_offsets[p]:parent_offsets[p + 1]``.
+    """
+
+    def __init__(
+        self,
+        child_ids: List[str],
+        chunk_ids: List[str],
+        child_chunk: np.ndarray,
+        child_parent: np.ndarray,
+        child_tokens: np.ndarray,
+        parent_m_ids: np.ndarray,
+        parent_offsets: np.ndarray,
+        text_bytes: np.ndarray,
+        text_offsets: np.ndarray,
+        child_collection: str,
+    ):
+        """
+        Initialize the index.
+
+        Args:
+            child_ids (List[str]): Child ids, indexed by row
+            chunk_ids (List[str]): Ids of the original chunks
+            child_chunk (np.ndarray): (n,) original chunk of every child
+            child_parent (np.ndarray): (n,) parent of every child
+            child_tokens (np.ndarray): (n,) tokens of every child
+            parent_m_ids (np.ndarray): (p,) m_id of every parent
+            parent_offsets (np.ndarray): (p + 1,) first child row of every parent
+            text_bytes (np.ndarray): UTF-8 bytes of all child texts
+            text_offsets (np.ndarray): (n + 1,) byte offset of every child text
+            child_collection (str): ChromaDB collection holding the child embeddings
+        """
+        self.child_ids = child_ids
+        self.chunk_ids = chunk_ids
+        self.child_chunk = child_chunk
+        self.child_parent = child_parent
+        self.child_tokens = child_tokens
+        self.parent_m_ids = parent_m_ids
+        self.parent_offsets = parent_offsets
+        self.text_bytes = text_bytes
+        self.text_offsets = text_offsets
+        self.child_collection = child_collection
+
+        self.child_rows = {child_id: row for row, child_id in enumerate(child_ids)}
+        # Prefix sums make the token count of any child range O(1)
+        self.token_prefix = np.concatenate([[0], np.cumsum(child_tokens)])
+
+    @classmethod
+    def build(
+        cls,
+        chunk_ids: List[str],
+        documents: List[str],
+        m_ids: Sequence[int],
+        child_collection: str,
+        child_tokens: int = DEFAULT_CHILD_TOKENS,
+    ) -> "HierarchyIndex":
+        """
+        Split chunks into children and group them by parent page.
+
+        Args:
+            chunk_ids (List[str]): Original chunk ids
+            documents (List[str]): Original chunk texts
+            m_ids (Sequence[int]): Parent m_id of every chunk
+            child_collection (str): Name of the child collection
+            child_tokens (int, optional): Target tokens per child. Defaults to 128.
+
+        Returns:
+            HierarchyIndex: The built index
+        """
+        # Children of one parent must be contiguous: order chunks by m_id,
+        # keeping their original order within a page
+        order = sorted(range(len(chunk_ids)), key=lambda i: (m_ids[i], i))
+
+        child_ids, texts, child_chunk, child_parent = [], [], [], []
+        parent_m_ids, parent_offsets = [], []
+        for i in order:
+            if not parent_m_ids or parent_m_ids[-1] != m_ids[i]:
+                parent_m_ids.append(m_ids[i])
+                parent_offsets.append(len(child_ids))
+            for k, text in enumerate(split_children(documents[i] or "", child_tokens)):
+                child_ids.append(f"{chunk_ids[i]}#{k}")
+                texts.append(text)
+                child_chunk.append(i)
+                child_parent.append(len(parent_m_ids) - 1)
+        parent_offsets.append(len(child_ids))
+
+        encoded = [text.encode("utf-8") for text in texts]
+        text_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=text_offsets[1:])
+
+        return cls(
+            child_ids,
+            list(chunk_ids),
+            np.array(child_chunk, dtype=np.int32),
+            np.array(child_parent, dtype=np.int32),
+            np.array([count_tokens(t) for t in texts], dtype=np.int32),
+            np.array(parent_m_ids, dtype=np.int64),
+            np.array(parent_offsets, dtype=np.int64),
+            np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            text_offsets,
+            child_collection,
+        )
+
+    def save(self, path: str) -> None:
+        """
+        Save the index as a compressed .npz file.
+
+        Args:
+            path (str): Output path
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        np.savez_compressed(
+            path,
+            child_ids=np.array(self.child_ids),
+            chunk_ids=np.array(self.chunk_ids),
+            child_chunk=self.child_chunk,
+            child_parent=self.child_parent,
+            child_tokens=self.child_tokens,
+            parent_m_ids=self.parent_m_ids,
+            parent_offsets=self.parent_offsets,
+            text_bytes=self.text_bytes,
+            text_offsets=self.text_offsets,
+            child_collection=np.array(self.child_collection),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "HierarchyIndex":
+        """
+        Load an index saved with save().
+
+        Args:
+            path (str): Path to the .npz file
+
+        Returns:
+            HierarchyIndex: The loaded index
+        """
+        with np.load(path) as data:
+            return cls(
+                child_ids=data["child_ids"].tolist(),
+                chunk_ids=data["chunk_ids"].tolist(),
+                child_chunk=data["child_chunk"],
+                child_parent=data["child_parent"],
+                child_tokens=data["child_tokens"],
+                parent_m_ids=data["parent_m_ids"],
+                parent_offsets=data["parent_offsets"],
+                text_bytes=data["text_bytes"],
+                text_offsets=data["text_offsets"],
+                child_collection=str(data["child_collection"]),
+            )
+
+    def text(self, start: int, end: int) -> str:
+        """
+        Text of the consecutive children start..end-1.
+
+        Args:
+            start (int): First child row
+            end (int): Child row after the last one
+
+        Returns:
+            str: The children's texts joined by spaces
+        """
+        return " ".join(
+            self.text_bytes[self.text_offsets[row] : self.text_offsets[row + 1]]
+            .tobytes()
+            .decode("utf-8")
+            for row in range(start, end)
+        )
+
+    def tokens(self, start: int, end: int) -> int:
+        """Tokens of the children start..end-1."""
+        return int(self.token_prefix[end] - self.token_prefix[start])
+
+    def expand(self, row: int, token_budget: int) -> Tuple[int, int]:
+        """
+        Widen a matched child to its neighbours within the same parent,
+        alternating right and left, while the window fits the budget.
+        A parent that fits the budget is returned whole.
+
+        Args:
+            row (int): Matched child row
+            token_budget (int): Maximum tokens of the window
+
+        Returns:
+            Tuple[int, int]: Child rows [start, end) of the expanded window
+        """
+        parent = self.child_parent[row]
+        first, last = self.parent_offsets[parent], self.parent_offsets[parent + 1]
+        if self.tokens(first, last) <= token_budget:
+            return int(first), int(last)
+
+        start, end = row, row + 1
+        grew = True
+        while grew:
+            grew = False
+            if end < last and self.tokens(start, end + 1) <= token_budget:
+                end += 1
+                grew = True
+            if start > first and self.tokens(start - 1, end) <= token_budget:
+                start -= 1
+                grew = True
+        return int(start), int(end)
+
+    def expand_documents(
+        self,
+        documents: List[Dict[str, Any]],
+        token_budget: int,
+        max_documents: Optional[int] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Replace matched children with their expanded context, in rank order,
+        keeping one window per page: later matches in an already expanded
+        page are dropped. Each returned document gets an equal share of
+        the budget.
+
+        Args:
+            documents (List[Dict[str, Any]]): Retrieved child documents
+            token_budget (int): Total tokens of the returned contents
+            max_documents (int, optional): Number of documents to return.
+                Defaults to None (one per match).
+
+        Returns:
+            List[Dict[str, Any]]: Documents whose id is the original chunk id,
+                with child_id and parent m_id added
+        """
+        if not documents:
+            return []
+
+        max_documents = max_documents or len(documents)
+        per_document = max(1, token_budget // max_documents)
+        expanded_parents = set()
+        expanded = []
+        for doc in documents:
+            if len(expanded) == max_documents:
+                break
+            row = self.child_rows.get(doc["id"])
+            if row is None:
+                expanded.append(doc)
+                continue
+            parent = int(self.child_parent[row])
+            if parent in expanded_parents:
+                continue
+            expanded_parents.add(parent)
+
+            start, end = self.expand(row, per_document)
+
+            metadata = dict(doc.get("metadata") or {})
+            metadata["m_id"] = int(self.parent_m_ids[parent])
+            expanded.append(
+                {
+                    "content": self.text(start, end),
+                    "metadata": metadata,
+                    "distance": doc.get("distance"),
+                    "id": self.chunk_ids[self.child_chunk[row]],
+                    "child_id": doc["id"],
+                }
+            )
+        return expanded
+
+
+def build_child_collection(
+    client,
+    collection,
+    embedding,
+    child_collection: Optional[str] = None,
+    child_tokens: int = DEFAULT_CHILD_TOKENS,
+    batch_size: int = 100,
+) -> HierarchyIndex:
+    """
+    Split every chunk of a collection into children and embed them into a
+    sibling collection.
+
+    Args:
+        client: ChromaDB client
+        collection: Source ChromaDB collection
+        embedding: Embedding client with get_embeddings()
+        child_collection (str, optional): Name of the child collection.
+            Defaults to "<collection>_children".
+        child_tokens (int, optional): Target tokens per child. Defaults to 128.
+        batch_size (int, optional): Children embedded per request. Defaults to 100.
+
+    Returns:
+        HierarchyIndex: The index of the new children
+    """
+    child_collection = child_collection or f"{collection.name}_children"
+    results = collection.get(include=["documents", "metadatas"])
+    metadatas = [m or {} for m in results["metadatas"]]
+
+    index = HierarchyIndex.build(
+        results["ids"],
+        results["documents"],
+        [int(m.get("m_id", -1)) for m in metadatas],
+        child_collection,
+        child_tokens,
+    )
+
+    target = client.get_or_create_collection(name=child_collection)
+    for start in range(0, len(index.child_ids), batch_size):
+        end = min(start + batch_size, len(index.child_ids))
+        texts = [index.text(row, row + 1) for row in range(start, end)]
+        target.add(
+            ids=index.child_ids[start:end],
+            documents=texts,
+            embeddings=embedding.get_embeddings(texts),
+            metadatas=[
+                {
+                    **metadatas[index.child_chunk[row]],
+                    "chunk_id": index.chunk_ids[index.child_chunk[row]],
+                }
+                for row in range(start, end)
+            ],
+        )
+
+    return index
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Split a collection into small child chunks for small-to-big retrieval"
+    )
+    parser.add_argument(
+        "--db_path",
+        type=str,
+        default="./data/chroma_cravo",
+        help="Path to ChromaDB directory",
+    )
+    parser.add_argument(
+        "--collection_name",
+        type=str,
+        default="cravo",
+        help="Name of the ChromaDB collection",
+    )
+    parser.add_argument(
+        "--child_collection",
+        type=str,
+        default=None,
+        help="Collection for the child chunks. Defaults to <collection>_children.",
+    )
+    parser.add_argument("--child_tokens", type=int, default=DEFAULT_CHILD_TOKENS)
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./data/embeddings/hierarchy_index.npz",
+        help="Output path for the hierarchy index",
+    )
+    return parser.parse_args()
+
+
+def main():
+    import chromadb
+    from chromadb.config import Settings
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    args = parse_args()
+
+    client = chromadb.PersistentClient(
+        path=args.db_path, settings=Settings(anonymized_telemetry=False)
+    )
+    embedding = OpenAIEmbedding(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        model=os.getenv("DEFAULT_EMBEDDING_MODEL", "text-embedding-3-small"),
+    )
+
+    index = build_child_collection(
+        client,
+        client.get_collection(args.collection_name),
+        embedding,
+        args.child_collection,
+        args.child_tokens,
+    )
+    index.save(args.output)
+    print(
+        f"Split {len(index.chunk_ids)} chunks into {len(index.child_ids)} children "
+        f"of {len(index.parent_m_ids)} pages, stored in '{index.child_collection}'"
+    )
+    print(f"Index saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
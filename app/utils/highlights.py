@@ -0,0 +1,157 @@
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def build_row_index(
+    umap_df: pd.DataFrame, collection_ids: Sequence[str]
+) -> Dict[str, int]:
+    """
+    Map Chroma chunk ids to rows of the projection table.
+
+    umap_metadata.csv keeps, in its ``index`` column, the position of every
+    row's chunk in ``collection.get()`` order, and tables updated by
+    ``etl/incremental.py`` the chunk id itself in ``chunk_id``. Older tables
+    with neither are assumed to follow the "doc_<row>" naming of the
+    ingestion scripts.
+
+    Args:
+        umap_df (pd.DataFrame): Projection table
+        collection_ids (Sequence[str]): Chunk ids in collection.get() order
+
+    Returns:
+        Dict[str, int]: Row position of every projected chunk
+    """
+    if "chunk_id" in umap_df.columns:
+        known = set(collection_ids)
+        return {
+            doc_id: row
+            for row, doc_id in enumerate(umap_df["chunk_id"].to_numpy())
+            if doc_id in known
+        }
+
+    if "index" in umap_df.columns:
+        return {
+            collection_ids[position]: row
+            for row, position in enumerate(umap_df["index"].to_numpy())
+            if 0 <= position < len(collection_ids)
+        }
+
+    row_index = {}
+    for doc_id in collection_ids:
+        suffix = doc_id.rsplit("_", 1)[-1]
+        if suffix.isdigit() and int(suffix) < len(umap_df):
+            row_index[doc_id] = int(suffix)
+    return row_index
+
+
+def rows_for_ids(doc_ids: Sequence[str], row_index: Dict[str, int]) -> np.ndarray:
+    """
+    Rows of the given chunks, in order, without duplicates or unknown ids.
+
+    Args:
+        doc_ids (Sequence[str]): Chunk ids, e.g. of retrieved documents
+        row_index (Dict[str, int]): Result of build_row_index()
+
+    Returns:
+        np.ndarray: Row positions, int64
+    """
+    rows = [row_index[doc_id] for doc_id in doc_ids if doc_id in row_index]
+    return np.array(list(dict.fromkeys(rows)), dtype=np.int64)
+
+
+def row_positions(
+    row_index: Dict[str, int], collection_ids: Sequence[str], n_rows: int
+) -> np.ndarray:
+    """
+    Position in collection.get() order of every projection row, -1 for
+    rows whose chunk is not in the collection.
+
+    Args:
+        row_index (Dict[str, int]): Result of build_row_index()
+        collection_ids (Sequence[str]): Chunk ids in collection.get() order
+        n_rows (int): Rows of the projection table
+
+    Returns:
+        np.ndarray: (n_rows,) int64 positions
+    """
+    positions = np.full(n_rows, -1, dtype=np.int64)
+    for position, doc_id in enumerate(collection_ids):
+        row = row_index.get(doc_id)
+        if row is not None:
+            positions[row] = position
+    return positions
+
+
+class NeighbourTable:
+    """
+    The nearest chunks of every projected point, as projection rows.
+    Precomputed from the kNN graph, so "more like this" on a click is an
+    array lookup rather than a vector query.
+    """
+
+    def __init__(self, rows: np.ndarray, distances: np.ndarray):
+        """
+        Initialize the table.
+
+        Args:
+            rows (np.ndarray): (n_rows, k) neighbour rows, nearest first,
+                -1 where there are fewer than k
+            distances (np.ndarray): (n_rows, k) cosine distances
+        """
+        self.rows = rows
+        self.distances = distances
+
+    @classmethod
+    def from_graph(
+        cls, graph, row_index: Dict[str, int], n_rows: int, k: int = 5
+    ) -> "NeighbourTable":
+        """
+        Translate a kNN graph (utils.knn_graph.KNNGraph) to projection rows,
+        dropping each point itself and chunks that are not projected.
+
+        Args:
+            graph (KNNGraph): Graph of the collection
+            row_index (Dict[str, int]): Result of build_row_index()
+            n_rows (int): Rows of the projection table
+            k (int, optional): Neighbours kept per point. Defaults to 5.
+
+        Returns:
+            NeighbourTable: The table
+        """
+        graph_rows = np.array(
+            [row_index.get(doc_id, -1) for doc_id in graph.ids], dtype=np.int64
+        )
+        candidates = graph_rows[np.asarray(graph.indices[:, 1:])]
+        distances = np.asarray(graph.distances[:, 1:], dtype=np.float32)
+
+        # Projected neighbours first, keeping their order
+        order = np.argsort(candidates < 0, axis=1, kind="stable")[:, :k]
+        candidates = np.take_along_axis(candidates, order, axis=1)
+        distances = np.take_along_axis(distances, order, axis=1)
+        distances[candidates < 0] = np.inf
+
+        width = candidates.shape[1]
+        rows = np.full((n_rows, width), -1, dtype=np.int64)
+        table_distances = np.full((n_rows, width), np.inf, dtype=np.float32)
+        projected = graph_rows >= 0
+        rows[graph_rows[projected]] = candidates[projected]
+        table_distances[graph_rows[projected]] = distances[projected]
+        return cls(rows, table_distances)
+
+    def lookup(self, row: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Neighbours of a projection row.
+
+        Args:
+            row (int): Row of the clicked point
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Neighbour rows (int64) and their
+                cosine distances, nearest first
+        """
+        if not 0 <= row < len(self.rows):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        found = self.rows[row] >= 0
+        return self.rows[row][found], self.distances[row][found]
@@ -0,0 +1,472 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.evaluation import recall_at_k
+from utils.quantized import exact_search
+
+# Rows assigned to centroids per block (and per pool task)
+ASSIGN_BLOCK = 16384
+
+
+def _assign_block(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Nearest centroid of every row (squared L2)."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    distances = np.einsum("ij,ij->i", centroids, centroids)[None, :] - 2.0 * (
+        vectors @ centroids.T
+    )
+    return distances.argmin(axis=1).astype(np.int32)
+
+
+@contextmanager
+def assignment_pool(workers: int = 1):
+    """
+    Process pool shared by every assignment pass of one build, so k-means
+    does not start new workers each iteration. Yields None for workers <= 1.
+
+    Args:
+        workers (int, optional): Worker processes. Defaults to 1.
+    """
+    if workers <= 1:
+        yield None
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield pool
+
+
+def assign(
+    vectors: np.ndarray,
+    centroids: np.ndarray,
+    pool: Optional[ProcessPoolExecutor] = None,
+) -> np.ndarray:
+    """
+    Nearest centroid of every vector, in blocks spread over a process pool.
+
+    Args:
+        vectors (np.ndarray): (n, d) vectors
+        centroids (np.ndarray): (k, d) centroids
+        pool (ProcessPoolExecutor, optional): Pool from assignment_pool.
+            Defaults to None (inline).
+
+    Returns:
+        np.ndarray: (n,) centroid numbers
+    """
+    blocks = [
+        vectors[start : start + ASSIGN_BLOCK]
+        for start in range(0, len(vectors), ASSIGN_BLOCK)
+    ]
+    # A single block is cheaper inline than pickled to a worker
+    if pool is None or len(blocks) == 1:
+        results = [_assign_block(block, centroids) for block in blocks]
+    else:
+        results = list(pool.map(_assign_block, blocks, [centroids] * len(blocks)))
+    return np.concatenate(results) if results else np.empty(0, dtype=np.int32)
+
+
+def kmeans(
+    vectors: np.ndarray,
+    n_lists: int,
+    iterations: int = 20,
+    sample_size: int = 100000,
+    seed: int = 0,
+    pool: Optional[ProcessPoolExecutor] = None,
+) -> np.ndarray:
+    """
+    Lloyd's k-means on a random sample, for the coarse quantizer.
+
+    Args:
+        vectors (np.ndarray): (n, d) vectors
+        n_lists (int): Number of centroids
+        iterations (int, optional): Lloyd iterations. Defaults to 20.
+        sample_size (int, optional): Rows used for training. Defaults to 100000.
+        seed (int, optional): Random seed. Defaults to 0.
+        pool (ProcessPoolExecutor, optional): Pool from assignment_pool,
+            reused by every iteration. Defaults to None (inline).
+
+    Returns:
+        np.ndarray: (n_lists, d) centroids
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    sample_rows = np.sort(rng.choice(n, size=min(n, sample_size), replace=False))
+    sample = np.asarray(vectors[sample_rows], dtype=np.float32)
+
+    centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = assign(sample, centroids, pool)
+        counts = np.bincount(labels, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # Re-seed empty lists with random sample points
+        if empty.any():
+            centroids[empty] = sample[rng.choice(len(sample), size=empty.sum())]
+
+    return centroids
+
+
+class IVFIndex:
+    """
+    Inverted-file index: vectors are grouped by their nearest k-means
+    centroid into contiguous posting lists, and a query scans only the
+    nprobe lists whose centroids are closest to it.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        centroids: np.ndarray,
+        offsets: np.ndarray,
+        vectors: np.ndarray,
+        nprobe: int = 8,
+    ):
+        """
+        Initialize the index.
+
+        Args:
+            ids (List[str]): Document ids, in posting-list order
+            centroids (np.ndarray): (k, d) coarse centroids
+            offsets (np.ndarray): (k + 1,) start row of each posting list
+            vectors (np.ndarray): (n, d) vectors in posting-list order, usually a memmap
+            nprobe (int, optional): Posting lists scanned per query. Defaults to 8.
+        """
+        self.ids = ids
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.nprobe = nprobe
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        ids: List[str],
+        embeddings: np.ndarray,
+        n_lists: Optional[int] = None,
+        iterations: int = 20,
+        workers: int = 1,
+        **kwargs,
+    ) -> "IVFIndex":
+        """
+        Train the coarse centroids and sort the vectors into posting lists.
+
+        Args:
+            ids (List[str]): Document ids
+            embeddings (np.ndarray): (n, d) embeddings aligned with ids
+            n_lists (int, optional): Number of posting lists.
+                Defaults to None (4 * sqrt(n)).
+            iterations (int, optional): k-means iterations. Defaults to 20.
+            workers (int, optional): Worker processes. Defaults to 1.
+            **kwargs: Passed to the constructor (nprobe)
+
+        Returns:
+            IVFIndex: The built index
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if n_lists is None:
+            n_lists = max(1, int(4 * np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+
+        with assignment_pool(workers) as pool:
+            centroids = kmeans(vectors, n_lists, iterations, pool=pool)
+            labels = assign(vectors, centroids, pool)
+
+        order = np.argsort(labels, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=n_lists), out=offsets[1:])
+
+        ids = [ids[row] for row in order]
+        return cls(ids, centroids, offsets, vectors[order], **kwargs)
+
+    def save(self, path: str) -> None:
+        """
+        Save the index to a directory. vectors.npy is memory-mapped on load.
+
+        Args:
+            path (str): Destination directory
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "ids.npy"), np.array(self.ids))
+        np.save(os.path.join(path, "centroids.npy"), self.centroids)
+        np.save(os.path.join(path, "offsets.npy"), self.offsets)
+        np.save(os.path.join(path, "vectors.npy"), np.asarray(self.vectors))
+        with open(os.path.join(path, "index.json"), "w") as f:
+            json.dump(
+                {
+                    "type": "ivf",
+                    "n_lists": self.n_lists,
+                    "nprobe": self.nprobe,
+                    "count": len(self.ids),
+                    "dimensions": int(self.vectors.shape[1]),
+                },
+                f,
+                indent=4,
+            )
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "IVFIndex":
+        """
+        Load an index saved with save().
+
+        Args:
+            path (str): Index directory
+            **kwargs: Override the saved constructor settings
+
+        Returns:
+            IVFIndex: The loaded index
+        """
+        with open(os.path.join(path, "index.json")) as f:
+            manifest = json.load(f)
+        settings = {"nprobe": manifest.get("nprobe", 8)}
+        settings.update(kwargs)
+
+        ids = np.load(os.path.join(path, "ids.npy")).tolist()
+        centroids = np.load(os.path.join(path, "centroids.npy"))
+        offsets = np.load(os.path.join(path, "offsets.npy"))
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+
+        return cls(ids, centroids, offsets, vectors, **settings)
+
+    def memory_bytes(self) -> Dict[str, int]:
+        """
+        Resident and memory-mapped sizes.
+
+        Returns:
+            Dict[str, int]: Bytes of the centroids and offsets (resident)
+                and of the posting lists (memory-mapped)
+        """
+        return {
+            "resident": self.centroids.nbytes + self.offsets.nbytes,
+            "posting_lists": int(np.prod(self.vectors.shape)) * 4,
+        }
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        top_k: int = 10,
+        nprobe: Optional[int] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        Scan the posting lists of the nprobe nearest centroids.
+
+        With a mask, disallowed rows are skipped before scoring, and more
+        lists are probed until at least top_k allowed rows are found.
+
+        Args:
+            query_embedding (Sequence[float]): Query vector
+            top_k (int, optional): Number of results. Defaults to 10.
+            nprobe (int, optional): Lists to scan. Defaults to self.nprobe.
+            mask (np.ndarray, optional): Boolean mask of the rows to search
+
+        Returns:
+            List[Tuple[str, float]]: (id, squared L2 distance) pairs, nearest first
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+
+        if mask is None:
+            lists, _ = exact_search(self.centroids, query, nprobe)
+        else:
+            lists, _ = exact_search(self.centroids, query, self.n_lists)
+            cumulative = np.concatenate([[0], np.cumsum(mask)])
+            allowed_per_list = (
+                cumulative[self.offsets[1:]] - cumulative[self.offsets[:-1]]
+            )
+            found = np.cumsum(allowed_per_list[lists])
+            needed = max(nprobe, int(np.searchsorted(found, top_k)) + 1)
+            lists = lists[:needed]
+
+        rows = np.concatenate(
+            [
+                np.arange(self.offsets[i], self.offsets[i + 1])
+                for i in np.sort(lists)  # sequential reads from the memmap
+            ]
+        )
+        if mask is not None:
+            rows = rows[mask[rows]]
+        if len(rows) == 0:
+            return []
+
+        order, distances = exact_search(self.vectors[rows], query, top_k)
+
+        return [
+            (self.ids[row], float(dist)) for row, dist in zip(rows[order], distances)
+        ]
+
+
+def sweep(
+    ids: List[str],
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    n_lists: Optional[int] = None,
+    nprobes: Sequence[int] = (1, 2, 4, 8, 16, 32, 64),
+    top_k: int = 10,
+    workers: int = 1,
+) -> Dict[str, object]:
+    """
+    Build time, memory, and QPS against recall@k for a range of nprobe.
+
+    Args:
+        ids (List[str]): Document ids
+        embeddings (np.ndarray): (n, d) embeddings
+        queries (np.ndarray): (q, d) query vectors
+        n_lists (int, optional): Number of posting lists. Defaults to 4 * sqrt(n).
+        nprobes (Sequence[int], optional): nprobe values to try
+        top_k (int, optional): Cutoff. Defaults to 10.
+        workers (int, optional): Worker processes for the build. Defaults to 1.
+
+    Returns:
+        Dict[str, object]: Build stats, the exact baseline and one row per nprobe
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+
+    start = time.perf_counter()
+    truth = []
+    for query in queries:
+        rows, _ = exact_search(vectors, query, top_k)
+        truth.append([ids[row] for row in rows])
+    exact_qps = len(queries) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    index = IVFIndex.build(ids, vectors, n_lists, workers=workers)
+    build_seconds = time.perf_counter() - start
+
+    rows = []
+    for nprobe in nprobes:
+        if nprobe > index.n_lists:
+            break
+        recalls = []
+        start = time.perf_counter()
+        for query, relevant in zip(queries, truth):
+            found = [doc_id for doc_id, _ in index.search(query, top_k, nprobe)]
+            recalls.append(recall_at_k(found, relevant, top_k))
+        elapsed = time.perf_counter() - start
+        rows.append(
+            {
+                "nprobe": nprobe,
+                "recall": float(np.mean(recalls)),
+                "qps": len(queries) / elapsed,
+            }
+        )
+
+    return {
+        "n_lists": index.n_lists,
+        "build_seconds": build_seconds,
+        "memory_bytes": index.memory_bytes(),
+        "exact_qps": exact_qps,
+        "nprobe": rows,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build or benchmark an IVF vector index"
+    )
+    parser.add_argument(
+        "--db_path",
+        type=str,
+        default="./data/chroma_cravo",
+        help="Path to ChromaDB directory",
+    )
+    parser.add_argument(
+        "--collection_name",
+        type=str,
+        default="cravo",
+        help="Name of the ChromaDB collection",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./data/embeddings/ivf_index",
+        help="Index directory",
+    )
+    parser.add_argument("--n_lists", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="Report build time, memory and QPS vs recall@k instead of building",
+    )
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--n_queries", type=int, default=200)
+    return parser.parse_args()
+
+
+def main():
+    import chromadb
+    from chromadb.config import Settings
+
+    args = parse_args()
+
+    client = chromadb.PersistentClient(
+        path=args.db_path, settings=Settings(anonymized_telemetry=False)
+    )
+    collection = client.get_collection(args.collection_name)
+    results = collection.get(include=["embeddings"])
+    embeddings = np.asarray(results["embeddings"], dtype=np.float32)
+
+    if not args.sweep:
+        start = time.perf_counter()
+        index = IVFIndex.build(
+            results["ids"],
+            embeddings,
+            args.n_lists,
+            workers=args.workers,
+            nprobe=args.nprobe,
+        )
+        index.save(args.output)
+        print(
+            f"Indexed {len(index.ids)} embeddings into {index.n_lists} lists "
+            f"in {time.perf_counter() - start:.1f}s ({args.output})"
+        )
+        return
+
+    # Stored vectors with a little noise stand in for real queries
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(embeddings), size=min(args.n_queries, len(embeddings)))
+    queries = embeddings[sample] + rng.normal(
+        scale=0.01, size=(len(sample), embeddings.shape[1])
+    ).astype(np.float32)
+
+    report = sweep(
+        results["ids"],
+        embeddings,
+        queries,
+        args.n_lists,
+        top_k=args.top_k,
+        workers=args.workers,
+    )
+    memory = report["memory_bytes"]
+    print(
+        f"{report['n_lists']} lists built in {report['build_seconds']:.1f}s, "
+        f"{memory['resident'] / 2**20:.1f} MiB resident, "
+        f"{memory['posting_lists'] / 2**20:.1f} MiB memory-mapped"
+    )
+    print(f"exact: {report['exact_qps']:.0f} QPS")
+    for row in report["nprobe"]:
+        print(
+            f"nprobe={row['nprobe']:>3}: recall@{args.top_k}={row['recall']:.3f} "
+            f"{row['qps']:.0f} QPS"
+        )
+
+
+if __name__ == "__main__":
+    main()
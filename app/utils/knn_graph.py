@@ -0,0 +1,435 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.ivf import IVFIndex
+
+# Rows per task, and columns scored against them at a time
+ROW_BLOCK = 1024
+COLUMN_BLOCK = 16384
+
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    """Unit-length float32 rows; zero rows stay zero."""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _knn_block(
+    vectors: np.ndarray, start: int, end: int, k: int, column_block: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact cosine kNN of rows start:end, streaming over column blocks."""
+    block = np.asarray(vectors[start:end])
+    best_rows = np.empty((len(block), 0), dtype=np.int64)
+    best_sims = np.empty((len(block), 0), dtype=np.float32)
+
+    for col_start in range(0, len(vectors), column_block):
+        columns = np.asarray(vectors[col_start : col_start + column_block])
+        sims = block @ columns.T
+        # Each row is its own first neighbour, even among duplicates
+        own = np.arange(start, end)
+        inside = (own >= col_start) & (own < col_start + len(columns))
+        sims[np.flatnonzero(inside), own[inside] - col_start] = 2.0
+
+        rows = np.broadcast_to(
+            np.arange(col_start, col_start + len(columns)), sims.shape
+        )
+        best_rows = np.hstack([best_rows, rows])
+        best_sims = np.hstack([best_sims, sims])
+        if best_sims.shape[1] > k:
+            keep = np.argpartition(-best_sims, k - 1, axis=1)[:, :k]
+            best_rows = np.take_along_axis(best_rows, keep, axis=1)
+            best_sims = np.take_along_axis(best_sims, keep, axis=1)
+
+    order = np.argsort(-best_sims, axis=1, kind="stable")
+    best_rows = np.take_along_axis(best_rows, order, axis=1)
+    distances = np.maximum(1.0 - np.take_along_axis(best_sims, order, axis=1), 0.0)
+    return best_rows.astype(np.int32), distances.astype(np.float32)
+
+
+def _ivf_knn(
+    vectors: np.ndarray, k: int, nprobe: int, workers: int, row_block: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Approximate cosine kNN of every row through an IVF index, a posting
+    list at a time: the rows probing a list are scored against it with
+    one matrix multiply and merged into their running top-k.
+    """
+    n = len(vectors)
+    index = IVFIndex.build(
+        [str(row) for row in range(n)], vectors, workers=workers, nprobe=nprobe
+    )
+    # Posting-list position -> row of vectors
+    list_rows = np.asarray(index.ids, dtype=np.int64)
+    nprobe = min(nprobe, index.n_lists)
+
+    # nprobe nearest centroids of every row (squared L2, as IVFIndex.search)
+    centroid_norms = np.einsum("ij,ij->i", index.centroids, index.centroids)
+    probes = np.empty((n, nprobe), dtype=np.int64)
+    for start in range(0, n, row_block):
+        scores = centroid_norms[None, :] - 2.0 * (
+            vectors[start : start + row_block] @ index.centroids.T
+        )
+        probes[start : start + row_block] = np.argpartition(scores, nprobe - 1, axis=1)[
+            :, :nprobe
+        ]
+
+    # Each row is its own first neighbour; unfilled slots stay at -inf
+    best_rows = np.repeat(np.arange(n, dtype=np.int64)[:, None], k, axis=1)
+    best_sims = np.full((n, k), -np.inf, dtype=np.float32)
+    best_sims[:, 0] = 2.0
+
+    # Rows probing each list, grouped by list
+    probing = np.argsort(probes.ravel(), kind="stable") // nprobe
+    bounds = np.concatenate(
+        [[0], np.cumsum(np.bincount(probes.ravel(), minlength=index.n_lists))]
+    )
+    for number in range(index.n_lists):
+        queries = probing[bounds[number] : bounds[number + 1]]
+        begin, end = index.offsets[number], index.offsets[number + 1]
+        if len(queries) == 0 or begin == end:
+            continue
+        members = list_rows[begin:end]
+        sims = vectors[queries] @ np.asarray(index.vectors[begin:end]).T
+        sims[queries[:, None] == members[None, :]] = -np.inf
+
+        candidate_rows = np.hstack(
+            [best_rows[queries], np.broadcast_to(members, sims.shape)]
+        )
+        candidate_sims = np.hstack([best_sims[queries], sims])
+        keep = np.argpartition(-candidate_sims, k - 1, axis=1)[:, :k]
+        best_rows[queries] = np.take_along_axis(candidate_rows, keep, axis=1)
+        best_sims[queries] = np.take_along_axis(candidate_sims, keep, axis=1)
+
+    order = np.argsort(-best_sims, axis=1, kind="stable")
+    best_rows = np.take_along_axis(best_rows, order, axis=1)
+    best_sims = np.take_along_axis(best_sims, order, axis=1)
+    # Fewer than k rows found: pad with the row itself, as the exact graph
+    unfilled = np.isneginf(best_sims)
+    best_rows[unfilled] = np.nonzero(unfilled)[0]
+    distances = np.where(unfilled, 0.0, np.maximum(1.0 - best_sims, 0.0))
+    return best_rows.astype(np.int32), distances.astype(np.float32)
+
+
+class KNNGraph:
+    """
+    The k nearest neighbours of every embedding by cosine distance, each
+    row listing itself first: the layout of UMAP's precomputed_knn. Built
+    once, saved as .npy files and memory-mapped on load, so UMAP fits,
+    parameter sweeps and neighbour lookups share it.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        indices: np.ndarray,
+        distances: np.ndarray,
+        exact: bool = True,
+    ):
+        """
+        Initialize the graph.
+
+        Args:
+            ids (List[str]): Document ids, one per row
+            indices (np.ndarray): (n, k) int32 neighbour rows, nearest first
+            distances (np.ndarray): (n, k) float32 cosine distances
+            exact (bool, optional): Whether neighbours are exact. Defaults to True.
+        """
+        self.ids = ids
+        self.indices = indices
+        self.distances = distances
+        self.exact = exact
+
+    @property
+    def k(self) -> int:
+        return self.indices.shape[1]
+
+    @classmethod
+    def build(
+        cls,
+        ids: List[str],
+        embeddings: np.ndarray,
+        k: int = 50,
+        workers: int = 1,
+        nprobe: Optional[int] = None,
+        row_block: int = ROW_BLOCK,
+        column_block: int = COLUMN_BLOCK,
+    ) -> "KNNGraph":
+        """
+        Compute the graph from normalized embeddings.
+
+        Exact graphs are a blocked matrix multiply: blocks of rows are
+        scored against blocks of columns in a thread pool (numpy releases
+        the GIL) and a running top-k is kept per row. With nprobe, an IVF
+        index answers the queries instead (approximate, for large corpora).
+
+        Args:
+            ids (List[str]): Document ids
+            embeddings (np.ndarray): (n, d) embeddings aligned with ids
+            k (int, optional): Neighbours per row, itself included. Defaults to 50.
+            workers (int, optional): Worker threads. Defaults to 1.
+            nprobe (Optional[int], optional): IVF lists probed per row;
+                None computes the exact graph. Defaults to None.
+            row_block (int, optional): Rows per task.
+            column_block (int, optional): Columns scored at a time.
+
+        Returns:
+            KNNGraph: The graph
+        """
+        vectors = normalize(embeddings)
+        k = min(k, len(vectors))
+        indices = np.empty((len(vectors), k), dtype=np.int32)
+        distances = np.empty((len(vectors), k), dtype=np.float32)
+
+        if nprobe is None:
+            starts = range(0, len(vectors), row_block)
+
+            def run(start):
+                end = min(start + row_block, len(vectors))
+                indices[start:end], distances[start:end] = _knn_block(
+                    vectors, start, end, k, column_block
+                )
+
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                list(pool.map(run, starts))
+            return cls(ids, indices, distances, exact=True)
+
+        indices[:], distances[:] = _ivf_knn(vectors, k, nprobe, workers, row_block)
+        return cls(ids, indices, distances, exact=False)
+
+    def save(self, path: str, embeddings: Optional[np.ndarray] = None) -> None:
+        """
+        Save the graph to a directory, optionally with the normalized
+        embeddings UMAP fits on.
+
+        Args:
+            path (str): Destination directory
+            embeddings (Optional[np.ndarray], optional): (n, d) embeddings
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "ids.npy"), np.array(self.ids))
+        np.save(os.path.join(path, "indices.npy"), np.asarray(self.indices))
+        np.save(os.path.join(path, "distances.npy"), np.asarray(self.distances))
+        if embeddings is not None:
+            np.save(os.path.join(path, "embeddings.npy"), normalize(embeddings))
+        with open(os.path.join(path, "graph.json"), "w") as f:
+            json.dump(
+                {
+                    "type": "knn_graph",
+                    "metric": "cosine",
+                    "k": self.k,
+                    "exact": self.exact,
+                    "count": len(self.ids),
+                },
+                f,
+                indent=4,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "KNNGraph":
+        """
+        Load a graph saved with save(); the arrays are memory-mapped.
+
+        Args:
+            path (str): Graph directory
+
+        Returns:
+            KNNGraph: The loaded graph
+        """
+        with open(os.path.join(path, "graph.json")) as f:
+            manifest = json.load(f)
+        return cls(
+            np.load(os.path.join(path, "ids.npy")).tolist(),
+            np.load(os.path.join(path, "indices.npy"), mmap_mode="r"),
+            np.load(os.path.join(path, "distances.npy"), mmap_mode="r"),
+            exact=manifest.get("exact", True),
+        )
+
+    def precomputed_knn(self, n_neighbors: int) -> Tuple[np.ndarray, np.ndarray, None]:
+        """
+        UMAP's precomputed_knn argument for a given n_neighbors.
+
+        Args:
+            n_neighbors (int): At most k
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, None]: Indices, distances and no
+                search index
+        """
+        if n_neighbors > self.k:
+            raise ValueError(f"The graph has only {self.k} neighbours per row")
+        return (
+            np.ascontiguousarray(self.indices[:, :n_neighbors]),
+            np.ascontiguousarray(self.distances[:, :n_neighbors]),
+            None,
+        )
+
+
+def fit_umap(
+    graph: KNNGraph,
+    embeddings: np.ndarray,
+    n_neighbors: int = 15,
+    min_dist: float = 0.1,
+    random_state: Optional[int] = 42,
+    **kwargs,
+) -> np.ndarray:
+    """
+    2-D UMAP projection on the cached kNN graph.
+
+    Args:
+        graph (KNNGraph): Graph of the embeddings
+        embeddings (np.ndarray): (n, d) embeddings, rows aligned with the graph
+        n_neighbors (int, optional): UMAP n_neighbors. Defaults to 15.
+        min_dist (float, optional): UMAP min_dist. Defaults to 0.1.
+        random_state (Optional[int], optional): Seed. Defaults to 42.
+        **kwargs: Passed to umap.UMAP
+
+    Returns:
+        np.ndarray: (n, 2) coordinates
+    """
+    import umap
+
+    reducer = umap.UMAP(
+        n_components=2,
+        n_neighbors=n_neighbors,
+        min_dist=min_dist,
+        metric="cosine",
+        precomputed_knn=graph.precomputed_knn(n_neighbors),
+        random_state=random_state,
+        **kwargs,
+    )
+    return reducer.fit_transform(embeddings)
+
+
+def _fit_saved(path: str, n_neighbors: int, min_dist: float) -> Dict[str, object]:
+    """Fit one sweep combination in a worker; the graph is memory-mapped."""
+    graph = KNNGraph.load(path)
+    embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode="r")
+    start = time.perf_counter()
+    coordinates = fit_umap(graph, embeddings, n_neighbors, min_dist)
+    return {
+        "n_neighbors": n_neighbors,
+        "min_dist": min_dist,
+        "seconds": time.perf_counter() - start,
+        "coordinates": coordinates,
+    }
+
+
+def sweep(
+    path: str,
+    n_neighbors: Sequence[int] = (5, 15, 30, 50),
+    min_dists: Sequence[float] = (0.0, 0.1, 0.5),
+    workers: int = 1,
+) -> List[Dict[str, object]]:
+    """
+    UMAP projections for a grid of parameters, in a process pool that
+    shares one saved graph through the page cache.
+
+    Args:
+        path (str): Graph directory, saved with its embeddings
+        n_neighbors (Sequence[int], optional): Values to try, each at most k
+        min_dists (Sequence[float], optional): Values to try
+        workers (int, optional): Worker processes. Defaults to 1.
+
+    Returns:
+        List[Dict[str, object]]: n_neighbors, min_dist, seconds and
+            coordinates of every combination
+    """
+    grid = list(itertools.product(n_neighbors, min_dists))
+    if workers <= 1:
+        return [_fit_saved(path, n, d) for n, d in grid]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(
+            pool.map(
+                _fit_saved,
+                [path] * len(grid),
+                [n for n, _ in grid],
+                [d for _, d in grid],
+            )
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build the kNN graph of a collection, or sweep UMAP on it"
+    )
+    parser.add_argument(
+        "--db_path",
+        type=str,
+        default="./data/chroma_cravo",
+        help="Path to ChromaDB directory",
+    )
+    parser.add_argument(
+        "--collection_name",
+        type=str,
+        default="cravo",
+        help="Name of the ChromaDB collection",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./data/embeddings/knn_graph",
+        help="Graph directory",
+    )
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        default=None,
+        help="Build an approximate graph with an IVF index",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="Fit UMAP for a parameter grid on a saved graph instead of building",
+    )
+    parser.add_argument("--n_neighbors", type=int, nargs="+", default=[5, 15, 30, 50])
+    parser.add_argument("--min_dist", type=float, nargs="+", default=[0.0, 0.1, 0.5])
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.sweep:
+        for result in sweep(args.output, args.n_neighbors, args.min_dist, args.workers):
+            name = f"umap_{result['n_neighbors']}_{result['min_dist']}.npy"
+            np.save(os.path.join(args.output, name), result["coordinates"])
+            print(f"{name}: {result['seconds']:.1f}s")
+        return
+
+    import chromadb
+    from chromadb.config import Settings
+
+    client = chromadb.PersistentClient(
+        path=args.db_path, settings=Settings(anonymized_telemetry=False)
+    )
+    results = client.get_collection(args.collection_name).get(include=["embeddings"])
+    embeddings = np.asarray(results["embeddings"], dtype=np.float32)
+
+    start = time.perf_counter()
+    graph = KNNGraph.build(
+        results["ids"], embeddings, args.k, workers=args.workers, nprobe=args.nprobe
+    )
+    graph.save(args.output, embeddings)
+    print(
+        f"Built the {'exact' if graph.exact else 'approximate'} {graph.k}-NN graph "
+        f"of {len(graph.ids)} embeddings in {time.perf_counter() - start:.1f}s "
+        f"({args.output})"
+    )
+
+
+if __name__ == "__main__":
+    main()
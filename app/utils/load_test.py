@@ -0,0 +1,244 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import chromadb
+from chromadb.config import Settings
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.create_test_db import create_collection, fake_embedding, load_json_documents
+from utils.embeddings import OpenAIEmbedding
+from utils.evaluation import latency_percentiles
+from utils.generator import OpenAIGenerator
+from utils.resilience import configure_admission, get_admission, upstream_session
+from utils.retriever import ChromaDBRetriever
+from utils.stub_server import DEFAULT_DIMENSIONS, MODEL_DIMENSIONS, StubServer
+from utils.tracing import get_tracer, span
+
+DEFAULT_QUESTIONS = [
+    "O que foi a Revolução dos Cravos?",
+    "Quem foi Salgueiro Maia?",
+    "What was the role of the MFA?",
+    "Que televisões cobriram o Verão Quente?",
+    "Como terminou o Estado Novo?",
+]
+
+DEMO_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+    "notebooks",
+    "demo_relevant.json",
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Simulate concurrent chat sessions through the retriever and generator"
+    )
+    parser.add_argument(
+        "--base_url",
+        type=str,
+        default=None,
+        help="OpenAI-compatible endpoint. Defaults to an in-process stub server.",
+    )
+    parser.add_argument(
+        "--db_path",
+        type=str,
+        default=None,
+        help="ChromaDB directory. Defaults to a temporary fixture collection.",
+    )
+    parser.add_argument("--collection_name", type=str, default="load_test")
+    parser.add_argument("--sessions", type=int, default=10, help="Concurrent sessions")
+    parser.add_argument("--turns", type=int, default=5, help="Chat turns per session")
+    parser.add_argument("--top_k", type=int, default=5)
+    parser.add_argument("--embedding_model", type=str, default="text-embedding-3-small")
+    parser.add_argument("--model", type=str, default="gpt-4o")
+    parser.add_argument("--latency_ms", type=float, default=50.0)
+    parser.add_argument("--jitter_ms", type=float, default=50.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument(
+        "--max_concurrent",
+        type=int,
+        default=None,
+        help="Upstream calls outstanding at once (admission control)",
+    )
+    parser.add_argument(
+        "--rate_per_s",
+        type=float,
+        default=None,
+        help="Upstream calls per second (admission control)",
+    )
+    parser.add_argument("--output", type=str, default=None, help="Write report as JSON")
+    return parser.parse_args()
+
+
+def build_fixture_collection(db_path: str, collection_name: str, dimensions: int):
+    """
+    Create a collection from the demo documents, embedded the same way the
+    stub server embeds queries.
+    """
+    demo = load_json_documents(DEMO_PATH)
+    client = chromadb.PersistentClient(
+        path=db_path, settings=Settings(anonymized_telemetry=False)
+    )
+    embeddings = [fake_embedding(doc, dimensions) for doc in demo["documents"]]
+    create_collection(
+        client,
+        collection_name,
+        demo["documents"],
+        embeddings,
+        demo["ids"],
+        demo["metadatas"],
+    )
+
+
+def run_session(
+    retriever: ChromaDBRetriever,
+    generator: OpenAIGenerator,
+    questions: List[str],
+    turns: int,
+    top_k: int,
+    session_id: str = None,
+) -> List[Dict[str, Any]]:
+    """
+    Run one simulated chat session.
+
+    Returns:
+        List[Dict[str, Any]]: Per-turn stage timings in milliseconds
+    """
+    records = []
+    for turn in range(turns):
+        question = questions[turn % len(questions)]
+        record = {"error": None}
+        start = time.perf_counter()
+        try:
+            with span("chat_turn"), upstream_session(session_id):
+                with span("retrieve", top_k=top_k):
+                    docs = retriever.retrieve(question, top_k=top_k)
+                retrieved = time.perf_counter()
+                record["retrieve"] = (retrieved - start) * 1000
+
+                with span("generate"):
+                    generator.generate_response(question, docs)
+                record["generate"] = (time.perf_counter() - retrieved) * 1000
+        except Exception as e:
+            record["error"] = type(e).__name__
+        record["turn"] = (time.perf_counter() - start) * 1000
+        records.append(record)
+
+    return records
+
+
+def summarize(records: List[Dict[str, Any]], wall_seconds: float) -> Dict[str, Any]:
+    """
+    Aggregate turn records into throughput and per-stage tail latency.
+    """
+    report = {
+        "turns": len(records),
+        "errors": sum(1 for r in records if r["error"]),
+        "wall_seconds": wall_seconds,
+        "throughput_turns_per_s": len(records) / wall_seconds if wall_seconds else 0.0,
+        "stages": {},
+    }
+    for stage in ("retrieve", "generate", "turn"):
+        values = [r[stage] for r in records if stage in r and not r["error"]]
+        report["stages"][stage] = latency_percentiles(values)
+
+    # Finer-grained stages (embedding, chroma_query, safety_check, ...)
+    report["spans"] = get_tracer().stage_stats()
+    report["admission"] = get_admission().stats()
+
+    return report
+
+
+def main():
+    args = parse_args()
+
+    stub = None
+    base_url = args.base_url
+    if base_url is None:
+        stub = StubServer(
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+        ).start()
+        base_url = stub.base_url
+        print(f"Started stub server at {base_url}")
+
+    db_path = args.db_path
+    if db_path is None:
+        db_path = tempfile.mkdtemp(prefix="cravo_load_")
+        dimensions = MODEL_DIMENSIONS.get(args.embedding_model, DEFAULT_DIMENSIONS)
+        build_fixture_collection(db_path, args.collection_name, dimensions)
+
+    configure_admission(max_concurrent=args.max_concurrent, rate_per_s=args.rate_per_s)
+
+    api_key = os.getenv("OPENAI_API_KEY", "stub")
+    retriever = ChromaDBRetriever(
+        db_path=db_path,
+        collection_name=args.collection_name,
+        embedding=OpenAIEmbedding(
+            api_key=api_key, model=args.embedding_model, base_url=base_url
+        ),
+    )
+    generator = OpenAIGenerator(api_key=api_key, model=args.model, base_url=base_url)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        futures = [
+            pool.submit(
+                run_session,
+                retriever,
+                generator,
+                DEFAULT_QUESTIONS[i % len(DEFAULT_QUESTIONS) :] + DEFAULT_QUESTIONS,
+                args.turns,
+                args.top_k,
+                f"session-{i}",
+            )
+            for i in range(args.sessions)
+        ]
+        records = [record for future in futures for record in future.result()]
+    wall_seconds = time.perf_counter() - start
+
+    report = summarize(records, wall_seconds)
+    report["sessions"] = args.sessions
+
+    print(
+        f"{report['turns']} turns in {wall_seconds:.2f}s "
+        f"({report['throughput_turns_per_s']:.2f} turns/s, {report['errors']} errors)"
+    )
+    for stage, stats in report["stages"].items():
+        print(
+            f"{stage:>18}: p50={stats['p50_ms']:.1f}ms "
+            f"p95={stats['p95_ms']:.1f}ms p99={stats['p99_ms']:.1f}ms"
+        )
+    for stage, stats in report["spans"].items():
+        if stage not in report["stages"]:
+            print(
+                f"{stage:>18}: p50={stats['p50_ms']:.1f}ms "
+                f"p95={stats['p95_ms']:.1f}ms"
+            )
+
+    admission = report["admission"]
+    print(
+        f"{'admission':>18}: max queue={admission['max_queue_depth']} "
+        f"wait p50={admission['p50_ms']:.1f}ms p95={admission['p95_ms']:.1f}ms "
+        f"rejected={admission['rejected']}"
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if stub is not None:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,329 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.evaluation import latency_percentiles, recall_at_k
+from utils.quantized import exact_search
+
+DEFAULT_PREFIX_DIMENSIONS = 256
+SWEEP_PREFIX_DIMENSIONS = [64, 128, 256, 512, 1024]
+
+
+def truncate(embeddings: np.ndarray, dimensions: int) -> np.ndarray:
+    """
+    Shorten text-embedding-3 vectors the way the API's ``dimensions``
+    parameter does: keep the leading components and renormalize.
+
+    Args:
+        embeddings (np.ndarray): (n, d) or (d,) embeddings
+        dimensions (int): Prefix length
+
+    Returns:
+        np.ndarray: Unit-length prefixes, float32
+    """
+    prefix = np.asarray(embeddings, dtype=np.float32)[..., :dimensions]
+    norms = np.linalg.norm(prefix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return prefix / norms
+
+
+class MatryoshkaIndex:
+    """
+    Two-stage search over Matryoshka embeddings: a resident matrix of
+    short prefixes shortlists candidates, which are rescored with the
+    full-width vectors memory-mapped from disk.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        prefixes: np.ndarray,
+        vectors: np.ndarray,
+        rescore_factor: int = 10,
+    ):
+        """
+        Initialize the index.
+
+        Args:
+            ids (List[str]): Document ids, indexed by row
+            prefixes (np.ndarray): (n, p) renormalized prefix vectors
+            vectors (np.ndarray): (n, d) full-width vectors, usually a memmap
+            rescore_factor (int, optional): Candidates rescored per requested
+                result. Defaults to 10.
+        """
+        self.ids = ids
+        self.prefixes = prefixes
+        self.vectors = vectors
+        self.rescore_factor = rescore_factor
+
+    @property
+    def prefix_dimensions(self) -> int:
+        return self.prefixes.shape[1]
+
+    @classmethod
+    def build(
+        cls,
+        ids: List[str],
+        embeddings: np.ndarray,
+        prefix_dimensions: int = DEFAULT_PREFIX_DIMENSIONS,
+        **kwargs,
+    ) -> "MatryoshkaIndex":
+        """
+        Build the prefix matrix from full-width embeddings.
+
+        Args:
+            ids (List[str]): Document ids
+            embeddings (np.ndarray): (n, d) embeddings aligned with ids
+            prefix_dimensions (int, optional): Prefix length. Defaults to 256.
+            **kwargs: Passed to the constructor (rescore_factor)
+
+        Returns:
+            MatryoshkaIndex: The built index
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        return cls(list(ids), truncate(vectors, prefix_dimensions), vectors, **kwargs)
+
+    def save(self, path: str) -> None:
+        """
+        Save the index to a directory: prefixes.npy is loaded into memory,
+        vectors.npy is memory-mapped for rescoring.
+
+        Args:
+            path (str): Destination directory
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "ids.npy"), np.array(self.ids))
+        np.save(os.path.join(path, "prefixes.npy"), self.prefixes)
+        np.save(os.path.join(path, "vectors.npy"), np.asarray(self.vectors))
+        with open(os.path.join(path, "index.json"), "w") as f:
+            json.dump(
+                {
+                    "type": "matryoshka",
+                    "prefix_dimensions": self.prefix_dimensions,
+                    "rescore_factor": self.rescore_factor,
+                    "count": len(self.ids),
+                    "dimensions": int(self.vectors.shape[1]),
+                },
+                f,
+                indent=4,
+            )
+
+    @classmethod
+    def load(cls, path: str, **kwargs) -> "MatryoshkaIndex":
+        """
+        Load an index saved with save().
+
+        Args:
+            path (str): Index directory
+            **kwargs: Override the saved constructor settings
+
+        Returns:
+            MatryoshkaIndex: The loaded index
+        """
+        with open(os.path.join(path, "index.json")) as f:
+            manifest = json.load(f)
+        settings = {"rescore_factor": manifest.get("rescore_factor", 10)}
+        settings.update(kwargs)
+
+        ids = np.load(os.path.join(path, "ids.npy")).tolist()
+        prefixes = np.load(os.path.join(path, "prefixes.npy"))
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+
+        return cls(ids, prefixes, vectors, **settings)
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        top_k: int = 10,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        Shortlist by prefix distance, then rescore with full vectors.
+
+        Args:
+            query_embedding (Sequence[float]): Full-width query vector
+            top_k (int, optional): Number of results. Defaults to 10.
+            mask (np.ndarray, optional): Boolean mask of the rows to search
+
+        Returns:
+            List[Tuple[str, float]]: (id, squared L2 distance) pairs, nearest first
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        prefix_query = truncate(query, self.prefix_dimensions)
+        n_candidates = top_k * self.rescore_factor
+
+        if mask is None:
+            rows, _ = exact_search(self.prefixes, prefix_query, n_candidates)
+        else:
+            allowed = np.flatnonzero(mask)
+            best, _ = exact_search(self.prefixes[allowed], prefix_query, n_candidates)
+            rows = allowed[best]
+
+        rows = np.sort(rows)  # sequential reads from the memmap
+        order, distances = exact_search(self.vectors[rows], query, top_k)
+
+        return [
+            (self.ids[row], float(dist)) for row, dist in zip(rows[order], distances)
+        ]
+
+
+def sweep(
+    ids: List[str],
+    embeddings: np.ndarray,
+    queries: np.ndarray,
+    prefix_dimensions: List[int] = SWEEP_PREFIX_DIMENSIONS,
+    top_k: int = 10,
+    rescore_factor: int = 10,
+) -> List[Dict[str, float]]:
+    """
+    Recall@k against exact full-width search and latency per prefix size.
+
+    Args:
+        ids (List[str]): Document ids
+        embeddings (np.ndarray): (n, d) full-width embeddings
+        queries (np.ndarray): (q, d) query vectors
+        prefix_dimensions (List[int], optional): Prefix sizes to try
+        top_k (int, optional): Cutoff. Defaults to 10.
+        rescore_factor (int, optional): Candidates rescored per result. Defaults to 10.
+
+    Returns:
+        List[Dict[str, float]]: One row per prefix size, plus an exact
+            baseline: rows rescored with full vectors per query, recall
+            and latency
+    """
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    truth, exact_latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        rows, _ = exact_search(vectors, query, top_k)
+        exact_latencies.append((time.perf_counter() - start) * 1000)
+        truth.append([ids[row] for row in rows])
+
+    report = [
+        {
+            "prefix_dimensions": vectors.shape[1],
+            "candidates": len(vectors),
+            "recall": 1.0,
+            **latency_percentiles(exact_latencies),
+        }
+    ]
+
+    for dimensions in prefix_dimensions:
+        if dimensions >= vectors.shape[1]:
+            continue
+        index = MatryoshkaIndex.build(
+            ids, vectors, dimensions, rescore_factor=rescore_factor
+        )
+        recalls, latencies = [], []
+        for query, relevant in zip(queries, truth):
+            start = time.perf_counter()
+            found = [doc_id for doc_id, _ in index.search(query, top_k)]
+            latencies.append((time.perf_counter() - start) * 1000)
+            recalls.append(recall_at_k(found, relevant, top_k))
+
+        report.append(
+            {
+                "prefix_dimensions": dimensions,
+                "candidates": min(top_k * index.rescore_factor, len(vectors)),
+                "recall": float(np.mean(recalls)),
+                **latency_percentiles(latencies),
+            }
+        )
+
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build or benchmark a two-stage Matryoshka prefix index"
+    )
+    parser.add_argument(
+        "--db_path",
+        type=str,
+        default="./data/chroma_cravo",
+        help="Path to ChromaDB directory",
+    )
+    parser.add_argument(
+        "--collection_name",
+        type=str,
+        default="cravo",
+        help="Name of the ChromaDB collection",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./data/embeddings/matryoshka_index",
+        help="Index directory",
+    )
+    parser.add_argument(
+        "--prefix_dimensions", type=int, default=DEFAULT_PREFIX_DIMENSIONS
+    )
+    parser.add_argument("--rescore_factor", type=int, default=10)
+    parser.add_argument(
+        "--sweep",
+        action="store_true",
+        help="Report recall@k and latency across prefix sizes instead of building",
+    )
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--n_queries", type=int, default=200)
+    return parser.parse_args()
+
+
+def main():
+    import chromadb
+    from chromadb.config import Settings
+
+    args = parse_args()
+
+    client = chromadb.PersistentClient(
+        path=args.db_path, settings=Settings(anonymized_telemetry=False)
+    )
+    collection = client.get_collection(args.collection_name)
+    results = collection.get(include=["embeddings"])
+    embeddings = np.asarray(results["embeddings"], dtype=np.float32)
+
+    if not args.sweep:
+        index = MatryoshkaIndex.build(
+            results["ids"],
+            embeddings,
+            args.prefix_dimensions,
+            rescore_factor=args.rescore_factor,
+        )
+        index.save(args.output)
+        print(
+            f"Indexed {len(index.ids)} embeddings with "
+            f"{index.prefix_dimensions}-d prefixes into {args.output}"
+        )
+        return
+
+    # Stored vectors with a little noise stand in for real queries
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(embeddings), size=min(args.n_queries, len(embeddings)))
+    queries = embeddings[sample]
+    queries = truncate(
+        queries + rng.normal(scale=0.01, size=queries.shape), queries.shape[1]
+    )
+
+    for row in sweep(
+        results["ids"],
+        embeddings,
+        queries,
+        top_k=args.top_k,
+        rescore_factor=args.rescore_factor,
+    ):
+        print(
+            f"{row['prefix_dimensions']:>5}-d: recall@{args.top_k}={row['recall']:.3f} "
+            f"p50={row['p50_ms']:.2f}ms p95={row['p95_ms']:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
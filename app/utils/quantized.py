@@ -0,0 +1,432 @@
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.evaluation import recall_at_k
+
+# Rows converted to float32 at a time during the int8 scan
+SCAN_BLOCK = 16384
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def popcount(bits: np.ndarray) -> np.ndarray:
+    """
+    Number of set bits per row of a packed uint8 matrix.
+
+    Args:
+        bits (np.ndarray): (n, n_bytes) uint8 array
+
+    Returns:
+        np.ndarray: (n,) bit counts
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT[bits].sum(axis=1, dtype=np.int32)
+
+
+def exact_search(
+    vectors: np.ndarray, query: np.ndarray, top_k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Brute-force squared L2 search (Chroma's default distance).
+
+    Args:
+        vectors (np.ndarray): (n, d) float matrix
+        query (np.ndarray): (d,) query vector
+        top_k (int): Number of results
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Row numbers and distances, nearest first
+    """
+    distances = _squared_l2(vectors, query)
+    return _top_k(distances, top_k)
+
+
+def _squared_l2(vectors: np.ndarray, query: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return (
+        np.einsum("ij,ij->i", vectors, vectors)
+        - 2.0 * (vectors @ query)
+        + float(query @ query)
+    )
+
+
+def _top_k(scores: np.ndarray, top_k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Rows of the top_k smallest scores, sorted ascending."""
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=scores.dtype)
+    rows = np.argpartition(scores, top_k - 1)[:top_k]
+    rows = rows[np.argsort(scores[rows], kind="stable")]
+    return rows, scores[rows]
+
+
+class QuantizedIndex:
+    """
+    Compact in-memory embedding store: int8 scalar codes (4x smaller than
+    float32) or 1-bit sign codes (32x smaller). A first pass over the
+    codes picks candidates that are rescored with the full-precision
+    vectors, which stay on disk and are memory-mapped. A loaded index
+    keeps only the codes of its mode in memory.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        int8_codes: Optional[np.ndarray],
+        scales: np.ndarray,
+        binary_codes: Optional[np.ndarray],
+        vectors: np.ndarray,
+        mode: str = "binary",
+        rescore_factor: int = 10,
+    ):
+        """
+        Initialize the index.
+
+        Args:
+            ids (List[str]): Document ids, indexed by row
+            int8_codes (Optional[np.ndarray]): (n, d) int8 scalar-quantized
+                vectors, None when not loaded
+            scales (np.ndarray): (d,) per-dimension dequantization scales
+            binary_codes (Optional[np.ndarray]): (n, d / 8) packed sign bits,
+                None when not loaded
+            vectors (np.ndarray): (n, d) full-precision vectors, usually a memmap
+            mode (str, optional): First-pass scan, "binary" or "int8". Defaults to "binary".
+            rescore_factor (int, optional): Candidates rescored per requested
+                result. Defaults to 10.
+        """
+        self.ids = ids
+        self.int8_codes = int8_codes
+        self.scales = scales
+        self.binary_codes = binary_codes
+        self.vectors = vectors
+        self.mode = mode
+        self.rescore_factor = rescore_factor
+
+    @classmethod
+    def build(
+        cls, ids: List[str], embeddings: np.ndarray, **kwargs
+    ) -> "QuantizedIndex":
+        """
+        Quantize a matrix of embeddings into both code sets, to be saved.
+
+        Args:
+            ids (List[str]): Document ids
+            embeddings (np.ndarray): (n, d) embeddings aligned with ids
+            **kwargs: Passed to the constructor (mode, rescore_factor)
+
+        Returns:
+            QuantizedIndex: The built index
+        """
+        vectors = np.asarray(embeddings, dtype=np.float32)
+
+        # Symmetric per-dimension scaling onto [-127, 127]
+        scales = np.abs(vectors).max(axis=0) / 127.0
+        scales[scales == 0] = 1.0
+        int8_codes = np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8)
+
+        binary_codes = np.packbits(vectors > 0, axis=1)
+
+        return cls(list(ids), int8_codes, scales, binary_codes, vectors, **kwargs)
+
+    def save(self, path: str) -> None:
+        """
+        Save the index to a directory: codes.npz holds the codes of both
+        modes, vectors.npy the full-precision vectors for memory-mapped
+        rescoring.
+
+        Args:
+            path (str): Destination directory
+        """
+        if self.int8_codes is None or self.binary_codes is None:
+            raise ValueError("Only an index with the codes of both modes is saved")
+        os.makedirs(path, exist_ok=True)
+        np.savez(
+            os.path.join(path, "codes.npz"),
+            ids=np.array(self.ids),
+            int8_codes=self.int8_codes,
+            scales=self.scales,
+            binary_codes=self.binary_codes,
+        )
+        np.save(os.path.join(path, "vectors.npy"), np.asarray(self.vectors))
+        with open(os.path.join(path, "index.json"), "w") as f:
+            json.dump(
+                {
+                    "type": "quantized",
+                    "mode": self.mode,
+                    "rescore_factor": self.rescore_factor,
+                    "count": len(self.ids),
+                    "dimensions": int(self.int8_codes.shape[1]),
+                },
+                f,
+                indent=4,
+            )
+
+    @classmethod
+    def load(
+        cls, path: str, modes: Optional[Sequence[str]] = None, **kwargs
+    ) -> "QuantizedIndex":
+        """
+        Load an index saved with save(). Only the codes of the given modes
+        are read into memory; the full-precision vectors are memory-mapped.
+
+        Args:
+            path (str): Index directory
+            modes (Optional[Sequence[str]], optional): Code sets to load,
+                e.g. ["binary", "int8"] to compare them. Defaults to the mode.
+            **kwargs: Override the saved constructor settings
+
+        Returns:
+            QuantizedIndex: The loaded index
+        """
+        with open(os.path.join(path, "index.json")) as f:
+            manifest = json.load(f)
+        settings = {
+            "mode": manifest.get("mode", "binary"),
+            "rescore_factor": manifest.get("rescore_factor", 10),
+        }
+        settings.update(kwargs)
+        modes = set(modes or [settings["mode"]])
+
+        # Members of an .npz are only read when accessed
+        with np.load(os.path.join(path, "codes.npz")) as data:
+            ids = data["ids"].tolist()
+            scales = data["scales"]
+            int8_codes = data["int8_codes"] if "int8" in modes else None
+            binary_codes = data["binary_codes"] if "binary" in modes else None
+
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+
+        return cls(ids, int8_codes, scales, binary_codes, vectors, **settings)
+
+    def memory_bytes(self) -> Dict[str, int]:
+        """
+        Resident size of what the index holds.
+
+        Returns:
+            Dict[str, int]: Bytes of the loaded int8 and binary codes (0 when
+                not loaded), the scales, the float32 vectors when in memory,
+                their total ("resident"), and the memory-mapped vectors
+        """
+        mapped = isinstance(self.vectors, np.memmap)
+        vector_bytes = int(np.prod(self.vectors.shape)) * 4
+        sizes = {
+            "int8": 0 if self.int8_codes is None else self.int8_codes.nbytes,
+            "binary": 0 if self.binary_codes is None else self.binary_codes.nbytes,
+            "scales": self.scales.nbytes,
+            "float32": 0 if mapped else vector_bytes,
+        }
+        sizes["resident"] = sum(sizes.values())
+        sizes["memory_mapped"] = vector_bytes if mapped else 0
+        return sizes
+
+    def candidates(
+        self,
+        query: np.ndarray,
+        n_candidates: int,
+        mode: Optional[str] = None,
+        rows: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        First-pass scan over the compact codes.
+
+        Args:
+            query (np.ndarray): (d,) query vector
+            n_candidates (int): Number of candidate rows
+            mode (str, optional): "binary" or "int8". Defaults to self.mode.
+            rows (np.ndarray, optional): Scan only these rows. Defaults to all.
+
+        Returns:
+            np.ndarray: Candidate row numbers
+        """
+        mode = mode or self.mode
+
+        if mode == "binary":
+            if self.binary_codes is None:
+                raise ValueError("The binary codes are not loaded")
+            codes = self.binary_codes if rows is None else self.binary_codes[rows]
+            hamming = popcount(np.bitwise_xor(codes, np.packbits(query > 0)))
+            best, _ = _top_k(hamming, n_candidates)
+
+        elif mode == "int8":
+            if self.int8_codes is None:
+                raise ValueError("The int8 codes are not loaded")
+            # Inner product against the dequantized codes, one block at a time
+            codes = self.int8_codes if rows is None else self.int8_codes[rows]
+            scaled_query = (query * self.scales).astype(np.float32)
+            scores = np.empty(len(codes), dtype=np.float32)
+            for start in range(0, len(codes), SCAN_BLOCK):
+                block = codes[start : start + SCAN_BLOCK]
+                scores[start : start + len(block)] = block.astype(np.float32) @ (
+                    scaled_query
+                )
+            best, _ = _top_k(-scores, n_candidates)
+
+        else:
+            raise ValueError(f"Unknown quantization mode '{mode}'")
+
+        return best if rows is None else rows[best]
+
+    def search(
+        self,
+        query_embedding: Sequence[float],
+        top_k: int = 10,
+        mode: Optional[str] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        Approximate nearest neighbours, rescored with full-precision vectors.
+
+        Args:
+            query_embedding (Sequence[float]): Query vector
+            top_k (int, optional): Number of results. Defaults to 10.
+            mode (str, optional): "binary" or "int8". Defaults to self.mode.
+            mask (np.ndarray, optional): Boolean mask of the rows to search
+
+        Returns:
+            List[Tuple[str, float]]: (id, squared L2 distance) pairs, nearest first
+        """
+        query = np.asarray(query_embedding, dtype=np.float32)
+        allowed = None if mask is None else np.flatnonzero(mask)
+        rows = self.candidates(query, top_k * self.rescore_factor, mode, allowed)
+
+        rows = np.sort(rows)  # sequential reads from the memmap
+        order, distances = exact_search(self.vectors[rows], query, top_k)
+
+        return [
+            (self.ids[row], float(dist)) for row, dist in zip(rows[order], distances)
+        ]
+
+
+def recall_vs_exact(
+    index: QuantizedIndex,
+    queries: np.ndarray,
+    top_k: int = 10,
+    mode: Optional[str] = None,
+) -> Dict[str, float]:
+    """
+    Recall@k of the quantized search against exact float search.
+
+    Args:
+        index (QuantizedIndex): Index to evaluate
+        queries (np.ndarray): (q, d) query vectors
+        top_k (int, optional): Cutoff. Defaults to 10.
+        mode (str, optional): "binary" or "int8". Defaults to index.mode.
+
+    Returns:
+        Dict[str, float]: recall and mean latency (ms) of both searches
+    """
+    vectors = np.asarray(index.vectors)
+    recalls, approx_ms, exact_ms = [], [], []
+
+    for query in queries:
+        start = time.perf_counter()
+        rows, _ = exact_search(vectors, query, top_k)
+        exact_ms.append((time.perf_counter() - start) * 1000)
+        truth = [index.ids[row] for row in rows]
+
+        start = time.perf_counter()
+        approx = [doc_id for doc_id, _ in index.search(query, top_k, mode=mode)]
+        approx_ms.append((time.perf_counter() - start) * 1000)
+
+        recalls.append(recall_at_k(approx, truth, top_k))
+
+    return {
+        "recall": float(np.mean(recalls)),
+        "approx_ms": float(np.mean(approx_ms)),
+        "exact_ms": float(np.mean(exact_ms)),
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Build and benchmark a quantized embedding index"
+    )
+    parser.add_argument(
+        "--db_path",
+        type=str,
+        default="./data/chroma_cravo",
+        help="Path to ChromaDB directory",
+    )
+    parser.add_argument(
+        "--collection_name",
+        type=str,
+        default="cravo",
+        help="Name of the ChromaDB collection",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./data/embeddings/quantized_index",
+        help="Index directory",
+    )
+    parser.add_argument(
+        "--mode", type=str, default="binary", choices=["binary", "int8"]
+    )
+    parser.add_argument("--rescore_factor", type=int, default=10)
+    parser.add_argument(
+        "--benchmark",
+        action="store_true",
+        help="Report memory and recall@k against exact search instead of building",
+    )
+    parser.add_argument("--top_k", type=int, default=10)
+    parser.add_argument("--n_queries", type=int, default=200)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if not args.benchmark:
+        import chromadb
+        from chromadb.config import Settings
+
+        client = chromadb.PersistentClient(
+            path=args.db_path, settings=Settings(anonymized_telemetry=False)
+        )
+        collection = client.get_collection(args.collection_name)
+        results = collection.get(include=["embeddings"])
+
+        index = QuantizedIndex.build(
+            results["ids"],
+            results["embeddings"],
+            mode=args.mode,
+            rescore_factor=args.rescore_factor,
+        )
+        index.save(args.output)
+        print(f"Quantized {len(index.ids)} embeddings into {args.output}")
+        memory = QuantizedIndex.load(args.output).memory_bytes()
+        print(f"Resident when loaded: {memory['resident'] / 2**20:.1f} MiB")
+        return
+
+    index = QuantizedIndex.load(args.output, modes=["binary", "int8"])
+    float_bytes = len(index.ids) * index.vectors.shape[1] * 4
+
+    # Stored vectors with a little noise stand in for real queries
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(index.ids), size=min(args.n_queries, len(index.ids)))
+    queries = np.asarray(index.vectors[np.sort(sample)], dtype=np.float32)
+    queries += rng.normal(scale=0.01, size=queries.shape).astype(np.float32)
+
+    memory = index.memory_bytes()
+    for mode in ("binary", "int8"):
+        report = recall_vs_exact(index, queries, args.top_k, mode=mode)
+        print(
+            f"{mode:>6}: {memory[mode] / 2**20:.1f} MiB "
+            f"({float_bytes / memory[mode]:.1f}x smaller), "
+            f"recall@{args.top_k}={report['recall']:.3f}, "
+            f"{report['approx_ms']:.2f}ms vs exact {report['exact_ms']:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
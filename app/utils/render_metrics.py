@@ -0,0 +1,91 @@
+import logging
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, Optional
+
+from utils.tracing import Span, span
+
+logger = logging.getLogger(__name__)
+
+# measure_render wraps ScriptRunContext._enqueue, a private attribute. It
+# has been Callable[[ForwardMsg], None] since Streamlit 1.30; keep the
+# streamlit pin in requirements.txt within the versions checked. The pin
+# starts at 1.37, the first with st.fragment and st.rerun(scope=...).
+_unhooked_warned = False
+
+
+def _script_run_ctx():
+    """Streamlit's context of the running script, or None outside Streamlit."""
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return None
+    return get_script_run_ctx()
+
+
+def _warn_unhooked() -> None:
+    global _unhooked_warned
+    if not _unhooked_warned:
+        _unhooked_warned = True
+        logger.warning(
+            "ScriptRunContext._enqueue is unavailable in this Streamlit "
+            "version. Render spans will not count payload bytes."
+        )
+
+
+def _hook_enqueue(ctx, sent: Dict[str, int]) -> Optional[Callable]:
+    """
+    Count the bytes and messages the script sends to the browser.
+
+    Args:
+        ctx: Streamlit's script run context
+        sent (Dict[str, int]): Counters, updated in place
+
+    Returns:
+        Optional[Callable]: The original _enqueue to restore, or None when
+            it cannot be wrapped
+    """
+    enqueue = getattr(ctx, "_enqueue", None)
+    if not callable(enqueue):
+        _warn_unhooked()
+        return None
+
+    def counting_enqueue(msg):
+        sent["bytes"] += msg.ByteSize()
+        sent["messages"] += 1
+        enqueue(msg)
+
+    try:
+        ctx._enqueue = counting_enqueue
+    except AttributeError:  # e.g. a frozen dataclass
+        _warn_unhooked()
+        return None
+    return enqueue
+
+
+@contextmanager
+def measure_render(name: str) -> Iterator[Span]:
+    """
+    Time a (partial) rerun of the page as a span, with the CPU time of the
+    script thread and the bytes of the messages sent to the browser.
+
+    Args:
+        name (str): Stage name, e.g. "render_chat"
+
+    Yields:
+        Span: The active span
+    """
+    ctx = _script_run_ctx()
+    sent = {"bytes": 0, "messages": 0}
+    enqueue = _hook_enqueue(ctx, sent) if ctx is not None else None
+
+    cpu_start = time.thread_time()
+    with span(name) as render_span:
+        try:
+            yield render_span
+        finally:
+            render_span.set("cpu_ms", (time.thread_time() - cpu_start) * 1000)
+            if enqueue is not None:
+                ctx._enqueue = enqueue
+                render_span.set("payload_bytes", sent["bytes"])
+                render_span.set("messages", sent["messages"])
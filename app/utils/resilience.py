@@ -0,0 +1,578 @@
+import contextvars
+import itertools
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple, Type
+
+import openai
+from utils.evaluation import latency_percentiles
+from utils.tracing import current_span
+
+# Errors worth retrying: the request may succeed if sent again
+RETRYABLE_ERRORS: Tuple[Type[Exception], ...] = (
+    openai.APIConnectionError,  # includes APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+
+_deadline: contextvars.ContextVar = contextvars.ContextVar("deadline", default=None)
+_session: contextvars.ContextVar = contextvars.ContextVar("session", default=None)
+
+# Admission priorities: lower is served first
+PRIORITY_ANSWER = 0
+PRIORITY_AUXILIARY = 1
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while a circuit breaker is open."""
+
+
+class DeadlineExceededError(Exception):
+    """Raised when the time budget of the current chat turn is spent."""
+
+
+class BusyError(Exception):
+    """Raised without calling upstream when too many calls are already queued."""
+
+
+# Everything call_upstream can raise when the upstream is unusable right now
+UPSTREAM_UNAVAILABLE: Tuple[Type[Exception], ...] = (
+    CircuitOpenError,
+    DeadlineExceededError,
+) + RETRYABLE_ERRORS
+
+
+@contextmanager
+def deadline(seconds: Optional[float]) -> Iterator[None]:
+    """
+    Bound every upstream call made inside the block, retries included,
+    to a shared time budget. Nested deadlines can only shorten it.
+
+    Args:
+        seconds (float, optional): Budget in seconds; None for no budget
+    """
+    if seconds is None:
+        yield
+        return
+
+    expires = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(min(expires, outer) if outer is not None else expires)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextmanager
+def upstream_session(session_id: Optional[str]) -> Iterator[None]:
+    """
+    Attribute every upstream call made inside the block to a chat session,
+    so admission control can share capacity fairly between sessions.
+
+    Args:
+        session_id (str, optional): Session identifier
+    """
+    token = _session.set(session_id)
+    try:
+        yield
+    finally:
+        _session.reset(token)
+
+
+def remaining_time() -> Optional[float]:
+    """
+    Seconds left in the current deadline.
+
+    Returns:
+        Optional[float]: Remaining seconds, or None outside any deadline
+    """
+    expires = _deadline.get()
+    if expires is None:
+        return None
+    return expires - time.monotonic()
+
+
+class RetryPolicy:
+    """
+    Capped exponential backoff with full jitter that honours the
+    Retry-After headers of rate-limit responses.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 0.25,
+        max_delay: float = 4.0,
+        max_retry_after: float = 20.0,
+    ):
+        """
+        Initialize the retry policy.
+
+        Args:
+            max_attempts (int, optional): Attempts per call, first one included. Defaults to 3.
+            base_delay (float, optional): Backoff scale in seconds. Defaults to 0.25.
+            max_delay (float, optional): Backoff cap in seconds. Defaults to 4.0.
+            max_retry_after (float, optional): Longest Retry-After honoured. Defaults to 20.0.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def delay(self, attempt: int, error: Exception) -> float:
+        """
+        Seconds to wait before the next attempt.
+
+        Args:
+            attempt (int): Number of the attempt that just failed (1-based)
+            error (Exception): The error it raised
+
+        Returns:
+            float: Delay in seconds
+        """
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            # Small jitter so callers throttled together don't return together
+            return min(retry_after, self.max_retry_after) * random.uniform(1.0, 1.1)
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Parse retry-after-ms / Retry-After (seconds) from an API error."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        # HTTP-date form, fall back to backoff
+        return None
+    return None
+
+
+class CircuitBreaker:
+    """
+    Opens after consecutive upstream failures so callers fail fast,
+    then lets a single trial call through once the reset timeout expires.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0
+    ):
+        """
+        Initialize the circuit breaker.
+
+        Args:
+            name (str): Upstream name, for metrics and errors
+            failure_threshold (int, optional): Consecutive failures that open
+                the circuit. Defaults to 5.
+            reset_timeout (float, optional): Seconds before a trial call is
+                allowed. Defaults to 30.0.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state()
+
+    def _state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        """
+        Whether a call may go upstream now.
+
+        Returns:
+            bool: False while open, or while a half-open trial is in flight
+        """
+        with self._lock:
+            state = self._state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def reset(self) -> None:
+        self.record_success()
+
+
+class AdmissionController:
+    """
+    Process-wide scheduler for upstream calls: a token bucket bounds the
+    request rate and a concurrency limit bounds the calls outstanding.
+    Waiting calls are admitted by priority, then from the session with the
+    fewest calls in flight, then round-robin across sessions. Calls that would queue
+    too long are rejected at once with BusyError.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: Optional[int] = None,
+        rate_per_s: Optional[float] = None,
+        burst: Optional[int] = None,
+        max_queue: int = 64,
+        max_wait: float = 10.0,
+        window: int = 500,
+    ):
+        """
+        Initialize the controller.
+
+        Args:
+            max_concurrent (int, optional): Calls outstanding at once. None for no limit.
+            rate_per_s (float, optional): Sustained calls per second. None for no limit.
+            burst (int, optional): Token bucket size. Defaults to max(1, rate_per_s).
+            max_queue (int, optional): Calls allowed to wait; beyond this new calls
+                are rejected immediately. Defaults to 64.
+            max_wait (float, optional): Longest wait in seconds, further bounded by
+                the turn deadline. Defaults to 10.0.
+            window (int, optional): Waits kept for rolling percentiles. Defaults to 500.
+        """
+        self.max_concurrent = max_concurrent
+        self.rate_per_s = rate_per_s
+        self.burst = burst if burst is not None else max(1, int(rate_per_s or 1))
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting: List[Tuple[int, int, Optional[str]]] = []
+        self._in_flight = 0
+        self._session_in_flight: Dict[Optional[str], int] = {}
+        self._session_last: Dict[Optional[str], int] = {}
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+
+        self._waits_ms: Deque[float] = deque(maxlen=window)
+        self.admitted = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+
+    def _refill(self, now: float) -> None:
+        if self.rate_per_s is None:
+            return
+        elapsed = now - self._refilled_at
+        self._tokens = min(self.burst, self._tokens + elapsed * self.rate_per_s)
+        self._refilled_at = now
+
+    def _head(self) -> Tuple[int, int, Optional[str]]:
+        """Waiting call to admit next."""
+        return min(
+            self._waiting,
+            key=lambda w: (
+                w[0],
+                self._session_in_flight.get(w[2], 0),
+                self._session_last.get(w[2], -1),
+                w[1],
+            ),
+        )
+
+    def _ready_in(self, now: float) -> Optional[float]:
+        """Seconds until the head can be admitted: 0 if now, None if unknown."""
+        if self.max_concurrent is not None and self._in_flight >= self.max_concurrent:
+            return None
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self.rate_per_s is not None and self._tokens < 1:
+            return (1 - self._tokens) / self.rate_per_s
+        return 0.0
+
+    def acquire(self, priority: int = PRIORITY_AUXILIARY) -> float:
+        """
+        Wait for a slot and a rate token.
+
+        Args:
+            priority (int, optional): PRIORITY_ANSWER or PRIORITY_AUXILIARY
+
+        Returns:
+            float: Seconds spent waiting
+
+        Raises:
+            BusyError: The queue is full, or the call would wait past max_wait
+                or the turn deadline
+        """
+        session = _session.get()
+        budget = self.max_wait
+        remaining = remaining_time()
+        if remaining is not None:
+            budget = min(budget, remaining)
+
+        start = time.monotonic()
+        with self._cond:
+            if len(self._waiting) >= self.max_queue:
+                self.rejected += 1
+                raise BusyError(f"{len(self._waiting)} upstream calls already queued")
+
+            entry = (priority, next(self._seq), session)
+            self._waiting.append(entry)
+            self.max_queue_depth = max(self.max_queue_depth, len(self._waiting))
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    ready_in = self._ready_in(now)
+                    if ready_in == 0 and self._head() == entry:
+                        break
+
+                    left = start + budget - now
+                    if left <= 0:
+                        self.rejected += 1
+                        raise BusyError("Timed out waiting for upstream capacity")
+                    self._cond.wait(left if ready_in is None else min(left, ready_in))
+            finally:
+                self._waiting.remove(entry)
+                # The next head may be admissible now
+                self._cond.notify_all()
+
+            if self.rate_per_s is not None:
+                self._tokens -= 1
+            self._in_flight += 1
+            self._session_in_flight[session] = (
+                self._session_in_flight.get(session, 0) + 1
+            )
+            self._session_last[session] = self.admitted
+            self.admitted += 1
+            waited = time.monotonic() - start
+            self._waits_ms.append(waited * 1000)
+            return waited
+
+    def release(self) -> None:
+        """Free the slot of a call admitted by the current session."""
+        session = _session.get()
+        with self._cond:
+            self._in_flight -= 1
+            count = self._session_in_flight.get(session, 1) - 1
+            if count:
+                self._session_in_flight[session] = count
+            else:
+                self._session_in_flight.pop(session, None)
+                if all(w[2] != session for w in self._waiting):
+                    self._session_last.pop(session, None)
+            self._cond.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Admit nothing for a while, e.g. after a rate-limit response, so
+        queued calls wait together instead of each retrying into the limit.
+
+        Args:
+            seconds (float): Pause length
+        """
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @contextmanager
+    def admit(self, priority: int = PRIORITY_AUXILIARY) -> Iterator[float]:
+        """
+        Hold an admission for the duration of the block.
+
+        Args:
+            priority (int, optional): PRIORITY_ANSWER or PRIORITY_AUXILIARY
+
+        Yields:
+            float: Seconds spent waiting
+        """
+        waited = self.acquire(priority)
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Current queue depth and calls in flight, counters, and rolling
+        wait-time percentiles.
+
+        Returns:
+            Dict[str, float]: queue_depth, max_queue_depth, in_flight, admitted,
+                rejected, and p50_ms/p95_ms/p99_ms of the wait
+        """
+        with self._cond:
+            waits = list(self._waits_ms)
+            return {
+                "queue_depth": len(self._waiting),
+                "max_queue_depth": self.max_queue_depth,
+                "in_flight": self._in_flight,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                **latency_percentiles(waits),
+            }
+
+
+_admission = AdmissionController()
+
+
+def configure_admission(**kwargs) -> AdmissionController:
+    """
+    Replace the process-wide admission controller.
+
+    Args:
+        **kwargs: AdmissionController settings
+
+    Returns:
+        AdmissionController: The new controller
+    """
+    global _admission
+    _admission = AdmissionController(**kwargs)
+    return _admission
+
+
+def get_admission() -> AdmissionController:
+    """Return the process-wide admission controller."""
+    return _admission
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """
+    Return the process-wide circuit breaker of an upstream.
+
+    Args:
+        name (str): Upstream name, e.g. "embeddings" or "chat"
+
+    Returns:
+        CircuitBreaker: The breaker, created on first use
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+def call_upstream(
+    name: str,
+    request: Callable[..., Any],
+    policy: Optional[RetryPolicy] = None,
+    priority: int = PRIORITY_AUXILIARY,
+) -> Any:
+    """
+    Make one upstream API call with retries, the turn deadline, the
+    upstream's circuit breaker and admission control. Every attempt is
+    admitted separately; backoff sleeps hold no slot.
+
+    Args:
+        name (str): Upstream name, selects the circuit breaker
+        request (Callable[..., Any]): Sends the request; receives a ``timeout``
+            keyword argument when a deadline is active
+        policy (RetryPolicy, optional): Retry policy. Defaults to DEFAULT_RETRY_POLICY.
+        priority (int, optional): Admission priority. Defaults to PRIORITY_AUXILIARY.
+
+    Returns:
+        Any: Whatever request returns
+
+    Raises:
+        BusyError: Too many upstream calls are already waiting
+        CircuitOpenError: The breaker is open
+        DeadlineExceededError: The turn's budget ran out before a success
+    """
+    policy = policy or DEFAULT_RETRY_POLICY
+    admission = get_admission()
+    breaker = get_breaker(name)
+    active_span = current_span()
+
+    for attempt in range(1, policy.max_attempts + 1):
+        remaining = remaining_time()
+        if remaining is not None and remaining <= 0:
+            raise DeadlineExceededError(f"No time left for '{name}'")
+
+        waited = admission.acquire(priority)
+        active_span.set("admission_wait_ms", waited * 1000)
+        # Once allowed, the attempt must be recorded, or a half-open
+        # breaker would wait forever for its trial call
+        allowed = False
+        try:
+            # Admission may have used up the budget: check it again before
+            # the breaker hands out a trial call
+            remaining = remaining_time()
+            if remaining is not None and remaining <= 0:
+                raise DeadlineExceededError(f"No time left for '{name}'")
+
+            allowed = breaker.allow()
+            if not allowed:
+                active_span.set("circuit_open", True)
+                raise CircuitOpenError(f"Circuit for '{name}' is open")
+
+            active_span.incr("attempts")
+            kwargs = {"timeout": remaining} if remaining is not None else {}
+            result = request(**kwargs)
+        except RETRYABLE_ERRORS as e:
+            breaker.record_failure()
+            error = e
+        except (CircuitOpenError, DeadlineExceededError):
+            if allowed:
+                breaker.record_failure()
+            raise
+        except Exception:
+            # Upstream answered (e.g. a 400): it is healthy, the request is not
+            breaker.record_success()
+            raise
+        except BaseException:
+            if allowed:
+                breaker.record_failure()
+            raise
+        else:
+            breaker.record_success()
+            return result
+        finally:
+            admission.release()
+
+        # Back off without holding an admission slot
+        delay = policy.delay(attempt, error)
+        if isinstance(error, openai.RateLimitError):
+            admission.pause(delay)
+        if attempt == policy.max_attempts:
+            raise error
+
+        remaining = remaining_time()
+        if remaining is not None and delay >= remaining:
+            raise DeadlineExceededError(
+                f"Retry of '{name}' would exceed the deadline"
+            ) from error
+
+        active_span.incr("retries")
+        time.sleep(delay)
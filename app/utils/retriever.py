@@ -1,8 +1,57 @@
-from typing import Any, Dict, List
+import json
+import logging
+import os
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 import chromadb
+import numpy as np
 from chromadb.config import Settings
+from utils.bm25 import BM25Index, reciprocal_rank_fusion
 from utils.embeddings import OpenAIEmbedding
+from utils.filters import MetadataFilterIndex
+from utils.hierarchy import HierarchyIndex
+from utils.ivf import IVFIndex
+from utils.matryoshka import MatryoshkaIndex
+from utils.quantized import QuantizedIndex
+from utils.resilience import UPSTREAM_UNAVAILABLE
+from utils.topics import TopicModel
+from utils.tracing import current_span, span
+
+logger = logging.getLogger(__name__)
+
+# Index ids looked up in the collection to check it was built from it
+ID_CHECK_SAMPLE = 100
+
+# Local vector index types, by the "type" field of their index.json
+VECTOR_INDEX_TYPES = {
+    "quantized": QuantizedIndex,
+    "matryoshka": MatryoshkaIndex,
+    "ivf": IVFIndex,
+}
+
+
+@lru_cache(maxsize=4)
+def load_vector_index(
+    path: str,
+) -> Union[QuantizedIndex, MatryoshkaIndex, IVFIndex]:
+    """
+    Load a local vector index once per process, so every session's
+    retriever shares the same arrays instead of holding its own copy.
+
+    Args:
+        path (str): Index directory
+
+    Returns:
+        Union[QuantizedIndex, MatryoshkaIndex, IVFIndex]: The loaded index
+    """
+    with open(os.path.join(path, "index.json")) as f:
+        index_type = json.load(f).get("type", "quantized")
+
+    if index_type not in VECTOR_INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type '{index_type}' in {path}")
+
+    return VECTOR_INDEX_TYPES[index_type].load(path)
 
 
 class ChromaDBRetriever:
@@ -10,7 +59,20 @@ class ChromaDBRetriever:
     Class for retrieving documents from ChromaDB.
     """
 
-    def __init__(self, db_path: str, collection_name: str, embedding: OpenAIEmbedding):
+    def __init__(
+        self,
+        db_path: str,
+        collection_name: str,
+        embedding: OpenAIEmbedding,
+        bm25_path: Optional[str] = None,
+        rrf_k: int = 60,
+        candidate_multiplier: int = 4,
+        vector_index_path: Optional[str] = None,
+        filter_index_path: Optional[str] = None,
+        hierarchy_path: Optional[str] = None,
+        context_tokens: int = 1500,
+        topics_path: Optional[str] = None,
+    ):
         """
         Initialize the ChromaDB retriever.
 
@@ -18,10 +80,82 @@ class ChromaDBRetriever:
             db_path (str): Path to the ChromaDB directory
             collection_name (str): Name of the ChromaDB collection
             embedding (OpenAIEmbedding): OpenAI embedding client
+            bm25_path (str, optional): Path to a BM25 index built with utils/bm25.py.
+                When the file exists, retrieval fuses BM25 and vector results.
+                Defaults to None (vector search only).
+            rrf_k (int, optional): Reciprocal-rank fusion constant. Defaults to 60.
+            candidate_multiplier (int, optional): Candidates fetched from each
+                ranker per requested document in hybrid mode. Defaults to 4.
+            vector_index_path (str, optional): Directory of a local vector index
+                built with utils/quantized.py, matryoshka.py or ivf.py. When it
+                exists, vector search runs on it instead of Chroma's index.
+                Defaults to None.
+            filter_index_path (str, optional): Path to a source/date filter index
+                built with utils/filters.py, required by retrieve()'s filters.
+                Defaults to None.
+            hierarchy_path (str, optional): Path to a child-chunk index built with
+                utils/hierarchy.py. When it exists, the child collection is
+                searched and matches are expanded to their surrounding text.
+                Defaults to None.
+            context_tokens (int, optional): Token budget shared by the expanded
+                documents of one retrieval. Defaults to 1500.
+            topics_path (str, optional): Directory of topics built with
+                utils/topics.py, required by retrieve()'s topic filter, along
+                with the filter index. Defaults to None.
         """
         self.db_path = db_path
         self.collection_name = collection_name
         self.embedding = embedding
+        self.rrf_k = rrf_k
+        self.candidate_multiplier = candidate_multiplier
+        self.context_tokens = context_tokens
+
+        self.bm25 = None
+        if bm25_path and os.path.exists(bm25_path):
+            self.bm25 = BM25Index.load(bm25_path)
+        elif bm25_path:
+            logger.warning(
+                "BM25 index not found at %s. Using vector search only.", bm25_path
+            )
+
+        self.vector_index = None
+        if vector_index_path and os.path.exists(vector_index_path):
+            self.vector_index = load_vector_index(vector_index_path)
+        elif vector_index_path:
+            logger.warning(
+                "Vector index not found at %s. Using Chroma.", vector_index_path
+            )
+
+        self.filters = None
+        if filter_index_path and os.path.exists(filter_index_path):
+            self.filters = MetadataFilterIndex.load(filter_index_path)
+        elif filter_index_path:
+            logger.warning(
+                "Filter index not found at %s. Filters disabled.", filter_index_path
+            )
+        # Filter rows of each index's ids, computed on first use
+        self._filter_positions = {}
+        # Filters this retriever cannot apply, logged on first use
+        self._ignored_filters = set()
+
+        self.topics = None
+        if topics_path and os.path.exists(topics_path):
+            self.topics = TopicModel.load(topics_path)
+        elif topics_path:
+            logger.warning(
+                "Topics not found at %s. Topic filter disabled.", topics_path
+            )
+        # Topic of every filter index row, computed on first use
+        self._filter_topics = None
+
+        self.hierarchy = None
+        if hierarchy_path and os.path.exists(hierarchy_path):
+            self.hierarchy = HierarchyIndex.load(hierarchy_path)
+            collection_name = self.hierarchy.child_collection
+        elif hierarchy_path:
+            logger.warning(
+                "Hierarchy index not found at %s. Using full chunks.", hierarchy_path
+            )
 
         # Initialize ChromaDB client
         self.client = chromadb.PersistentClient(
@@ -36,26 +170,270 @@ class ChromaDBRetriever:
                 f"Collection '{collection_name}' not found. Make sure it exists: {str(e)}"
             )
 
-    def retrieve(self, query: str, top_k: int = 3) -> List[Dict[str, Any]]:
+        for name, index in [
+            ("BM25", self.bm25),
+            ("Vector", self.vector_index),
+            ("Filter", self.filters),
+            ("Topic", self.topics),
+        ]:
+            if index is not None:
+                self._check_index_ids(name, index.ids)
+
+    def _check_index_ids(self, name: str, ids: Sequence[str]) -> None:
+        """
+        Check that an index was built from the searched collection, e.g.
+        from the child collection in hierarchy mode rather than the parent
+        chunks. Rows of another collection never match a search result, so
+        every filtered search would come back empty.
+
+        Args:
+            name (str): Index name for the messages
+            ids (Sequence[str]): Ids of the index rows
+
+        Raises:
+            ValueError: If none of a sample of the ids is in the collection
+        """
+        if len(ids) == 0:
+            return
+        rows = np.unique(np.linspace(0, len(ids) - 1, ID_CHECK_SAMPLE).astype(int))
+        sample = [str(ids[row]) for row in rows]
+        found = set(self.collection.get(ids=sample, include=[])["ids"])
+        if not found:
+            raise ValueError(
+                f"{name} index ids (e.g. '{sample[0]}') are not in collection "
+                f"'{self.collection.name}'. Rebuild the index from it."
+            )
+        if len(found) < len(sample):
+            logger.warning(
+                "%d of %d sampled %s index ids are not in collection '%s'. "
+                "The index is stale; rebuild it.",
+                len(sample) - len(found),
+                len(sample),
+                name,
+                self.collection.name,
+            )
+
+    def retrieve(
+        self,
+        query: str,
+        top_k: int = 3,
+        sources: Optional[List[str]] = None,
+        start: Union[str, int, None] = None,
+        end: Union[str, int, None] = None,
+        topics: Optional[List[int]] = None,
+    ) -> List[Dict[str, Any]]:
         """
         Retrieve relevant documents based on the query.
 
+        With a BM25 index loaded, vector and lexical rankings are fused by
+        reciprocal-rank fusion; BM25-only hits carry a distance of None.
+        If the embedding API is unavailable, BM25 results are returned alone.
+        Source, date and topic filters are applied before scoring. With a hierarchy
+        index, small child chunks are matched and then expanded to their
+        neighbours or whole page within the context token budget.
+
         Args:
             query (str): Query to search for
             top_k (int, optional): Number of documents to retrieve. Defaults to 3.
+            sources (List[str], optional): Only search these source_names.
+                Defaults to None (all sources).
+            start (Union[str, int], optional): Earliest tstamp, e.g. "1974" or
+                "19740425". Defaults to None.
+            end (Union[str, int], optional): Latest tstamp, inclusive. Defaults to None.
+            topics (List[int], optional): Only search chunks of these topics.
+                Defaults to None (all topics).
+
+        Returns:
+            List[Dict[str, Any]]: List of documents with their metadata and sources
+        """
+        mask = self._filter_mask(sources, start, end, topics)
+        if mask is not None and not mask.any():
+            return []
+
+        if self.hierarchy is None:
+            return self._search(query, top_k, mask)
+
+        # Extra children make up for matches merged into the same window
+        children = self._search(query, top_k * 2, mask)
+        with span("expand", children=len(children)):
+            return self.hierarchy.expand_documents(children, self.context_tokens, top_k)
+
+    def _search(
+        self, query: str, top_k: int, mask: Optional[np.ndarray] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Rank documents of the searched collection, vector, lexical or fused.
+
+        Args:
+            query (str): Query to search for
+            top_k (int): Number of documents to retrieve
+            mask (np.ndarray, optional): Filter index rows allowed in the results
 
         Returns:
             List[Dict[str, Any]]: List of documents with their metadata and sources
         """
         # Get query embedding
-        query_embedding = self.embedding.get_embedding(query)
+        try:
+            query_embedding = self.embedding.get_embedding(query)
+        except UPSTREAM_UNAVAILABLE as e:
+            if self.bm25 is None:
+                raise
+            logger.warning("Embedding unavailable (%s). Falling back to BM25 only.", e)
+            current_span().set("degraded", True)
+            lexical_hits = self._lexical_search(query, top_k, mask)
+            docs_by_id = self._fetch_documents([doc_id for doc_id, _ in lexical_hits])
+            return [
+                docs_by_id[doc_id] for doc_id, _ in lexical_hits if doc_id in docs_by_id
+            ]
+
+        if self.bm25 is None:
+            return self._vector_search(query_embedding, top_k, mask)
+
+        # Hybrid: fuse a deeper vector shortlist with the BM25 ranking
+        n_candidates = top_k * self.candidate_multiplier
+        vector_docs = self._vector_search(query_embedding, n_candidates, mask)
+        lexical_hits = self._lexical_search(query, n_candidates, mask)
+
+        fused = reciprocal_rank_fusion(
+            [
+                [doc["id"] for doc in vector_docs],
+                [doc_id for doc_id, _ in lexical_hits],
+            ],
+            k=self.rrf_k,
+        )[:top_k]
+
+        docs_by_id = {doc["id"]: doc for doc in vector_docs}
+
+        # BM25-only hits still need their content and metadata
+        missing_ids = [doc_id for doc_id, _ in fused if doc_id not in docs_by_id]
+        docs_by_id.update(self._fetch_documents(missing_ids))
+
+        return [docs_by_id[doc_id] for doc_id, _ in fused if doc_id in docs_by_id]
+
+    def _filter_mask(
+        self,
+        sources: Optional[List[str]],
+        start: Union[str, int, None],
+        end: Union[str, int, None],
+        topics: Optional[List[int]] = None,
+    ) -> Optional[np.ndarray]:
+        """Rows of the filter index matching the filters, None if unfiltered."""
+        if sources is None and start is None and end is None and topics is None:
+            return None
+        if self.filters is None:
+            self._warn_ignored(
+                "No filter index loaded. Ignoring source, date and topic filters."
+            )
+            return None
+        mask = self.filters.mask(sources, start, end)
+        if topics is None:
+            return mask
+        if self.topics is None:
+            self._warn_ignored("No topics loaded. Ignoring topic filter.")
+            return mask
+
+        if self._filter_topics is None:
+            self._filter_topics = self.topics.topics_of(self.filters.ids)
+        in_topics = np.isin(self._filter_topics, np.asarray(topics, dtype=np.int32))
+        return in_topics if mask is None else mask & in_topics
+
+    def _warn_ignored(self, message: str) -> None:
+        """Log a filter that cannot be applied once, not on every query."""
+        if message not in self._ignored_filters:
+            self._ignored_filters.add(message)
+            logger.warning(message)
+
+    def _aligned_mask(self, index, mask: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """A filter mask reordered to the rows of a BM25 or vector index."""
+        if mask is None:
+            return None
+        key = id(index)
+        if key not in self._filter_positions:
+            self._filter_positions[key] = self.filters.positions(index.ids)
+        return self.filters.align(mask, self._filter_positions[key])
+
+    def _lexical_search(
+        self, query: str, n_results: int, mask: Optional[np.ndarray] = None
+    ) -> List[Tuple[str, float]]:
+        """BM25 ranking, restricted to the filter mask."""
+        with span("bm25", n_results=n_results):
+            return self.bm25.search(
+                query, n_results, mask=self._aligned_mask(self.bm25, mask)
+            )
+
+    def _fetch_documents(self, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Fetch documents by id, in the same shape as retrieve() results.
+
+        Args:
+            ids (List[str]): Document ids
+
+        Returns:
+            Dict[str, Dict[str, Any]]: Documents keyed by id, with distance None
+        """
+        if not ids:
+            return {}
+
+        fetched = self.collection.get(ids=ids, include=["documents", "metadatas"])
+
+        return {
+            doc_id: {
+                "content": fetched["documents"][i],
+                "metadata": fetched["metadatas"][i] or {},
+                "distance": None,
+                "id": doc_id,
+            }
+            for i, doc_id in enumerate(fetched["ids"])
+        }
+
+    def _vector_search(
+        self,
+        query_embedding: List[float],
+        n_results: int,
+        mask: Optional[np.ndarray] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Query the collection by embedding.
+
+        Args:
+            query_embedding (List[float]): Query embedding vector
+            n_results (int): Number of documents to retrieve
+            mask (np.ndarray, optional): Filter index rows allowed in the results
+
+        Returns:
+            List[Dict[str, Any]]: List of documents with their metadata and distances
+        """
+        if self.vector_index is not None:
+            with span("vector_index", n_results=n_results):
+                hits = self.vector_index.search(
+                    query_embedding,
+                    n_results,
+                    mask=self._aligned_mask(self.vector_index, mask),
+                )
+            docs_by_id = self._fetch_documents([doc_id for doc_id, _ in hits])
+            documents_with_metadata = []
+            for doc_id, distance in hits:
+                if doc_id in docs_by_id:
+                    docs_by_id[doc_id]["distance"] = distance
+                    documents_with_metadata.append(docs_by_id[doc_id])
+            return documents_with_metadata
+
+        # Chroma only stores m_id, so filter on the parents of the allowed rows
+        where = None
+        n_query = n_results
+        if mask is not None:
+            where = {"m_id": {"$in": np.unique(self.filters.m_ids[mask]).tolist()}}
+            # Topics are per chunk, finer than m_id: over-fetch, then drop
+            n_query = n_results * self.candidate_multiplier
 
         # Query the collection
-        results = self.collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k,
-            include=["documents", "metadatas", "distances"],
-        )
+        with span("chroma_query", n_results=n_query):
+            results = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=n_query,
+                where=where,
+                include=["documents", "metadatas", "distances"],
+            )
 
         # Combine documents with their metadata
         documents_with_metadata = []
@@ -83,6 +461,15 @@ class ChromaDBRetriever:
                 }
                 documents_with_metadata.append(document_info)
 
+        if mask is not None:
+            allowed = self.filters.align(
+                mask,
+                self.filters.positions([doc["id"] for doc in documents_with_metadata]),
+            )
+            documents_with_metadata = [
+                doc for doc, ok in zip(documents_with_metadata, allowed) if ok
+            ][:n_results]
+
         return documents_with_metadata
 
     def get_collection_info(self) -> Dict[str, Any]:
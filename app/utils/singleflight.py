@@ -0,0 +1,117 @@
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from utils.resilience import DeadlineExceededError, remaining_time
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs
+    the call, the others wait for and share its result (or its error).
+    Nothing is cached once the call returns.
+    """
+
+    def __init__(self, name: str):
+        """
+        Initialize the group.
+
+        Args:
+            name (str): Group name, for metrics
+        """
+        self.name = name
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key: Hashable, call: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run call, unless an identical call is already in flight.
+
+        Args:
+            key (Hashable): Identifies identical requests
+            call (Callable[[], Any]): Makes the request
+
+        Returns:
+            Tuple[Any, bool]: The result, and whether it came from another
+                caller's request
+
+        Raises:
+            DeadlineExceededError: The turn's budget ran out while waiting
+        """
+        with self._lock:
+            self.calls += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            try:
+                return future.result(timeout=remaining_time()), True
+            except FutureTimeoutError:
+                raise DeadlineExceededError(
+                    f"Timed out waiting for an identical '{self.name}' request"
+                )
+
+        try:
+            result = call()
+        except BaseException as e:
+            self._finish(key)
+            future.set_exception(e)
+            raise
+
+        self._finish(key)
+        future.set_result(result)
+        return result, False
+
+    def _finish(self, key: Hashable) -> None:
+        # Later callers start a new request rather than reuse a finished one
+        with self._lock:
+            del self._in_flight[key]
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Counters since the process started.
+
+        Returns:
+            Dict[str, int]: calls, coalesced (served by another caller's request)
+                and in_flight
+        """
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._in_flight),
+            }
+
+
+_groups: Dict[str, SingleFlight] = {}
+_groups_lock = threading.Lock()
+
+
+def get_group(name: str) -> SingleFlight:
+    """
+    Return the process-wide single-flight group of a request type.
+
+    Args:
+        name (str): Request type, e.g. "embedding" or "generate"
+
+    Returns:
+        SingleFlight: The group, created on first use
+    """
+    with _groups_lock:
+        if name not in _groups:
+            _groups[name] = SingleFlight(name)
+        return _groups[name]
+
+
+def singleflight_stats() -> Dict[str, Dict[str, int]]:
+    """Counters of every group, by name."""
+    with _groups_lock:
+        groups = list(_groups.values())
+    return {group.name: group.stats() for group in groups}
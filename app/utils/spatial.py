@@ -0,0 +1,347 @@
+import argparse
+import json
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Average points per grid cell
+POINTS_PER_CELL = 16
+
+Box = Tuple[float, float, float, float]
+
+
+def points_in_polygon(
+    x: np.ndarray, y: np.ndarray, polygon_x: Sequence[float], polygon_y: Sequence[float]
+) -> np.ndarray:
+    """
+    Even-odd rule point-in-polygon test, vectorized over the points.
+
+    Args:
+        x (np.ndarray): Point x coordinates
+        y (np.ndarray): Point y coordinates
+        polygon_x (Sequence[float]): Polygon vertex x coordinates
+        polygon_y (Sequence[float]): Polygon vertex y coordinates
+
+    Returns:
+        np.ndarray: Boolean mask of the points inside
+    """
+    inside = np.zeros(len(x), dtype=bool)
+    j = len(polygon_x) - 1
+    for i in range(len(polygon_x)):
+        xi, yi = polygon_x[i], polygon_y[i]
+        xj, yj = polygon_x[j], polygon_y[j]
+        crosses = (yi > y) != (yj > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = (xj - xi) * (y - yi) / (yj - yi) + xi
+        inside ^= crosses & (x < x_cross)
+        j = i
+    return inside
+
+
+class GridIndex:
+    """
+    Uniform grid over the 2-D projection. Points are sorted by cell into
+    contiguous runs (like IVF posting lists), so a box touches one run per
+    row of cells and only the points of the cells it overlaps are tested.
+    """
+
+    def __init__(
+        self,
+        x: np.ndarray,
+        y: np.ndarray,
+        origin: Tuple[float, float],
+        cell_size: Tuple[float, float],
+        cells: int,
+        order: np.ndarray,
+        offsets: np.ndarray,
+    ):
+        """
+        Initialize the index.
+
+        Args:
+            x (np.ndarray): (n,) x coordinates, in row order
+            y (np.ndarray): (n,) y coordinates, in row order
+            origin (Tuple[float, float]): Lower-left corner of the grid
+            cell_size (Tuple[float, float]): Cell width and height
+            cells (int): Cells per axis
+            order (np.ndarray): (n,) rows sorted by cell
+            offsets (np.ndarray): (cells * cells + 1,) start of each cell in order
+        """
+        self.x = x
+        self.y = y
+        self.origin = origin
+        self.cell_size = cell_size
+        self.cells = cells
+        self.order = order
+        self.offsets = offsets
+        # Coordinates in cell order, so candidate reads are sequential
+        self._xs = x[order]
+        self._ys = y[order]
+
+    @classmethod
+    def build(
+        cls,
+        x: Sequence[float],
+        y: Sequence[float],
+        points_per_cell: int = POINTS_PER_CELL,
+    ) -> "GridIndex":
+        """
+        Bucket the points into a square grid sized for points_per_cell.
+
+        Args:
+            x (Sequence[float]): x coordinates, e.g. umap_df["x"]
+            y (Sequence[float]): y coordinates
+            points_per_cell (int, optional): Average points per cell.
+
+        Returns:
+            GridIndex: The index
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        cells = max(1, int(np.sqrt(len(x) / points_per_cell)))
+
+        if len(x):
+            origin = (float(x.min()), float(y.min()))
+            extent = (float(x.max()) - origin[0], float(y.max()) - origin[1])
+        else:
+            origin, extent = (0.0, 0.0), (0.0, 0.0)
+        cell_size = tuple(max(e / cells, 1e-12) for e in extent)
+
+        cell = cls._cell_of(x, y, origin, cell_size, cells)
+        order = np.argsort(cell, kind="stable")
+        offsets = np.zeros(cells * cells + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell, minlength=cells * cells), out=offsets[1:])
+        return cls(x, y, origin, cell_size, cells, order, offsets)
+
+    @staticmethod
+    def _cell_of(x, y, origin, cell_size, cells) -> np.ndarray:
+        cx = np.clip(((x - origin[0]) / cell_size[0]).astype(np.int64), 0, cells - 1)
+        cy = np.clip(((y - origin[1]) / cell_size[1]).astype(np.int64), 0, cells - 1)
+        return cy * cells + cx
+
+    def _axis_cells(self, low: float, high: float, axis: int) -> Tuple[int, int]:
+        first = int(np.floor((low - self.origin[axis]) / self.cell_size[axis]))
+        last = int(np.floor((high - self.origin[axis]) / self.cell_size[axis]))
+        return max(first, 0), min(last, self.cells - 1)
+
+    def _box_positions(self, box: Box) -> np.ndarray:
+        """Positions (in cell order) of the points inside a box."""
+        x0, x1, y0, y1 = box
+        cx0, cx1 = self._axis_cells(x0, x1, 0)
+        cy0, cy1 = self._axis_cells(y0, y1, 1)
+        if cx0 > cx1 or cy0 > cy1:
+            return np.empty(0, dtype=np.int64)
+
+        # The cells of one grid row are contiguous in cell order
+        starts = self.offsets[np.arange(cy0, cy1 + 1) * self.cells + cx0]
+        ends = self.offsets[np.arange(cy0, cy1 + 1) * self.cells + cx1 + 1]
+        positions = np.concatenate(
+            [np.arange(s, e) for s, e in zip(starts, ends) if e > s] or [[]]
+        ).astype(np.int64)
+
+        xs, ys = self._xs[positions], self._ys[positions]
+        return positions[(xs >= x0) & (xs <= x1) & (ys >= y0) & (ys <= y1)]
+
+    def _rows(self, positions: np.ndarray, mask: Optional[np.ndarray]) -> np.ndarray:
+        rows = self.order[positions]
+        if mask is not None:
+            rows = rows[mask[rows]]
+        return rows
+
+    def query_box(self, box: Box, mask: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Rows inside a box, e.g. a box selection.
+
+        Args:
+            box (Box): (x0, x1, y0, y1)
+            mask (Optional[np.ndarray], optional): Boolean mask of the rows allowed
+
+        Returns:
+            np.ndarray: Sorted row positions
+        """
+        return np.sort(self._rows(self._box_positions(box), mask))
+
+    def query_lasso(
+        self,
+        polygon_x: Sequence[float],
+        polygon_y: Sequence[float],
+        mask: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Rows inside a lasso polygon: its bounding box, then the exact test.
+
+        Args:
+            polygon_x (Sequence[float]): Vertex x coordinates
+            polygon_y (Sequence[float]): Vertex y coordinates
+            mask (Optional[np.ndarray], optional): Boolean mask of the rows allowed
+
+        Returns:
+            np.ndarray: Sorted row positions
+        """
+        if len(polygon_x) < 3:
+            return np.empty(0, dtype=np.int64)
+        box = (min(polygon_x), max(polygon_x), min(polygon_y), max(polygon_y))
+        positions = self._box_positions(box)
+        inside = points_in_polygon(
+            self._xs[positions], self._ys[positions], polygon_x, polygon_y
+        )
+        return np.sort(self._rows(positions[inside], mask))
+
+    def nearest(self, x: float, y: float, mask: Optional[np.ndarray] = None) -> int:
+        """
+        Row of the point nearest to (x, y), e.g. to resolve a click.
+
+        Args:
+            x (float): x coordinate
+            y (float): y coordinate
+            mask (Optional[np.ndarray], optional): Boolean mask of the rows allowed
+
+        Returns:
+            int: Row position, -1 if there is no allowed point
+        """
+        extent = max(self.cell_size) * self.cells
+        radius = max(self.cell_size)
+        # Grow a box until it holds a candidate...
+        while True:
+            rows = self._rows(
+                self._box_positions((x - radius, x + radius, y - radius, y + radius)),
+                mask,
+            )
+            if len(rows) or radius > 2 * extent + abs(x) + abs(y):
+                break
+            radius *= 2
+        if not len(rows):
+            return -1
+
+        # ...then search the box that holds every point closer than it
+        radius = float(
+            np.sqrt(((self.x[rows] - x) ** 2 + (self.y[rows] - y) ** 2).min())
+        )
+        rows = self._rows(
+            self._box_positions((x - radius, x + radius, y - radius, y + radius)), mask
+        )
+        distances = (self.x[rows] - x) ** 2 + (self.y[rows] - y) ** 2
+        return int(rows[np.argmin(distances)])
+
+    def cull(
+        self,
+        viewport: Optional[Box] = None,
+        max_points: Optional[int] = None,
+        mask: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        Rows worth sending to the browser: those inside the viewport,
+        thinned evenly across cells when there are more than max_points.
+
+        Args:
+            viewport (Optional[Box], optional): (x0, x1, y0, y1); None is
+                the whole projection
+            max_points (Optional[int], optional): Cap on the rows returned
+            mask (Optional[np.ndarray], optional): Boolean mask of the rows allowed
+
+        Returns:
+            np.ndarray: Sorted row positions
+        """
+        if viewport is None:
+            positions = np.arange(len(self.order))
+        else:
+            positions = self._box_positions(viewport)
+        if mask is not None:
+            positions = positions[mask[self.order[positions]]]
+        if max_points and len(positions) > max_points:
+            # A stride over cell order keeps every dense region represented
+            step = len(positions) / max_points
+            positions = positions[(np.arange(max_points) * step).astype(np.int64)]
+        return np.sort(self.order[positions])
+
+    def bounds(self, rows: np.ndarray) -> Optional[Box]:
+        """
+        Bounding box of some rows, e.g. the highlighted points.
+
+        Args:
+            rows (np.ndarray): Row positions
+
+        Returns:
+            Optional[Box]: (x0, x1, y0, y1), None for no rows
+        """
+        if len(rows) == 0:
+            return None
+        xs, ys = self.x[rows], self.y[rows]
+        return float(xs.min()), float(xs.max()), float(ys.min()), float(ys.max())
+
+
+def benchmark(
+    sizes: Sequence[int] = (100_000, 1_000_000), queries: int = 200, seed: int = 0
+) -> List[Dict[str, float]]:
+    """
+    Grid index against brute-force numpy scans on clustered 2-D points.
+
+    Args:
+        sizes (Sequence[int], optional): Numbers of points
+        queries (int, optional): Queries of each kind. Defaults to 200.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        List[Dict[str, float]]: Per size, build time and mean milliseconds
+            per box, lasso and nearest query, grid and brute force
+    """
+    rng = np.random.default_rng(seed)
+    report = []
+    for n in sizes:
+        centers = rng.uniform(-10, 10, size=(50, 2))
+        points = centers[rng.integers(0, 50, size=n)] + rng.normal(size=(n, 2))
+        x, y = points[:, 0], points[:, 1]
+
+        start = time.perf_counter()
+        index = GridIndex.build(x, y)
+        row = {"points": n, "build_s": time.perf_counter() - start}
+
+        probes = rng.uniform(-10, 10, size=(queries, 2))
+        boxes = [(px - 0.5, px + 0.5, py - 0.5, py + 0.5) for px, py in probes]
+        angles = np.linspace(0, 2 * np.pi, 12, endpoint=False)
+        lassos = [
+            (px + 0.7 * np.cos(angles), py + 0.7 * np.sin(angles)) for px, py in probes
+        ]
+
+        def timed(fn, args):
+            start = time.perf_counter()
+            for arg in args:
+                fn(*arg)
+            return (time.perf_counter() - start) * 1000 / len(args)
+
+        row["box_ms"] = timed(lambda b: index.query_box(b), [(b,) for b in boxes])
+        row["box_brute_ms"] = timed(
+            lambda b: np.flatnonzero(
+                (x >= b[0]) & (x <= b[1]) & (y >= b[2]) & (y <= b[3])
+            ),
+            [(b,) for b in boxes],
+        )
+        row["lasso_ms"] = timed(index.query_lasso, lassos)
+        row["lasso_brute_ms"] = timed(
+            lambda px, py: np.flatnonzero(points_in_polygon(x, y, px, py)), lassos
+        )
+        row["nearest_ms"] = timed(index.nearest, probes)
+        row["nearest_brute_ms"] = timed(
+            lambda px, py: int(np.argmin((x - px) ** 2 + (y - py) ** 2)), probes
+        )
+        report.append(row)
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the grid index on synthetic projections"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--queries", type=int, default=200)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    print(json.dumps(benchmark(args.sizes, args.queries), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.create_test_db import fake_embedding
+
+# Native widths of the OpenAI embedding models
+MODEL_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+DEFAULT_DIMENSIONS = 1536
+
+ENGLISH_HINTS = re.compile(r"\b(the|what|who|when|why|how|is|was|did)\b", re.I)
+
+
+def count_tokens(text: str) -> int:
+    """Rough whitespace token count, good enough for usage accounting."""
+    return len(text.split())
+
+
+def stub_reply(messages: List[Dict[str, str]]) -> str:
+    """
+    Deterministic chat reply shaped like what the generator's prompts expect.
+
+    Args:
+        messages (List[Dict[str, str]]): Chat messages
+
+    Returns:
+        str: Reply text
+    """
+    prompt = messages[-1]["content"] if messages else ""
+
+    # Language detection prompt in OpenAIGenerator.translate_if_needed
+    if "Language code:" in prompt:
+        text = re.search(r'Text: "(.*)"', prompt, re.S)
+        return "en" if text and ENGLISH_HINTS.search(text.group(1)) else "pt"
+
+    # Translation prompt
+    if "Portuguese translation:" in prompt:
+        text = re.search(r'English text: "(.*)"', prompt, re.S)
+        return text.group(1) if text else prompt
+
+    # Safety analysis prompt in OpenAIGenerator.check_user_input_safety
+    if "RISK_TYPE:" in prompt:
+        return "RISK_TYPE: none\nCONFIDENCE: high\nREASONING: stub"
+
+    question = re.search(r"PERGUNTA DO UTILIZADOR:\s*(.*?)\n\n", prompt, re.S)
+    question = question.group(1).strip() if question else prompt[:200]
+    return f"Resposta simulada do Professor Cravo a: {question}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Request handler for the OpenAI-compatible endpoints.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        # Keep load tests quiet
+        pass
+
+    def do_POST(self):
+        settings = self.server.settings
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+
+        with self.server.lock:
+            self.server.request_count += 1
+            request_number = self.server.request_count
+
+        # Latency injection
+        delay_ms = settings["latency_ms"] + random.uniform(0, settings["jitter_ms"])
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+        # Error injection
+        if (
+            request_number <= settings["fail_first"]
+            or random.random() < settings["error_rate"]
+        ):
+            headers = {}
+            if settings["error_status"] == 429:
+                headers["Retry-After"] = str(settings["retry_after"])
+            return self._send_json(
+                settings["error_status"],
+                {"error": {"message": "Injected error", "type": "stub_error"}},
+                headers,
+            )
+
+        path = self.path.rstrip("/")
+        if path.endswith("/embeddings"):
+            return self._embeddings(body)
+        if path.endswith("/chat/completions"):
+            return self._chat_completions(body)
+
+        self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _embeddings(self, body: Dict[str, Any]) -> None:
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+
+        model = body.get("model", "text-embedding-3-small")
+        dimensions = body.get("dimensions") or MODEL_DIMENSIONS.get(
+            model, DEFAULT_DIMENSIONS
+        )
+        tokens = sum(count_tokens(text) for text in inputs)
+
+        self._send_json(
+            200,
+            {
+                "object": "list",
+                "model": model,
+                "data": [
+                    {
+                        "object": "embedding",
+                        "index": i,
+                        "embedding": fake_embedding(text, dimensions),
+                    }
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            },
+        )
+
+    def _chat_completions(self, body: Dict[str, Any]) -> None:
+        messages = body.get("messages", [])
+        model = body.get("model", "gpt-4o")
+        reply = stub_reply(messages)
+
+        prompt_tokens = sum(count_tokens(m.get("content", "")) for m in messages)
+        completion_tokens = count_tokens(reply)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        if body.get("stream"):
+            return self._stream_chat(completion_id, created, model, reply)
+
+        self._send_json(
+            200,
+            {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": reply},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+    def _stream_chat(self, completion_id: str, created: int, model: str, reply: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {"index": 0, "delta": delta, "finish_reason": finish_reason}
+                ],
+            }
+
+        token_delay = self.server.settings["stream_token_ms"] / 1000
+        events = [chunk({"role": "assistant", "content": ""})]
+        events += [chunk({"content": word}) for word in re.findall(r"\S+\s*", reply)]
+        events.append(chunk({}, "stop"))
+
+        for event in events:
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            if token_delay:
+                time.sleep(token_delay)
+
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _send_json(
+        self, status: int, payload: Dict[str, Any], headers: Optional[Dict] = None
+    ) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    # Bursts of concurrent clients connect at once in the load tests
+    request_queue_size = 128
+    daemon_threads = True
+
+
+class StubServer:
+    """
+    Local stand-in for the OpenAI API serving /v1/embeddings and
+    /v1/chat/completions with deterministic outputs.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 500,
+        retry_after: float = 1.0,
+        stream_token_ms: float = 0.0,
+        fail_first: int = 0,
+    ):
+        """
+        Initialize the stub server.
+
+        Args:
+            host (str, optional): Interface to bind. Defaults to "127.0.0.1".
+            port (int, optional): Port to bind, 0 for any free port. Defaults to 0.
+            latency_ms (float, optional): Fixed delay added to every request. Defaults to 0.
+            jitter_ms (float, optional): Uniform random extra delay. Defaults to 0.
+            error_rate (float, optional): Probability of answering with an error. Defaults to 0.
+            error_status (int, optional): HTTP status of injected errors. Defaults to 500.
+            retry_after (float, optional): Retry-After seconds sent with 429 errors. Defaults to 1.
+            stream_token_ms (float, optional): Delay between streamed tokens. Defaults to 0.
+            fail_first (int, optional): Answer the first N requests with an error. Defaults to 0.
+        """
+        self.httpd = _StubHTTPServer((host, port), StubHandler)
+        self.httpd.lock = threading.Lock()
+        self.httpd.request_count = 0
+        self.httpd.settings = {
+            "latency_ms": latency_ms,
+            "jitter_ms": jitter_ms,
+            "error_rate": error_rate,
+            "error_status": error_status,
+            "retry_after": retry_after,
+            "stream_token_ms": stream_token_ms,
+            "fail_first": fail_first,
+        }
+        self.thread = None
+
+    @property
+    def settings(self) -> Dict[str, float]:
+        """Mutable latency/error settings, applied to the next request."""
+        return self.httpd.settings
+
+    @property
+    def request_count(self) -> int:
+        return self.httpd.request_count
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "StubServer":
+        """Serve in a background thread."""
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub server")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency_ms", type=float, default=0.0)
+    parser.add_argument("--jitter_ms", type=float, default=0.0)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--error_status", type=int, default=500)
+    parser.add_argument("--retry_after", type=float, default=1.0)
+    parser.add_argument("--stream_token_ms", type=float, default=0.0)
+    parser.add_argument("--fail_first", type=int, default=0)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = StubServer(**vars(args))
+    print(f"Stub OpenAI API listening on {server.base_url}")
+    print(f"Point the app at it with OPENAI_BASE_URL={server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
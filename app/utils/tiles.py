@@ -0,0 +1,309 @@
+import argparse
+import json
+import os
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# A tile holding more points than this is aggregated and split in four
+MAX_TILE_POINTS = 4096
+MAX_ZOOM = 12
+# Aggregate bins per tile edge; even, so every bin falls in one child tile
+TILE_BINS = 64
+# Point metadata rows per JSON shard, fetched on click
+META_SHARD_ROWS = 1000
+META_COLUMNS = ["title", "source_name", "tstamp", "linkToArchive"]
+
+POINT_TILE = 1
+AGGREGATE_TILE = 2
+# Fraction of a tile addressable by the uint16 point coordinates
+QUANT = 65535
+
+# Same colours as the Streamlit app's palette, for the legend
+SOURCE_COLORS = {
+    "Expresso": "#FF4C4C",
+    "Web": "#E07B39",
+    "Wikipedia PT": "#556B2F",
+    "Publico": "#2c6b7e",
+}
+FALLBACK_COLORS = ["#2E9CCA", "#F4A300", "#D72638", "#8E7DBE", "#bdbcbc"]
+
+
+def world_coordinates(
+    x: np.ndarray, y: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, List[float]]:
+    """
+    Map the projection into the unit square, keeping its aspect ratio.
+
+    Args:
+        x (np.ndarray): Projection x
+        y (np.ndarray): Projection y
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray, List[float]]: u and v in [0, 1], and
+            the [x0, y0, size] of the square in projection units
+    """
+    x0, y0 = float(x.min()), float(y.min())
+    size = max(float(x.max()) - x0, float(y.max()) - y0) or 1.0
+    u = np.clip((x - x0) / size, 0.0, 1.0)
+    v = np.clip((y - y0) / size, 0.0, 1.0)
+    return u, v, [x0, y0, size]
+
+
+def encode_points(
+    qx: np.ndarray, qy: np.ndarray, rows: np.ndarray, categories: np.ndarray
+) -> bytes:
+    """
+    Point tile: an 8-byte header (kind, 3 reserved bytes, uint32 count),
+    then uint16 x, uint16 y, uint32 row and uint8 category arrays. Arrays
+    are little-endian and aligned, so a browser reads them as typed arrays
+    without copying.
+    """
+    header = np.zeros(8, dtype=np.uint8)
+    header[0] = POINT_TILE
+    header[4:8] = np.array([len(rows)], dtype="<u4").view(np.uint8)
+    return b"".join(
+        [
+            header.tobytes(),
+            qx.astype("<u2").tobytes(),
+            qy.astype("<u2").tobytes(),
+            rows.astype("<u4").tobytes(),
+            categories.astype(np.uint8).tobytes(),
+        ]
+    )
+
+
+def encode_aggregate(cells: np.ndarray, counts: np.ndarray) -> bytes:
+    """
+    Aggregate tile: an 8-byte header (kind, bins per edge, uint16 number of
+    categories, uint32 number of non-empty bins), the uint16 bin numbers
+    (row-major from the bottom-left, padded to 4 bytes) and a uint32 count
+    per bin and category.
+    """
+    header = np.zeros(8, dtype=np.uint8)
+    header[0] = AGGREGATE_TILE
+    header[1] = TILE_BINS
+    header[2:4] = np.array([counts.shape[1]], dtype="<u2").view(np.uint8)
+    header[4:8] = np.array([len(cells)], dtype="<u4").view(np.uint8)
+    padding = b"\0\0" if len(cells) % 2 else b""
+    return b"".join(
+        [
+            header.tobytes(),
+            cells.astype("<u2").tobytes(),
+            padding,
+            counts.astype("<u4").tobytes(),
+        ]
+    )
+
+
+def decode_tile(data: bytes) -> Dict[str, Any]:
+    """
+    Read a tile written by export_tiles().
+
+    Args:
+        data (bytes): Tile file contents
+
+    Returns:
+        Dict[str, Any]: kind and the arrays of the tile
+    """
+    kind = data[0]
+    count = int(np.frombuffer(data, dtype="<u4", count=1, offset=4)[0])
+    if kind == POINT_TILE:
+        offset = 8
+        qx = np.frombuffer(data, dtype="<u2", count=count, offset=offset)
+        qy = np.frombuffer(data, dtype="<u2", count=count, offset=offset + 2 * count)
+        rows = np.frombuffer(data, dtype="<u4", count=count, offset=offset + 4 * count)
+        categories = np.frombuffer(
+            data, dtype=np.uint8, count=count, offset=offset + 8 * count
+        )
+        return {"kind": kind, "x": qx, "y": qy, "rows": rows, "categories": categories}
+
+    n_categories = int(np.frombuffer(data, dtype="<u2", count=1, offset=2)[0])
+    cells = np.frombuffer(data, dtype="<u2", count=count, offset=8)
+    offset = 8 + 2 * count + (2 if count % 2 else 0)
+    counts = np.frombuffer(
+        data, dtype="<u4", count=count * n_categories, offset=offset
+    ).reshape(count, n_categories)
+    return {"kind": kind, "bins": data[1], "cells": cells, "counts": counts}
+
+
+def build_pyramid(
+    u: np.ndarray,
+    v: np.ndarray,
+    categories: np.ndarray,
+    n_categories: int,
+    max_points: int = MAX_TILE_POINTS,
+    max_zoom: int = MAX_ZOOM,
+) -> Iterator[Tuple[int, int, int, bytes]]:
+    """
+    Quadtree of tiles, top down. A tile with at most max_points points (or
+    at max_zoom) lists them and ends its branch; a denser one stores
+    per-bin category counts and is split into its non-empty children.
+    Every point is therefore stored in exactly one point tile.
+
+    Args:
+        u (np.ndarray): (n,) x in [0, 1]
+        v (np.ndarray): (n,) y in [0, 1], upwards
+        categories (np.ndarray): (n,) category number of every point
+        n_categories (int): Number of categories
+        max_points (int, optional): Points per point tile. Defaults to MAX_TILE_POINTS.
+        max_zoom (int, optional): Deepest zoom level. Defaults to MAX_ZOOM.
+
+    Yields:
+        Tuple[int, int, int, bytes]: z, x, y (from the bottom-left) and tile bytes
+    """
+    pending = [(0, 0, 0, np.arange(len(u)))]
+    while pending:
+        z, tx, ty, rows = pending.pop()
+        scale = float(1 << z)
+        # Position inside the tile, in [0, 1)
+        fx = np.clip(u[rows] * scale - tx, 0.0, 1.0 - 1e-9)
+        fy = np.clip(v[rows] * scale - ty, 0.0, 1.0 - 1e-9)
+
+        if len(rows) <= max_points or z == max_zoom:
+            yield z, tx, ty, encode_points(
+                np.round(fx * QUANT),
+                np.round(fy * QUANT),
+                rows,
+                categories[rows],
+            )
+            continue
+
+        bins = (fy * TILE_BINS).astype(np.int64) * TILE_BINS + (fx * TILE_BINS).astype(
+            np.int64
+        )
+        flat = np.bincount(
+            bins * n_categories + categories[rows],
+            minlength=TILE_BINS * TILE_BINS * n_categories,
+        ).reshape(TILE_BINS * TILE_BINS, n_categories)
+        cells = np.flatnonzero(flat.sum(axis=1))
+        yield z, tx, ty, encode_aggregate(cells, flat[cells])
+
+        quadrant = (fy >= 0.5).astype(np.int64) * 2 + (fx >= 0.5)
+        for q in range(4):
+            child = rows[quadrant == q]
+            if len(child):
+                pending.append((z + 1, 2 * tx + q % 2, 2 * ty + q // 2, child))
+
+
+def category_colors(categories: Sequence[str]) -> Dict[str, str]:
+    """Legend colour of every category: the app's, then a fallback cycle."""
+    colors, fallback = {}, 0
+    for category in categories:
+        if category in SOURCE_COLORS:
+            colors[category] = SOURCE_COLORS[category]
+        else:
+            colors[category] = FALLBACK_COLORS[fallback % len(FALLBACK_COLORS)]
+            fallback += 1
+    return colors
+
+
+def export_tiles(
+    umap_df: pd.DataFrame,
+    output_dir: str,
+    max_points: int = MAX_TILE_POINTS,
+    max_zoom: int = MAX_ZOOM,
+) -> Dict[str, Any]:
+    """
+    Write the tile pyramid, the point metadata shards and the manifest
+    read by site/map/index.html.
+
+    Args:
+        umap_df (pd.DataFrame): Projection table with x, y and source_name
+        output_dir (str): Output directory
+        max_points (int, optional): Points per point tile. Defaults to MAX_TILE_POINTS.
+        max_zoom (int, optional): Deepest zoom level. Defaults to MAX_ZOOM.
+
+    Returns:
+        Dict[str, Any]: The manifest
+    """
+    sources = umap_df["source_name"].astype(str)
+    categories = sorted(sources.unique())
+    if len(categories) > 255:
+        raise ValueError("Point tiles store the category in one byte")
+    category_of = {category: i for i, category in enumerate(categories)}
+    codes = sources.map(category_of).to_numpy(dtype=np.int64)
+    u, v, bounds = world_coordinates(
+        umap_df["x"].to_numpy(dtype=np.float64), umap_df["y"].to_numpy(dtype=np.float64)
+    )
+
+    tiles, total_bytes, deepest = 0, 0, 0
+    for z, tx, ty, data in build_pyramid(
+        u, v, codes, len(categories), max_points, max_zoom
+    ):
+        tile_dir = os.path.join(output_dir, "tiles", str(z), str(tx))
+        os.makedirs(tile_dir, exist_ok=True)
+        with open(os.path.join(tile_dir, f"{ty}.bin"), "wb") as f:
+            f.write(data)
+        tiles += 1
+        total_bytes += len(data)
+        deepest = max(deepest, z)
+
+    meta_dir = os.path.join(output_dir, "meta")
+    os.makedirs(meta_dir, exist_ok=True)
+    meta = umap_df.reindex(columns=META_COLUMNS).fillna("").astype(str)
+    for shard, start in enumerate(range(0, len(meta), META_SHARD_ROWS)):
+        with open(os.path.join(meta_dir, f"{shard}.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                meta.iloc[start : start + META_SHARD_ROWS].values.tolist(),
+                f,
+                ensure_ascii=False,
+                separators=(",", ":"),
+            )
+
+    manifest = {
+        "type": "tiles",
+        "version": 1,
+        "points": len(umap_df),
+        "bounds": bounds,
+        "categories": categories,
+        "colors": category_colors(categories),
+        "bins": TILE_BINS,
+        "max_points": max_points,
+        "max_zoom": deepest,
+        "tiles": tiles,
+        "bytes": total_bytes,
+        "meta_columns": META_COLUMNS,
+        "meta_shard_rows": META_SHARD_ROWS,
+    }
+    with open(os.path.join(output_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    return manifest
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Export the document map as static tiles for site/map"
+    )
+    parser.add_argument(
+        "--umap_path",
+        type=str,
+        default="./data/embeddings/umap_metadata.csv",
+        help="Projection table",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./site/map/data",
+        help="Output directory, served next to site/map/index.html",
+    )
+    parser.add_argument("--max_points", type=int, default=MAX_TILE_POINTS)
+    parser.add_argument("--max_zoom", type=int, default=MAX_ZOOM)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    manifest = export_tiles(
+        pd.read_csv(args.umap_path), args.output, args.max_points, args.max_zoom
+    )
+    print(
+        f"Wrote {manifest['tiles']} tiles ({manifest['bytes'] / 1e6:.1f} MB, "
+        f"zoom 0-{manifest['max_zoom']}) for {manifest['points']} points "
+        f"to {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.bm25 import tokenize
+from utils.ivf import assign, assignment_pool, kmeans
+from utils.knn_graph import normalize
+
+# Keywords kept per topic, and chunks shown to the labeler
+TOP_KEYWORDS = 10
+EXAMPLES_PER_TOPIC = 3
+
+# labeler(keywords, example_texts) -> short label
+Labeler = Callable[[List[str], List[str]], str]
+
+
+def topic_keywords(
+    texts: Sequence[str],
+    assignments: np.ndarray,
+    n_topics: int,
+    top_n: int = TOP_KEYWORDS,
+) -> List[List[str]]:
+    """
+    Most distinctive words of every topic by class-based TF-IDF: the
+    chunks of a topic are treated as one document, as BERTopic does.
+
+    Args:
+        texts (Sequence[str]): Chunk texts
+        assignments (np.ndarray): (n,) topic of every chunk
+        n_topics (int): Number of topics
+        top_n (int, optional): Words per topic. Defaults to TOP_KEYWORDS.
+
+    Returns:
+        List[List[str]]: Keywords of every topic, best first
+    """
+    counts = [Counter() for _ in range(n_topics)]
+    for text, topic in zip(texts, assignments):
+        if topic >= 0:
+            counts[topic].update(tokenize(text or ""))
+
+    frequency = Counter()
+    for topic_counts in counts:
+        frequency.update(topic_counts)
+    average_words = sum(frequency.values()) / max(n_topics, 1)
+
+    keywords = []
+    for topic_counts in counts:
+        total = sum(topic_counts.values()) or 1
+        scores = {
+            word: count / total * np.log(1 + average_words / frequency[word])
+            for word, count in topic_counts.items()
+        }
+        keywords.append(sorted(scores, key=lambda w: (-scores[w], w))[:top_n])
+    return keywords
+
+
+def representative_rows(
+    embeddings: np.ndarray,
+    assignments: np.ndarray,
+    centroids: np.ndarray,
+    per_topic: int = EXAMPLES_PER_TOPIC,
+) -> List[np.ndarray]:
+    """
+    Chunks closest to every topic centroid.
+
+    Args:
+        embeddings (np.ndarray): (n, d) unit-length embeddings
+        assignments (np.ndarray): (n,) topic of every chunk
+        centroids (np.ndarray): (n_topics, d) unit-length centroids
+        per_topic (int, optional): Rows per topic. Defaults to EXAMPLES_PER_TOPIC.
+
+    Returns:
+        List[np.ndarray]: Rows of every topic, closest first
+    """
+    examples = []
+    for topic, centroid in enumerate(centroids):
+        members = np.flatnonzero(assignments == topic)
+        similarity = embeddings[members] @ centroid
+        examples.append(members[np.argsort(-similarity, kind="stable")[:per_topic]])
+    return examples
+
+
+def label_signature(keywords: Sequence[str]) -> str:
+    """Label cache key of a topic; unchanged keywords keep their label."""
+    return hashlib.sha1("|".join(keywords).encode("utf-8")).hexdigest()[:16]
+
+
+class TopicModel:
+    """
+    Topics of a collection, clustered offline from the stored embeddings:
+    every chunk's topic, the topic centroids, keywords and labels.
+    """
+
+    def __init__(
+        self,
+        ids: List[str],
+        assignments: np.ndarray,
+        centroids: np.ndarray,
+        keywords: List[List[str]],
+        labels: List[str],
+    ):
+        """
+        Initialize the topic model.
+
+        Args:
+            ids (List[str]): Chunk ids, indexed by row
+            assignments (np.ndarray): (n,) topic of every row
+            centroids (np.ndarray): (n_topics, d) unit-length centroids
+            keywords (List[List[str]]): Keywords of every topic
+            labels (List[str]): Label of every topic
+        """
+        self.ids = ids
+        self.assignments = assignments
+        self.centroids = centroids
+        self.keywords = keywords
+        self.labels = labels
+        self._id_to_row = None
+
+    @property
+    def n_topics(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        ids: List[str],
+        embeddings: np.ndarray,
+        texts: Sequence[str],
+        n_topics: int = 20,
+        labeler: Optional[Labeler] = None,
+        label_cache: Optional[Dict[str, str]] = None,
+        seed: int = 0,
+        workers: int = 1,
+    ) -> "TopicModel":
+        """
+        Cluster the embeddings with spherical k-means and describe the topics.
+
+        Not BERTopic, as in the notebook: it is pinned in requirements.txt
+        but drags umap-learn, hdbscan and sentence-transformers into the
+        app, and the notebook's Ward clustering needs memory quadratic in
+        the number of chunks. k-means reuses the IVF code and scales
+        linearly.
+
+        Args:
+            ids (List[str]): Chunk ids
+            embeddings (np.ndarray): (n, d) stored embeddings
+            texts (Sequence[str]): Chunk texts, for the keywords
+            n_topics (int, optional): Number of topics. Defaults to 20.
+            labeler (Optional[Labeler], optional): Names a topic from its
+                keywords and example chunks, e.g. OpenAIGenerator.label_topic.
+                Defaults to None (the top keywords).
+            label_cache (Optional[Dict[str, str]], optional): Labels of a
+                previous build by label_signature(); only topics missing
+                from it are sent to the labeler
+            seed (int, optional): Random seed. Defaults to 0.
+            workers (int, optional): Worker processes for assignment. Defaults to 1.
+
+        Returns:
+            TopicModel: The topics
+        """
+        vectors = normalize(np.asarray(embeddings, dtype=np.float32))
+        n_topics = min(n_topics, len(vectors))
+
+        # On unit vectors, L2 k-means ranks like cosine
+        with assignment_pool(workers) as pool:
+            centroids = normalize(
+                kmeans(
+                    vectors, n_topics, sample_size=len(vectors), seed=seed, pool=pool
+                )
+            )
+            assignments = assign(vectors, centroids, pool)
+
+        keywords = topic_keywords(texts, assignments, n_topics)
+        examples = representative_rows(vectors, assignments, centroids)
+        label_cache = label_cache or {}
+
+        labels = []
+        for topic in range(n_topics):
+            signature = label_signature(keywords[topic])
+            if signature not in label_cache:
+                if labeler is None:
+                    label_cache[signature] = ", ".join(keywords[topic][:3])
+                else:
+                    label_cache[signature] = labeler(
+                        keywords[topic], [texts[row] for row in examples[topic]]
+                    )
+            labels.append(label_cache[signature])
+
+        return cls(list(ids), assignments.astype(np.int32), centroids, keywords, labels)
+
+    def save(self, path: str) -> None:
+        """
+        Save the topics to a directory.
+
+        Args:
+            path (str): Destination directory
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "ids.npy"), np.array(self.ids))
+        np.save(os.path.join(path, "assignments.npy"), self.assignments)
+        np.save(os.path.join(path, "centroids.npy"), self.centroids)
+        sizes = np.bincount(
+            self.assignments[self.assignments >= 0], minlength=self.n_topics
+        )
+        with open(os.path.join(path, "topics.json"), "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "type": "topics",
+                    "count": len(self.ids),
+                    "topics": [
+                        {
+                            "id": topic,
+                            "label": self.labels[topic],
+                            "keywords": self.keywords[topic],
+                            "size": int(sizes[topic]),
+                            "signature": label_signature(self.keywords[topic]),
+                        }
+                        for topic in range(self.n_topics)
+                    ],
+                },
+                f,
+                ensure_ascii=False,
+                indent=4,
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "TopicModel":
+        """
+        Load topics saved with save().
+
+        Args:
+            path (str): Topic directory
+
+        Returns:
+            TopicModel: The loaded topics
+        """
+        with open(os.path.join(path, "topics.json"), encoding="utf-8") as f:
+            topics = json.load(f)["topics"]
+        return cls(
+            np.load(os.path.join(path, "ids.npy")).tolist(),
+            np.load(os.path.join(path, "assignments.npy")),
+            np.load(os.path.join(path, "centroids.npy")),
+            [topic["keywords"] for topic in topics],
+            [topic["label"] for topic in topics],
+        )
+
+    @staticmethod
+    def load_label_cache(path: str) -> Dict[str, str]:
+        """
+        Labels of the topics saved at path, for rebuilding without
+        relabeling unchanged topics; empty when there are none.
+
+        Args:
+            path (str): Topic directory
+
+        Returns:
+            Dict[str, str]: Label by label_signature()
+        """
+        manifest = os.path.join(path, "topics.json")
+        if not os.path.exists(manifest):
+            return {}
+        with open(manifest, encoding="utf-8") as f:
+            return {
+                topic["signature"]: topic["label"] for topic in json.load(f)["topics"]
+            }
+
+    def mask(self, topics: Sequence[int]) -> np.ndarray:
+        """
+        Rows in any of the given topics.
+
+        Args:
+            topics (Sequence[int]): Topic ids
+
+        Returns:
+            np.ndarray: (n,) boolean mask
+        """
+        return np.isin(self.assignments, np.asarray(list(topics), dtype=np.int32))
+
+    def topics_of(self, ids: Sequence[str]) -> np.ndarray:
+        """
+        Topic of the given chunks, -1 for chunks clustered after the build.
+
+        Args:
+            ids (Sequence[str]): Chunk ids
+
+        Returns:
+            np.ndarray: Topic of every id
+        """
+        if self._id_to_row is None:
+            self._id_to_row = {doc_id: row for row, doc_id in enumerate(self.ids)}
+        rows = np.array([self._id_to_row.get(i, -1) for i in ids], dtype=np.int64)
+        return np.where(rows >= 0, self.assignments[rows], -1).astype(np.int32)
+
+    def row_topics(self, row_index: Dict[str, int], n_rows: int) -> np.ndarray:
+        """
+        Topic of every projection row, -1 for rows without one.
+
+        Args:
+            row_index (Dict[str, int]): Chunk id → projection row, from
+                utils.highlights.build_row_index()
+            n_rows (int): Rows of the projection table
+
+        Returns:
+            np.ndarray: (n_rows,) topics
+        """
+        topics = np.full(n_rows, -1, dtype=np.int32)
+        ids = list(row_index)
+        topics[[row_index[i] for i in ids]] = self.topics_of(ids)
+        return topics
+
+    def label_positions(
+        self, x: np.ndarray, y: np.ndarray, row_topics: np.ndarray
+    ) -> np.ndarray:
+        """
+        Map position of every topic label: the median of its points, which
+        stays inside a curved cluster more often than the mean.
+
+        Args:
+            x (np.ndarray): (n_rows,) projection x
+            y (np.ndarray): (n_rows,) projection y
+            row_topics (np.ndarray): Result of row_topics()
+
+        Returns:
+            np.ndarray: (n_topics, 2), NaN for topics without points
+        """
+        positions = np.full((self.n_topics, 2), np.nan)
+        for topic in range(self.n_topics):
+            members = row_topics == topic
+            if members.any():
+                positions[topic] = np.median(x[members]), np.median(y[members])
+        return positions
+
+
+def build_from_collection(
+    collection,
+    n_topics: int = 20,
+    labeler: Optional[Labeler] = None,
+    label_cache: Optional[Dict[str, str]] = None,
+    batch_size: int = 1000,
+    workers: int = 1,
+) -> TopicModel:
+    """
+    Cluster a collection's stored embeddings, without embedding anything.
+
+    Args:
+        collection: ChromaDB collection
+        n_topics (int, optional): Number of topics. Defaults to 20.
+        labeler (Optional[Labeler], optional): See TopicModel.build()
+        label_cache (Optional[Dict[str, str]], optional): See TopicModel.build()
+        batch_size (int, optional): Chunks fetched per request. Defaults to 1000.
+        workers (int, optional): Worker processes for assignment. Defaults to 1.
+
+    Returns:
+        TopicModel: The topics
+    """
+    ids, embeddings, texts = [], [], []
+    offset = 0
+    while True:
+        batch = collection.get(
+            include=["embeddings", "documents"], limit=batch_size, offset=offset
+        )
+        if not batch["ids"]:
+            break
+        ids.extend(batch["ids"])
+        embeddings.append(np.asarray(batch["embeddings"], dtype=np.float32))
+        texts.extend(batch["documents"])
+        offset += len(batch["ids"])
+
+    return TopicModel.build(
+        ids,
+        np.concatenate(embeddings),
+        texts,
+        n_topics,
+        labeler=labeler,
+        label_cache=label_cache,
+        workers=workers,
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Cluster a ChromaDB collection into labeled topics"
+    )
+    parser.add_argument(
+        "--db_path",
+        type=str,
+        default="./data/chroma_cravo",
+        help="Path to ChromaDB directory",
+    )
+    parser.add_argument(
+        "--collection_name",
+        type=str,
+        default="cravo",
+        help="Name of the ChromaDB collection",
+    )
+    parser.add_argument("--n_topics", type=int, default=20)
+    parser.add_argument(
+        "--output",
+        type=str,
+        default="./data/embeddings/topics",
+        help="Output directory; labels of unchanged topics are reused",
+    )
+    parser.add_argument(
+        "--no_llm",
+        action="store_true",
+        help="Label topics with their keywords instead of the LLM",
+    )
+    parser.add_argument("--workers", type=int, default=1)
+    return parser.parse_args()
+
+
+def main():
+    import chromadb
+    from chromadb.config import Settings
+
+    args = parse_args()
+
+    client = chromadb.PersistentClient(
+        path=args.db_path, settings=Settings(anonymized_telemetry=False)
+    )
+    collection = client.get_collection(args.collection_name)
+
+    labeler = None
+    if not args.no_llm:
+        from dotenv import load_dotenv
+        from utils.generator import OpenAIGenerator
+
+        load_dotenv()
+        labeler = OpenAIGenerator(api_key=os.getenv("OPENAI_API_KEY")).label_topic
+
+    model = build_from_collection(
+        collection,
+        args.n_topics,
+        labeler=labeler,
+        label_cache=TopicModel.load_label_cache(args.output),
+        workers=args.workers,
+    )
+    model.save(args.output)
+    print(f"Clustered {len(model.ids)} chunks into {model.n_topics} topics:")
+    for topic, label in enumerate(model.labels):
+        print(f"  {topic}: {label}")
+
+
+if __name__ == "__main__":
+    main()
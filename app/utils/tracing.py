@@ -0,0 +1,268 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+
+class Span:
+    """
+    A timed stage of a chat turn, with free-form attributes
+    (token counts, cache hits, retry counts, ...).
+    """
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start_time = time.time()
+        self.duration_ms = None
+        self.attributes: Dict[str, Any] = {}
+        self._start = time.perf_counter()
+        self._otel_span = None
+
+    def set(self, key: str, value: Any) -> None:
+        """Set an attribute on the span."""
+        self.attributes[key] = value
+        if self._otel_span is not None:
+            self._otel_span.set_attribute(key, value)
+
+    def incr(self, key: str, amount: int = 1) -> None:
+        """Increment a counter attribute on the span."""
+        self.set(key, self.attributes.get(key, 0) + amount)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+        }
+
+
+class _NullSpan:
+    """Stand-in returned by current_span() outside any span."""
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def incr(self, key: str, amount: int = 1) -> None:
+        pass
+
+
+class Tracer:
+    """
+    Records spans, keeps rolling per-stage latencies in memory and
+    optionally exports finished spans to a JSONL file and/or an
+    OpenTelemetry collector.
+    """
+
+    def __init__(
+        self,
+        window: int = 500,
+        jsonl_path: Optional[str] = None,
+        otel_endpoint: Optional[str] = None,
+    ):
+        """
+        Initialize the tracer.
+
+        Args:
+            window (int, optional): Spans kept per stage for rolling percentiles.
+                Defaults to 500.
+            jsonl_path (str, optional): Append finished spans to this file.
+                Defaults to None.
+            otel_endpoint (str, optional): OTLP/gRPC endpoint of a local collector,
+                e.g. "http://localhost:4317". Defaults to None.
+        """
+        self.window = window
+        self.jsonl_path = jsonl_path
+        self._lock = threading.Lock()
+        self._durations: Dict[str, Deque[float]] = {}
+        self._recent: Deque[Dict[str, Any]] = deque(maxlen=window)
+        self._otel_tracer = None
+
+        if jsonl_path:
+            os.makedirs(os.path.dirname(jsonl_path) or ".", exist_ok=True)
+        if otel_endpoint:
+            self._otel_tracer = _make_otel_tracer(otel_endpoint)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """
+        Time a block of code as a named stage.
+
+        Args:
+            name (str): Stage name, e.g. "embedding" or "generation"
+            **attributes: Initial span attributes
+
+        Yields:
+            Span: The active span
+        """
+        parent = _current_span.get()
+        span = Span(
+            name,
+            trace_id=parent.trace_id if parent else uuid.uuid4().hex,
+            parent_id=parent.span_id if parent else None,
+        )
+        token = _current_span.set(span)
+
+        otel_cm = None
+        if self._otel_tracer is not None:
+            otel_cm = self._otel_tracer.start_as_current_span(name)
+            span._otel_span = otel_cm.__enter__()
+
+        for key, value in attributes.items():
+            span.set(key, value)
+
+        exc_info = (None, None, None)
+        try:
+            yield span
+        except Exception as e:
+            span.set("error", type(e).__name__)
+            exc_info = sys.exc_info()
+            raise
+        finally:
+            span.duration_ms = (time.perf_counter() - span._start) * 1000
+            _current_span.reset(token)
+            if otel_cm is not None:
+                # The OTel span records the exception and an error status
+                otel_cm.__exit__(*exc_info)
+            self._record(span)
+
+    def _record(self, span: Span) -> None:
+        record = span.to_dict()
+        with self._lock:
+            if span.name not in self._durations:
+                self._durations[span.name] = deque(maxlen=self.window)
+            self._durations[span.name].append(span.duration_ms)
+            self._recent.append(record)
+
+            if self.jsonl_path:
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, default=str) + "\n")
+
+    def stage_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Rolling latency percentiles per stage.
+
+        Returns:
+            Dict[str, Dict[str, float]]: count, p50_ms and p95_ms per stage name
+        """
+        with self._lock:
+            snapshot = {name: list(values) for name, values in self._durations.items()}
+
+        stats = {}
+        for name, values in snapshot.items():
+            p50, p95 = np.percentile(values, [50, 95])
+            stats[name] = {"count": len(values), "p50_ms": p50, "p95_ms": p95}
+        return stats
+
+    def recent_spans(self) -> List[Dict[str, Any]]:
+        """Most recent finished spans, oldest first."""
+        with self._lock:
+            return list(self._recent)
+
+
+def _make_otel_tracer(endpoint: str):
+    """Create an OpenTelemetry tracer exporting over OTLP, if installed."""
+    try:
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import (
+            OTLPSpanExporter,
+        )
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        logger.warning(
+            "OpenTelemetry export requested but opentelemetry-sdk and "
+            "opentelemetry-exporter-otlp are not installed. Skipping."
+        )
+        return None
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": "arquivo-dos-cravos"})
+    )
+    provider.add_span_processor(
+        BatchSpanProcessor(OTLPSpanExporter(endpoint=endpoint, insecure=True))
+    )
+    return provider.get_tracer(__name__)
+
+
+_tracer = Tracer()
+
+
+def configure_tracing(
+    jsonl_path: Optional[str] = None,
+    otel_endpoint: Optional[str] = None,
+    window: int = 500,
+) -> Tracer:
+    """
+    Replace the process-wide tracer.
+
+    Args:
+        jsonl_path (str, optional): Append finished spans to this file
+        otel_endpoint (str, optional): OTLP/gRPC collector endpoint
+        window (int, optional): Spans kept per stage. Defaults to 500.
+
+    Returns:
+        Tracer: The new tracer
+    """
+    global _tracer
+    _tracer = Tracer(window=window, jsonl_path=jsonl_path, otel_endpoint=otel_endpoint)
+    return _tracer
+
+
+def get_tracer() -> Tracer:
+    """Return the process-wide tracer."""
+    return _tracer
+
+
+def span(name: str, **attributes):
+    """Shortcut for get_tracer().span(...)."""
+    return _tracer.span(name, **attributes)
+
+
+def current_span():
+    """Return the active span, or a no-op stand-in outside any span."""
+    return _current_span.get() or _NullSpan()
+
+
+def traced(name: str) -> Callable:
+    """
+    Decorator timing every call of a function as a span.
+
+    Args:
+        name (str): Stage name
+
+    Returns:
+        Callable: Decorator
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with _tracer.span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,162 @@
+import os
+import sys
+import threading
+import time
+
+import chromadb
+import numpy as np
+import pandas as pd
+import pytest
+from chromadb.config import Settings
+
+# Add the app directory to path to import modules
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "app"))
+
+from utils.bm25 import build_from_collection
+from utils.corpora import Corpus, CorpusCache, estimate_bytes, resolve_collections
+from utils.create_test_db import SAMPLE_DOCS, FakeEmbedding, create_collection
+from utils.retriever import ChromaDBRetriever
+
+COLLECTION_NAME = "test_cravo"
+
+EXACT_HNSW = {"hnsw:construction_ef": 400, "hnsw:search_ef": 400, "hnsw:M": 64}
+
+
+@pytest.fixture(scope="module")
+def hybrid_retriever(tmp_path_factory):
+    """Retriever of the sample documents with a BM25 index."""
+    db_path = str(tmp_path_factory.mktemp("chroma"))
+    client = chromadb.PersistentClient(
+        path=db_path, settings=Settings(anonymized_telemetry=False)
+    )
+    client.create_collection(COLLECTION_NAME, metadata=EXACT_HNSW)
+    create_collection(
+        client,
+        COLLECTION_NAME,
+        SAMPLE_DOCS,
+        FakeEmbedding().get_embeddings(SAMPLE_DOCS),
+        [f"sample_{i}" for i in range(len(SAMPLE_DOCS))],
+        [{"link": "", "m_id": i} for i in range(len(SAMPLE_DOCS))],
+    )
+
+    plain = ChromaDBRetriever(
+        db_path=db_path, collection_name=COLLECTION_NAME, embedding=FakeEmbedding()
+    )
+    bm25_path = str(tmp_path_factory.mktemp("bm25") / "bm25_index.npz")
+    build_from_collection(plain.collection).save(bm25_path)
+
+    return ChromaDBRetriever(
+        db_path=db_path,
+        collection_name=COLLECTION_NAME,
+        embedding=FakeEmbedding(),
+        bm25_path=bm25_path,
+    )
+
+
+def test_corpus_cache_is_lru_and_memory_bounded():
+    cache = CorpusCache(max_bytes=3000, max_entries=3, sizeof=lambda c: c.nbytes)
+    loads = []
+
+    def loader(name, size):
+        def load():
+            loads.append(name)
+            time.sleep(0.05)
+            return np.zeros(size, dtype=np.uint8)
+
+        return load
+
+    # Concurrent first requests share one load
+    threads = [
+        threading.Thread(target=cache.get, args=("cravo", loader("cravo", 1000)))
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loads == ["cravo"]
+
+    cache.get("guerra", loader("guerra", 1000))
+    cache.get("cravo", loader("cravo", 1000))  # hit: guerra is now least recent
+    cache.get("web", loader("web", 1500))  # over 3000 bytes: guerra goes
+    stats = cache.stats()
+    assert [c["name"] for c in stats["corpora"]] == ["cravo", "web"]
+    assert stats["bytes"] == 2500 and stats["evictions"] == 1
+    assert stats["loads"] == 3 and stats["hits"] == 1 and stats["misses"] == 6
+
+    cache.get("a", loader("a", 10))
+    cache.get("b", loader("b", 10))  # max_entries: cravo goes
+    assert [c["name"] for c in cache.stats()["corpora"]] == ["web", "a", "b"]
+
+    # A corpus over the whole budget is still served, alone
+    cache.get("huge", loader("huge", 5000))
+    assert [c["name"] for c in cache.stats()["corpora"]] == ["huge"]
+    assert cache.evict("huge") and not cache.evict("huge")
+
+
+def test_corpus_size_counts_shared_indexes(hybrid_retriever):
+    results = hybrid_retriever.collection.get(include=["documents", "metadatas"])
+    umap_df = pd.DataFrame({"x": np.zeros(len(results["ids"]))})
+    corpus = Corpus(
+        COLLECTION_NAME,
+        hybrid_retriever,
+        results["documents"],
+        results["metadatas"],
+        umap_df,
+        {doc_id: row for row, doc_id in enumerate(results["ids"])},
+        np.arange(len(results["ids"])),
+    )
+    bm25_bytes = sum(
+        value.nbytes
+        for value in vars(hybrid_retriever.bm25).values()
+        if isinstance(value, np.ndarray)
+    )
+    documents_bytes = sum(sys.getsizeof(doc) for doc in results["documents"])
+    assert corpus.memory_bytes() > bm25_bytes + documents_bytes
+    assert estimate_bytes([corpus, corpus]) < 2 * corpus.memory_bytes()
+
+    collections = resolve_collections(
+        {
+            "bm25_index_path": "./data/embeddings/bm25_index.npz",
+            "collections": {"guerra": {"db_path": "./data/chroma_guerra"}},
+        },
+        "cravo",
+        "./data/chroma_cravo",
+    )
+    assert collections["cravo"]["bm25_index_path"] == "./data/embeddings/bm25_index.npz"
+    assert collections["guerra"] == {
+        "db_path": "./data/chroma_guerra",
+        "embeddings_path": "./data/embeddings/guerra/",
+        "bm25_index_path": None,
+        "vector_index_path": None,
+        "filter_index_path": None,
+        "hierarchy_index_path": None,
+        "knn_graph_path": None,
+        "topics_path": None,
+    }
+
+
+def test_corpus_cache_does_not_reload_a_corpus_stored_after_a_miss():
+    cache = CorpusCache()
+    loads = []
+
+    def load():
+        loads.append("cravo")
+        return np.zeros(10, dtype=np.uint8)
+
+    do = cache._loads.do
+    raced = []
+
+    def late_do(key, call):
+        # Another request loads the corpus between this one's miss and its load
+        if not raced:
+            raced.append(key)
+            cache.get(key, load)
+        return do(key, call)
+
+    cache._loads.do = late_do
+    first = cache.get("cravo", load)
+    assert loads == ["cravo"]
+    assert first is cache.get("cravo", load)
+    assert cache.stats()["loads"] == 1
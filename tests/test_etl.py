@@ -0,0 +1,488 @@
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import chromadb
+import pandas as pd
+import pytest
+from chromadb.config import Settings
+
+# Add the app directory to path to import modules
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "app"))
+
+from etl.corpus_io import benchmark as format_benchmark
+from etl.corpus_io import parents_path, read_corpus
+from etl.extract import benchmark, extract_text
+from etl.fetcher import ArquivoFetcher
+from etl.incremental import chunk_text, ingest
+from etl.preprocess import JsonDataProcessor
+from utils.create_test_db import FakeEmbedding
+from utils.hierarchy import count_tokens
+from utils.highlights import build_row_index
+from utils.resilience import RetryPolicy
+
+# Crawl subdirectories of the incremental ingest tests
+SOURCES = {"publico": "Publico", "expresso": "Expresso"}
+
+
+def _item(n: int, url: str, tstamp: str) -> dict:
+    # Shaped like a TextSearch response_item, links pointing at arquivo.pt
+    return {
+        "title": f"Página {n}",
+        "originalURL": url,
+        "linkToArchive": f"https://arquivo.pt/wayback/{tstamp}/{url}",
+        "linkToNoFrame": f"https://arquivo.pt/noFrame/replay/{tstamp}/{url}",
+        "linkToScreenshot": f"https://arquivo.pt/screenshot?url={tstamp}",
+        "linkToExtractedText": f"https://arquivo.pt/textextracted?m={url}/{tstamp}",
+        "tstamp": tstamp,
+    }
+
+
+ITEMS = [
+    _item(i, f"http://publico.pt/25-abril-{i}", f"2014042{i}120000") for i in range(3)
+]
+# A later capture of the first page, found through the CDX API
+RECAPTURE = _item(3, ITEMS[0]["originalURL"], "20150425120000")
+
+# (path, sorted query) -> recorded body
+RECORDED = {
+    ("/textsearch", (("maxItems", "2"), ("prettyPrint", "false"), ("q", "cravos"))): {
+        "response_items": ITEMS[:2],
+        "next_page": "https://arquivo.pt/textsearch?q=cravos&maxItems=2&offset=2",
+    },
+    ("/textsearch", (("maxItems", "2"), ("offset", "2"), ("q", "cravos"))): {
+        "response_items": ITEMS[2:],
+        "next_page": "https://arquivo.pt/textsearch?q=cravos&maxItems=2&offset=4",
+    },
+    ("/textsearch", (("maxItems", "2"), ("offset", "4"), ("q", "cravos"))): {
+        "response_items": []
+    },
+    ("/wayback/cdx", (("output", "json"), ("url", "http://publico.pt/25-abril-0"))): (
+        "\n".join(
+            json.dumps(row)
+            for row in [
+                {"url": ITEMS[0]["originalURL"], "timestamp": "1", "digest": "A"},
+                {"url": ITEMS[0]["originalURL"], "timestamp": "2", "digest": "A"},
+                {"url": ITEMS[0]["originalURL"], "timestamp": "3", "digest": "B"},
+                {"url": ITEMS[0]["originalURL"], "timestamp": "4", "status": "404"},
+            ]
+        )
+    ),
+    ("/textsearch", (("metadata", "http://publico.pt/25-abril-0/1"),)): {
+        "response_items": [ITEMS[0]]
+    },
+    ("/textsearch", (("metadata", "http://publico.pt/25-abril-0/3"),)): {
+        "response_items": [RECAPTURE]
+    },
+}
+TEXTS = {
+    f"{item['originalURL']}/{item['tstamp']}": (
+        f"Menu\nNotícia {i} sobre o 25 de Abril de 1974.\n\n"
+        f"Os capitães na rua, parágrafo {i}."
+    )
+    for i, item in enumerate(ITEMS + [RECAPTURE])
+}
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        parts = urlsplit(self.path)
+        query = dict(parse_qsl(parts.query))
+        with server.lock:
+            server.arrivals.append(time.monotonic())
+            delay = server.delays.pop(0) if server.delays else 0.02
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            server.hits[parts.path] = server.hits.get(parts.path, 0) + 1
+            fail = server.failures.get(query.get("m"), 0)
+            if fail:
+                server.failures[query["m"]] = fail - 1
+        time.sleep(delay)
+
+        headers = {}
+        if parts.path == "/textextracted":
+            if fail:
+                status, body = 503, b""
+                headers["Retry-After"] = "0.05"
+            else:
+                status, body = 200, TEXTS[query["m"]].encode("utf-8")
+                etag = f'"{hash(query["m"])}"'
+                headers["ETag"] = etag
+                if self.headers.get("If-None-Match") == etag:
+                    status, body = 304, b""
+        else:
+            recorded = RECORDED.get((parts.path, tuple(sorted(query.items()))))
+            status = 404 if recorded is None else 200
+            if not isinstance(recorded, str):
+                recorded = json.dumps(recorded)
+            body = recorded.encode("utf-8")
+
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        with server.lock:
+            server.in_flight -= 1
+
+
+@pytest.fixture
+def arquivo():
+    """Local server replaying recorded Arquivo.pt responses."""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ReplayHandler)
+    server.daemon_threads = True
+    server.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.lock = threading.Lock()
+    server.in_flight = server.max_in_flight = 0
+    server.hits = {}
+    server.arrivals = []
+    # Seconds taken by the next responses; 0.02 after these
+    server.delays = []
+    # The first page's text fails twice before it is served
+    server.failures = {f"{ITEMS[0]['originalURL']}/{ITEMS[0]['tstamp']}": 2}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetcher_writes_processor_layout_and_resumes(arquivo, tmp_path):
+    output_path = str(tmp_path / "res" / "publico" / "arquivo.json")
+
+    def fetch(refresh=False, urls=()):
+        async def run():
+            async with ArquivoFetcher(
+                base_url=arquivo.base_url,
+                concurrency=2,
+                rate_per_s=200,
+                retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01),
+                cache_dir=str(tmp_path / "cache"),
+            ) as fetcher:
+                items = await fetcher.search("cravos", page_size=2)
+                for url in urls:
+                    items += await fetcher.captures(url)
+                counts = await fetcher.fetch_to_file(items, output_path, refresh)
+            return items, counts, fetcher.stats
+
+        return asyncio.run(run())
+
+    items, counts, stats = fetch()
+    assert [item["tstamp"] for item in items] == [item["tstamp"] for item in ITEMS]
+    assert counts == {"fetched": 3, "skipped": 0, "failed": 0}
+    assert stats["retries"] == 2
+    assert arquivo.max_in_flight <= 2
+
+    # The processor reads the file as it reads the hand-made crawls
+    entries = JsonDataProcessor(output_path).process_file(output_path)
+    assert len(entries) == 6  # "Menu" is too short to be a paragraph
+    assert entries[0]["parent_title"] == "Página 0"
+    assert entries[0]["text"] == "Notícia 0 sobre o 25 de Abril de 1974."
+    assert entries[0]["link"] == (
+        "https://arquivo.pt/noFrame/replay/20140420120000/http://publico.pt/25-abril-0"
+    )
+
+    # A rerun skips pages already written; CDX captures with a known digest
+    # or an error status are dropped
+    arquivo.hits.clear()
+    items, counts, _ = fetch(urls=[ITEMS[0]["originalURL"]])
+    assert len(items) == 5
+    assert counts == {"fetched": 1, "skipped": 4, "failed": 0}
+    assert arquivo.hits["/textextracted"] == 1
+    with open(output_path) as f:
+        assert sorted(json.load(f)) == sorted(
+            [item["tstamp"] for item in ITEMS + [RECAPTURE]]
+        )
+
+    # A refresh revalidates every page instead of downloading it again
+    _, counts, stats = fetch(refresh=True)
+    assert counts["fetched"] == 3
+    assert stats["not_modified"] == 3
+    assert len(JsonDataProcessor(output_path).process_file(output_path)) == 8
+
+
+def test_fetcher_spaces_requests_after_slow_responses(arquivo):
+    # Both connections free up at once: the queued requests must still be
+    # spaced by the rate limit, not sent together
+    arquivo.delays = [0.3, 0.25]
+    pages = [f"{item['originalURL']}/{item['tstamp']}" for item in ITEMS[1:]]
+
+    async def run():
+        async with ArquivoFetcher(
+            base_url=arquivo.base_url,
+            concurrency=2,
+            rate_per_s=20,
+            retry_policy=RetryPolicy(max_attempts=1),
+        ) as fetcher:
+            await asyncio.gather(
+                *(
+                    fetcher.get(f"{arquivo.base_url}/textextracted", {"m": page})
+                    for page in pages + pages
+                )
+            )
+
+    asyncio.run(run())
+    gaps = [b - a for a, b in zip(arquivo.arrivals, arquivo.arrivals[1:])]
+    assert len(arquivo.arrivals) == 4
+    assert min(gaps) >= 0.04
+
+
+ARCHIVED_PAGE = """<html><head><title>Público</title><style>.a{color:red}</style></head>
+<body><header><a href="/">Público</a><ul class="main-menu"><li>Política</li></ul></header>
+<nav>Início | Mundo | Desporto</nav>
+<article><header><h1>O 25 de Abril</h1></header>
+<p>Os capitães &amp; o <b>MFA</b> saíram<br>à rua.</p><!-- pub -->Depois, o Carmo.
+<div class="share-buttons">Partilhar no Facebook</div>
+<script>var html = "<p>Não é texto</p>";</script>
+<p style="display: none">Escondido</p><p>Fim.</p></article>
+<aside>Mais lidas</aside><footer>© Público Comunicação Social</footer></body></html>"""
+
+
+def test_extraction_drops_boilerplate():
+    assert extract_text(ARCHIVED_PAGE) == (
+        "O 25 de Abril\nOs capitães & o MFA saíram\nà rua.\nDepois, o Carmo.\nFim."
+    )
+    assert JsonDataProcessor.preprocess_text("{html}" + ARCHIVED_PAGE).startswith(
+        "O 25 de Abril\n"
+    )
+    # Plain text, comparisons included, is left as it was
+    assert JsonDataProcessor.preprocess_text("Em 1974 < 1975.") == "Em 1974 < 1975."
+
+    paragraph = "<p>Os capitães saíram à rua na madrugada de 25 de Abril.</p>"
+    page = ARCHIVED_PAGE.replace("<p>Fim.</p>", paragraph * 20).replace(
+        "<nav>", "<nav>" + "<a>Secção</a> " * 100
+    )
+    report = benchmark([page] * 50, rounds=1)
+    print("\nExtraction benchmark:", json.dumps(report))
+    assert report["token_reduction"] >= 0.25
+    assert report["structural"]["mb_per_s"] >= 1.0
+
+
+def test_columnar_output_round_trips(tmp_path):
+    crawl = {
+        f"2014042{p}120000": {
+            **{field: f"{field} {p}" for field in ["title", "originalURL"]},
+            "linkToArchive": f"https://arquivo.pt/wayback/2014042{p}120000/x{p}",
+            "linkToNoFrame": f"https://arquivo.pt/noFrame/replay/2014042{p}120000/x{p}",
+            "linkToScreenshot": "",
+            "tstamp": f"2014042{p}120000",
+            "children": [
+                {
+                    "text": f"Parágrafo {c} da notícia {p} sobre o 25 de Abril.",
+                    "link": "",
+                }
+                for c in range(20)
+            ],
+        }
+        for p in range(10)
+    }
+    input_path = tmp_path / "publico.json"
+    input_path.write_text(json.dumps(crawl), encoding="utf-8")
+
+    outputs = {}
+    for fmt in ["json", "parquet", "jsonl"]:
+        processor = JsonDataProcessor(str(input_path), str(tmp_path / fmt), fmt)
+        processor.run()
+        outputs[fmt] = sorted(str(p) for p in (tmp_path / fmt).iterdir())
+
+    assert [os.path.basename(p) for p in outputs["parquet"]] == [
+        "processed_publico.children.parquet",
+        "processed_publico.parents.parquet",
+    ]
+    expected = read_corpus(outputs["json"][0])
+    assert len(expected) == 200
+    for fmt in ["parquet", "jsonl"]:
+        pd.testing.assert_frame_equal(read_corpus(outputs[fmt][0]), expected)
+
+    # Only the requested columns are read, parents joined back on parent_id
+    partial = read_corpus(outputs["parquet"][0], ["text", "parent_title"])
+    assert list(partial.columns) == ["text", "parent_title"]
+    assert partial["parent_title"][25] == "title 1"
+
+    entries = processor.process_file(str(input_path))
+    report = format_benchmark(entries * 20, ["text"])
+    print("\nOutput format benchmark:", json.dumps(report))
+    assert report["parquet"]["bytes"] < report["json"]["bytes"] / 5
+    assert report["jsonl"]["bytes"] < report["json"]["bytes"] / 5
+
+
+def test_parents_path_only_renames_the_table():
+    # ".children." elsewhere in the path is left alone
+    assert parents_path("/runs/a.children.b/processed_x.children.parquet") == (
+        "/runs/a.children.b/processed_x.parents.parquet"
+    )
+    assert parents_path("processed_x.children.jsonl.gz") == (
+        "processed_x.parents.jsonl.gz"
+    )
+    with pytest.raises(ValueError):
+        parents_path("/runs/a.children.b/processed_x.json")
+
+
+def write_crawl(data_dir, source_dir: str, pages: dict) -> None:
+    source_path = data_dir / source_dir
+    source_path.mkdir(parents=True, exist_ok=True)
+    crawl = {
+        f"1974042{i}": {
+            "tstamp": f"1974042{i}",
+            "title": title,
+            "originalURL": f"http://{source_dir}.pt/{title}",
+            "linkToArchive": f"https://arquivo.pt/wayback/{title}",
+            "linkToNoFrame": "",
+            "linkToScreenshot": "",
+            "children": [{"text": text, "link": ""} for text in texts],
+        }
+        for i, (title, texts) in enumerate(pages.items())
+    }
+    (source_path / "crawl.json").write_text(json.dumps(crawl), encoding="utf-8")
+
+
+class CountingEmbedding(FakeEmbedding):
+    def __init__(self):
+        super().__init__()
+        self.embedded = []
+
+    def get_embeddings(self, texts):
+        self.embedded.extend(texts)
+        return super().get_embeddings(texts)
+
+
+@pytest.fixture
+def incremental(tmp_path):
+    client = chromadb.PersistentClient(
+        path=str(tmp_path / "chroma"), settings=Settings(anonymized_telemetry=False)
+    )
+    return client.create_collection("incremental"), CountingEmbedding()
+
+
+def test_incremental_ingest_embeds_only_changes(tmp_path, incremental):
+    collection, embedding = incremental
+    data_dir, embeddings_path = tmp_path / "res", str(tmp_path / "embeddings")
+
+    def run():
+        return ingest(str(data_dir), collection, embedding, embeddings_path, SOURCES)
+
+    write_crawl(
+        data_dir,
+        "publico",
+        {
+            "revolucao": ["Os capitães saíram à rua.", "Salgueiro Maia em Santarém."],
+            "censura": ["O lápis azul da censura."],
+            "eleicoes": ["As eleições de 1975."],
+        },
+    )
+    write_crawl(data_dir, "expresso", {"pide": ["A sede da PIDE."]})
+    first = run()
+    assert first["added"] == first["embedded"] == 5
+    stored = collection.get(include=["metadatas"])
+    # Rows of chunks the collection no longer has are dropped
+    pd.DataFrame(
+        {
+            "chunk_id": stored["ids"] + ["doc_999"],
+            "x": [0.0, 1.0, 2.0, 3.0, 4.0, 9.0],
+            "y": [0.0, 1.0, 2.0, 3.0, 4.0, 9.0],
+        }
+    ).to_csv(os.path.join(embeddings_path, "umap_metadata.csv"), index=False)
+
+    # One chunk edited, one page gone, one page new, one chunk re-wrapped
+    embedding.embedded.clear()
+    write_crawl(
+        data_dir,
+        "publico",
+        {
+            "revolucao": ["Os capitães saíram à rua.", "Salgueiro Maia no Carmo."],
+            "eleicoes": ["As  eleições\nde 1975."],
+            "constituicao": ["A Constituição de 1976."],
+        },
+    )
+    second = run()
+
+    assert sorted(embedding.embedded) == [
+        "A Constituição de 1976.",
+        "Salgueiro Maia no Carmo.",
+    ]
+    assert (second["unchanged"], second["changed"]) == (3, 1)
+    assert (second["added"], second["deleted"]) == (1, 1)
+    assert (second["pages_added"], second["pages_removed"]) == (1, 1)
+
+    # Edited chunks keep their id; the censored page's chunk is gone
+    ids = collection.get()["ids"]
+    old_ids = dict(zip(stored["ids"], [m["chunk_key"] for m in stored["metadatas"]]))
+    censura = [i for i, key in old_ids.items() if "censura" in key]
+    edited = [i for i, key in old_ids.items() if key.endswith("revolucao#1.0")]
+    assert censura[0] not in ids and edited[0] in ids
+    assert len(ids) == 5
+
+    with open(os.path.join(embeddings_path, "metadata.json")) as f:
+        meta_map = json.load(f)
+    assert sorted(meta["title"] for meta in meta_map.values()) == [
+        "constituicao",
+        "eleicoes",
+        "pide",
+        "revolucao",
+    ]
+
+    umap_df = pd.read_csv(os.path.join(embeddings_path, "umap_metadata.csv"))
+    assert sorted(umap_df["chunk_id"]) == sorted(ids)
+    assert umap_df["x"].between(0.0, 4.0).all()
+    row_index = build_row_index(umap_df, ids)
+    current = collection.get(include=["metadatas"])
+    for doc_id, metadata in zip(current["ids"], current["metadatas"]):
+        assert umap_df["title"][row_index[doc_id]] in metadata["chunk_key"]
+
+
+def test_incremental_ingest_refuses_incomplete_crawls(tmp_path, incremental):
+    collection, embedding = incremental
+    data_dir, embeddings_path = tmp_path / "res", str(tmp_path / "embeddings")
+
+    def run(**kwargs):
+        return ingest(
+            str(data_dir), collection, embedding, embeddings_path, SOURCES, **kwargs
+        )
+
+    with pytest.raises(ValueError, match="missing publico, expresso"):
+        run()
+    write_crawl(data_dir, "publico", {"revolucao": ["Os capitães saíram à rua."]})
+    write_crawl(data_dir, "expresso", {"pide": ["A sede da PIDE."]})
+    assert run()["added"] == 2
+
+    # A source directory gone missing is not a source gone empty
+    (data_dir / "expresso" / "crawl.json").unlink()
+    (data_dir / "expresso").rmdir()
+    with pytest.raises(ValueError, match="missing expresso"):
+        run()
+    assert len(collection.get()["ids"]) == 2
+
+    # Even when allowed, only chunks of the crawled sources are deleted
+    write_crawl(data_dir, "publico", {"censura": ["O lápis azul da censura."]})
+    report = run(allow_deletions=True)
+    assert (report["added"], report["deleted"], report["kept"]) == (1, 1, 1)
+    documents = collection.get()["documents"]
+    assert sorted(documents) == ["A sede da PIDE.", "O lápis azul da censura."]
+    with open(os.path.join(embeddings_path, "metadata.json")) as f:
+        titles = sorted(meta["title"] for meta in json.load(f).values())
+    assert titles == ["censura", "pide"]
+
+
+def test_chunk_text_keeps_whole_sentences_under_the_limit():
+    sentences = [f"A frase número {i} fala do 25 de Abril." for i in range(40)]
+    text = " ".join(sentences)
+    limit = count_tokens(" ".join(sentences[:5]))
+
+    chunks = chunk_text(text, max_tokens=limit)
+
+    assert " ".join(chunk for chunk, _ in chunks) == text
+    assert all(tokens <= limit for _, tokens in chunks)
+    assert all(tokens == count_tokens(chunk) for chunk, tokens in chunks[:-1])
+    assert len(chunks) == 8
@@ -0,0 +1,127 @@
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+# Add the app directory to path to import modules
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "app"))
+
+from utils.knn_graph import KNNGraph, fit_umap, sweep
+
+
+class StubUMAP:
+    """umap.UMAP stand-in that records its arguments."""
+
+    calls = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        StubUMAP.calls.append(kwargs)
+
+    def fit_transform(self, embeddings):
+        return np.zeros((len(embeddings), self.kwargs["n_components"]))
+
+
+@pytest.fixture
+def vectors():
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(10, 32))
+    vectors = centers[rng.integers(0, 10, size=1500)] + rng.normal(
+        scale=0.3, size=(1500, 32)
+    )
+    vectors[7] = vectors[3]  # a duplicate still lists itself first
+    return vectors
+
+
+@pytest.fixture
+def stub_umap(monkeypatch):
+    StubUMAP.calls = []
+    monkeypatch.setitem(sys.modules, "umap", types.SimpleNamespace(UMAP=StubUMAP))
+    return StubUMAP
+
+
+def test_knn_graph_blocked_build_matches_brute_force(vectors, tmp_path):
+    ids = [f"doc_{i}" for i in range(len(vectors))]
+
+    # Blocks smaller than the corpus, in both directions
+    graph = KNNGraph.build(
+        ids, vectors, k=10, workers=2, row_block=200, column_block=300
+    )
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    truth = np.argsort(-(unit @ unit.T), axis=1)[:, :10]
+
+    assert graph.indices[:, 0].tolist() == list(range(len(vectors)))
+    assert graph.indices[3, 1] == 7 and graph.distances[3, 1] < 1e-5
+    overlap = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(graph.indices, truth)])
+    assert overlap >= 0.99
+    assert np.all(np.diff(graph.distances, axis=1) >= -1e-6)
+
+    graph.save(str(tmp_path / "graph"), vectors)
+    loaded = KNNGraph.load(str(tmp_path / "graph"))
+    assert isinstance(loaded.indices, np.memmap)
+    indices, distances, _ = loaded.precomputed_knn(5)
+    assert indices.shape == distances.shape == (1500, 5)
+    np.testing.assert_array_equal(indices, graph.indices[:, :5])
+
+    pytest.importorskip("umap")
+    coordinates = fit_umap(loaded, vectors, n_neighbors=5)
+    assert coordinates.shape == (1500, 2)
+
+
+def test_approximate_knn_graph_through_ivf(vectors):
+    ids = [f"doc_{i}" for i in range(len(vectors))]
+    exact = KNNGraph.build(ids, vectors, k=10)
+
+    approximate = KNNGraph.build(ids, vectors, k=10, nprobe=16, row_block=200)
+    assert not approximate.exact
+    assert approximate.indices[:, 0].tolist() == list(range(len(vectors)))
+    assert np.all(np.diff(approximate.distances, axis=1) >= -1e-6)
+    recall = np.mean(
+        [len(set(a) & set(b)) / 10 for a, b in zip(approximate.indices, exact.indices)]
+    )
+    assert recall >= 0.9
+
+    # Probing every list scores every pair, as the exact graph does
+    everything = KNNGraph.build(ids, vectors, k=10, nprobe=len(vectors))
+    np.testing.assert_allclose(everything.distances, exact.distances, atol=1e-5)
+
+    # Fewer rows than k: the row itself pads the missing neighbours
+    small = KNNGraph.build(ids[:3], vectors[:3], k=3, nprobe=1)
+    assert small.indices.shape == (3, 3)
+    assert small.indices[:, 0].tolist() == [0, 1, 2]
+
+
+def test_umap_fits_and_sweeps_on_the_saved_graph(vectors, stub_umap, tmp_path):
+    ids = [f"doc_{i}" for i in range(len(vectors))]
+    graph = KNNGraph.build(ids, vectors, k=10)
+    graph.save(str(tmp_path / "graph"), vectors)
+
+    coordinates = fit_umap(graph, vectors, n_neighbors=5, min_dist=0.2)
+    assert coordinates.shape == (1500, 2)
+    (kwargs,) = stub_umap.calls
+    assert kwargs["metric"] == "cosine" and kwargs["min_dist"] == 0.2
+    knn_indices, knn_distances, search_index = kwargs["precomputed_knn"]
+    np.testing.assert_array_equal(knn_indices, graph.indices[:, :5])
+    assert knn_distances.shape == (1500, 5) and search_index is None
+
+    with pytest.raises(ValueError):
+        fit_umap(graph, vectors, n_neighbors=11)
+
+    stub_umap.calls = []
+    results = sweep(str(tmp_path / "graph"), n_neighbors=(5, 10), min_dists=(0.0, 0.5))
+    assert [(r["n_neighbors"], r["min_dist"]) for r in results] == [
+        (5, 0.0),
+        (5, 0.5),
+        (10, 0.0),
+        (10, 0.5),
+    ]
+    assert all(r["coordinates"].shape == (1500, 2) for r in results)
+    assert [c["precomputed_knn"][0].shape for c in stub_umap.calls] == [
+        (1500, 5),
+        (1500, 5),
+        (1500, 10),
+        (1500, 10),
+    ]
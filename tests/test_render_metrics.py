@@ -0,0 +1,74 @@
+import os
+import sys
+
+import pytest
+
+# Add the app directory to path to import modules
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "app"))
+
+from utils import render_metrics
+from utils.tracing import configure_tracing
+
+
+class Message:
+    def __init__(self, size):
+        self.size = size
+
+    def ByteSize(self):
+        return self.size
+
+
+class Context:
+    def __init__(self):
+        self.sent = []
+        self._enqueue = self.sent.append
+
+
+@pytest.fixture
+def fresh_tracer(monkeypatch):
+    """configure_tracing() for one test; the process-wide tracer is restored after."""
+    from utils import tracing
+
+    monkeypatch.setattr(tracing, "_tracer", tracing.get_tracer())
+    return configure_tracing
+
+
+def test_render_spans_count_cpu_and_payload(monkeypatch, fresh_tracer):
+    ctx = Context()
+    monkeypatch.setattr(render_metrics, "_script_run_ctx", lambda: ctx)
+    tracer = fresh_tracer()
+
+    with render_metrics.measure_render("render_chat"):
+        sum(i * i for i in range(100000))
+        ctx._enqueue(Message(120))
+        ctx._enqueue(Message(30))
+
+    attributes = tracer.recent_spans()[-1]["attributes"]
+    assert attributes["payload_bytes"] == 150
+    assert attributes["messages"] == 2
+    assert attributes["cpu_ms"] > 0
+    # Messages still reach the browser, and counting stops with the span
+    assert [m.size for m in ctx.sent] == [120, 30]
+    assert ctx._enqueue == ctx.sent.append
+
+
+def test_render_spans_without_enqueue_hook(monkeypatch, fresh_tracer, caplog):
+    class FrozenContext(Context):
+        def __setattr__(self, name, value):
+            if hasattr(self, name):
+                raise AttributeError(f"cannot assign to field '{name}'")
+            super().__setattr__(name, value)
+
+    monkeypatch.setattr(render_metrics, "_unhooked_warned", False)
+    for ctx in [object(), FrozenContext()]:
+        monkeypatch.setattr(render_metrics, "_script_run_ctx", lambda: ctx)
+        tracer = fresh_tracer()
+
+        with render_metrics.measure_render("render_chat"):
+            pass
+
+        # The render is still timed, without payload counters
+        attributes = tracer.recent_spans()[-1]["attributes"]
+        assert "cpu_ms" in attributes and "payload_bytes" not in attributes
+    assert caplog.text.count("Render spans will not count payload bytes") == 1
@@ -0,0 +1,688 @@
+import json
+import os
+import sys
+
+import chromadb
+import numpy as np
+import pandas as pd
+import pytest
+from chromadb.config import Settings
+
+# Add the app directory to path to import modules
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "app"))
+
+from utils.bm25 import build_from_collection
+from utils.create_test_db import (
+    SAMPLE_DOCS,
+    FakeEmbedding,
+    create_collection,
+    load_json_documents,
+)
+from utils.evaluation import evaluate_search, load_labeled_queries
+from utils.filters import build_from_collection as build_filter_index
+from utils.hierarchy import HierarchyIndex, build_child_collection
+from utils.highlights import (
+    NeighbourTable,
+    build_row_index,
+    row_positions,
+    rows_for_ids,
+)
+from utils.ivf import IVFIndex
+from utils.ivf import sweep as ivf_sweep
+from utils.knn_graph import KNNGraph
+from utils.matryoshka import MatryoshkaIndex, sweep, truncate
+from utils.quantized import QuantizedIndex, recall_vs_exact
+from utils.resilience import CircuitOpenError
+from utils.retriever import ChromaDBRetriever
+from utils.topics import TopicModel
+from utils.topics import build_from_collection as build_topics
+
+DEMO_PATH = os.path.join(ROOT_DIR, "notebooks", "demo_relevant.json")
+GOLDEN_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "golden_queries.json"
+)
+COLLECTION_NAME = "test_cravo"
+
+# Regression gates: lower these only with a good reason
+TOP_K = 3
+MIN_RECALL = 0.85
+MIN_MRR = 0.75
+BENCHMARK_ROUNDS = 20
+# Wall-clock latency depends on the machine: gated only when this is set
+MAX_P95_MS = os.getenv("RETRIEVAL_MAX_P95_MS")
+
+EXACT_HNSW = {"hnsw:construction_ef": 400, "hnsw:search_ef": 400, "hnsw:M": 64}
+
+# Distractor pages: mostly filler words, some taken from the relevant pages
+N_DISTRACTORS = 500
+DEMO_WORD_RATE = 0.1
+FILLER_WORDS = """
+    o a os as um uma de do da dos das em no na por para com que se mais
+    governo camara lisboa porto cidade pais europa presidente ministro partido
+    economia trabalho escola saude imprensa jornal noticia ano mes semana dia
+    historia politica guerra acordo lei direito povo familia igreja rua praca
+    futebol musica cinema livro teatro arte ciencia empresa banco crise greve
+    """.split()
+
+
+def distractor_documents(documents, n, seed=0):
+    """Random pages sharing common words, not names, with the given documents."""
+    rng = np.random.default_rng(seed)
+    words = sorted(
+        {word for doc in documents for word in doc.split() if word.isalpha()}
+        - {word for doc in documents for word in doc.split() if not word.islower()}
+    )
+    return [
+        " ".join(
+            (
+                rng.choice(words)
+                if rng.random() < DEMO_WORD_RATE
+                else rng.choice(FILLER_WORDS)
+            )
+            for _ in range(rng.integers(15, 50))
+        )
+        for _ in range(n)
+    ]
+
+
+@pytest.fixture(scope="module")
+def db_path(tmp_path_factory):
+    """Fixture collection: the demo documents among sample and random distractors."""
+    path = str(tmp_path_factory.mktemp("chroma"))
+    demo = load_json_documents(DEMO_PATH)
+    distractors = distractor_documents(demo["documents"], N_DISTRACTORS)
+
+    docs = demo["documents"] + SAMPLE_DOCS + distractors
+    ids = (
+        demo["ids"]
+        + [f"sample_{i}" for i in range(len(SAMPLE_DOCS))]
+        + [f"distractor_{i}" for i in range(len(distractors))]
+    )
+    metadatas = demo["metadatas"] + [{"link": "", "m_id": -1}] * (
+        len(SAMPLE_DOCS) + len(distractors)
+    )
+
+    client = chromadb.PersistentClient(
+        path=path, settings=Settings(anonymized_telemetry=False)
+    )
+    # A near-exact HNSW graph, so that misses come from the ranking being tested
+    client.create_collection(COLLECTION_NAME, metadata=EXACT_HNSW)
+    create_collection(
+        client,
+        COLLECTION_NAME,
+        docs,
+        FakeEmbedding().get_embeddings(docs),
+        ids,
+        metadatas,
+    )
+    return path
+
+
+@pytest.fixture(scope="module")
+def retriever(db_path):
+    return ChromaDBRetriever(
+        db_path=db_path, collection_name=COLLECTION_NAME, embedding=FakeEmbedding()
+    )
+
+
+@pytest.fixture(scope="module")
+def hybrid_retriever(db_path, tmp_path_factory):
+    plain = ChromaDBRetriever(
+        db_path=db_path, collection_name=COLLECTION_NAME, embedding=FakeEmbedding()
+    )
+    bm25_path = str(tmp_path_factory.mktemp("bm25") / "bm25_index.npz")
+    build_from_collection(plain.collection).save(bm25_path)
+
+    return ChromaDBRetriever(
+        db_path=db_path,
+        collection_name=COLLECTION_NAME,
+        embedding=FakeEmbedding(),
+        bm25_path=bm25_path,
+    )
+
+
+@pytest.fixture(scope="module")
+def quantized_path(retriever, tmp_path_factory):
+    results = retriever.collection.get(include=["embeddings"])
+    path = str(tmp_path_factory.mktemp("quantized") / "index")
+    QuantizedIndex.build(results["ids"], results["embeddings"]).save(path)
+    return path
+
+
+@pytest.fixture(scope="module")
+def quantized_retriever(db_path, quantized_path):
+    return ChromaDBRetriever(
+        db_path=db_path,
+        collection_name=COLLECTION_NAME,
+        embedding=FakeEmbedding(),
+        vector_index_path=quantized_path,
+    )
+
+
+@pytest.fixture(scope="module")
+def matryoshka_retriever(db_path, retriever, tmp_path_factory):
+    results = retriever.collection.get(include=["embeddings"])
+    path = str(tmp_path_factory.mktemp("matryoshka") / "index")
+    MatryoshkaIndex.build(results["ids"], results["embeddings"], 64).save(path)
+    return ChromaDBRetriever(
+        db_path=db_path,
+        collection_name=COLLECTION_NAME,
+        embedding=FakeEmbedding(),
+        vector_index_path=path,
+    )
+
+
+@pytest.fixture(scope="module")
+def ivf_retriever(db_path, retriever, tmp_path_factory):
+    results = retriever.collection.get(include=["embeddings"])
+    path = str(tmp_path_factory.mktemp("ivf") / "index")
+    IVFIndex.build(results["ids"], results["embeddings"], n_lists=4, nprobe=2).save(
+        path
+    )
+    return ChromaDBRetriever(
+        db_path=db_path,
+        collection_name=COLLECTION_NAME,
+        embedding=FakeEmbedding(),
+        vector_index_path=path,
+    )
+
+
+@pytest.fixture(scope="module")
+def filter_path(retriever, tmp_path_factory):
+    # Stand-in for umap_metadata.csv: one source and capture date per parent
+    umap_df = pd.DataFrame(
+        {
+            "meta_id": [1299, 952, 114],
+            "source_name": ["Expresso", "Publico", "Wikipedia PT"],
+            "tstamp": ["20180630120000", "20150101000000", "20240425000000"],
+        }
+    )
+    path = str(tmp_path_factory.mktemp("filters") / "filter_index.npz")
+    build_filter_index(retriever.collection, umap_df).save(path)
+    return path
+
+
+@pytest.fixture(scope="module")
+def hierarchy_path(db_path, retriever, tmp_path_factory):
+    client = chromadb.PersistentClient(
+        path=db_path, settings=Settings(anonymized_telemetry=False)
+    )
+    path = str(tmp_path_factory.mktemp("hierarchy") / "hierarchy_index.npz")
+    client.create_collection(f"{COLLECTION_NAME}_children", metadata=EXACT_HNSW)
+    build_child_collection(
+        client, retriever.collection, FakeEmbedding(), child_tokens=16
+    ).save(path)
+    return path
+
+
+@pytest.fixture(scope="module")
+def hierarchy_retriever(db_path, hierarchy_path):
+    return ChromaDBRetriever(
+        db_path=db_path,
+        collection_name=COLLECTION_NAME,
+        embedding=FakeEmbedding(),
+        hierarchy_path=hierarchy_path,
+        context_tokens=90,
+    )
+
+
+@pytest.fixture(scope="module")
+def golden_queries():
+    return load_labeled_queries(GOLDEN_PATH)
+
+
+def test_retrieve_returns_documents_with_metadata(retriever):
+    docs = retriever.retrieve("Revolução dos Cravos", top_k=2)
+
+    assert len(docs) == 2
+    assert docs[0]["id"] == "doc_50"
+    assert docs[0]["metadata"]["m_id"] == 114
+    assert docs[0]["distance"] is not None
+    assert docs[0]["content"].startswith("Revolução dos Cravos")
+
+
+def test_golden_ids_exist_in_demo_seed(golden_queries):
+    demo_ids = set(load_json_documents(DEMO_PATH)["ids"])
+
+    for item in golden_queries:
+        assert set(item["relevant_ids"]) <= demo_ids
+
+
+def test_hybrid_matches_exact_names(hybrid_retriever):
+    assert hybrid_retriever.bm25.search("ZDF", 1)[0][0] == "doc_269"
+
+    docs = hybrid_retriever.retrieve("Patiño", top_k=1)
+    assert docs[0]["id"] == "doc_543"
+    assert docs[0]["content"]
+
+
+def test_hybrid_falls_back_to_bm25_when_embeddings_are_down(hybrid_retriever):
+    class DownEmbedding(FakeEmbedding):
+        def get_embedding(self, text):
+            raise CircuitOpenError("embeddings")
+
+    hybrid_retriever.embedding = DownEmbedding()
+    try:
+        docs = hybrid_retriever.retrieve("Quinta Patiño", top_k=1)
+    finally:
+        hybrid_retriever.embedding = FakeEmbedding()
+
+    assert docs[0]["id"] == "doc_543"
+    assert docs[0]["distance"] is None
+
+
+def unit_rows(vectors):
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("mode", ["binary", "int8"])
+def test_quantized_recall_against_exact(mode):
+    # Normalized like real embeddings, with a low-dimensional structure
+    rng = np.random.default_rng(0)
+    vectors = unit_rows(
+        rng.normal(size=(4000, 16)) @ rng.normal(size=(16, 256))
+        + rng.normal(scale=0.1, size=(4000, 256))
+    )
+    ids = [f"doc_{i}" for i in range(len(vectors))]
+    queries = unit_rows(
+        vectors[rng.integers(0, len(vectors), size=50)]
+        + rng.normal(scale=0.02, size=(50, 256))
+    )
+    index = QuantizedIndex.build(ids, vectors)
+    # Only a fraction of the corpus is rescored exactly
+    assert 10 * index.rescore_factor < len(ids)
+
+    report = recall_vs_exact(index, queries, top_k=10, mode=mode)
+    memory = index.memory_bytes()
+    print(f"\n{mode} quantization:", json.dumps(report), memory)
+
+    assert report["recall"] >= 0.95
+    assert vectors.size * 4 / memory[mode] >= (32 if mode == "binary" else 4)
+
+
+@pytest.mark.parametrize("mode", ["binary", "int8"])
+def test_loaded_quantized_index_keeps_only_its_codes(mode, tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = unit_rows(rng.normal(size=(2000, 256)))
+    ids = [f"doc_{i}" for i in range(len(vectors))]
+    QuantizedIndex.build(ids, vectors, mode=mode).save(str(tmp_path))
+
+    index = QuantizedIndex.load(str(tmp_path))
+    other = "int8" if mode == "binary" else "binary"
+    memory = index.memory_bytes()
+    assert memory[other] == 0 and memory["float32"] == 0
+    assert memory["resident"] == memory[mode] + memory["scales"]
+    assert memory["memory_mapped"] == vectors.size * 4
+    assert index.search(vectors[5], top_k=3)[0][0] == "doc_5"
+    with pytest.raises(ValueError):
+        index.search(vectors[5], top_k=3, mode=other)
+
+    both = QuantizedIndex.load(str(tmp_path), modes=["binary", "int8"])
+    assert both.search(vectors[5], top_k=3, mode=other)[0][0] == "doc_5"
+
+
+def test_matryoshka_prefix_sweep(golden_queries):
+    # Leading components carry most of the signal, as in text-embedding-3
+    rng = np.random.default_rng(0)
+    decay = 1.0 / np.sqrt(1.0 + np.arange(1024) / 16.0)
+    vectors = unit_rows(rng.normal(size=(4000, 1024)) * decay)
+    ids = [f"doc_{i}" for i in range(len(vectors))]
+    queries = unit_rows(
+        vectors[rng.integers(0, len(vectors), size=50)]
+        + rng.normal(scale=0.02, size=(50, 1024)) * decay
+    )
+    report = sweep(ids, vectors, queries, top_k=10, rescore_factor=10)
+    print("\nMatryoshka sweep:", json.dumps(report))
+
+    by_dimensions = {row["prefix_dimensions"]: row for row in report}
+    # Only a fraction of the corpus is rescored with full vectors
+    assert by_dimensions[256]["candidates"] == 100
+    assert all(row["candidates"] < len(ids) for row in report[1:])
+    assert by_dimensions[1024]["recall"] == 1.0
+    assert by_dimensions[256]["recall"] >= 0.95
+    assert by_dimensions[64]["recall"] <= by_dimensions[512]["recall"]
+
+    embedding = FakeEmbedding(dimensions=1024)
+    query = embedding.get_embedding(golden_queries[0]["query"])
+    # A shortened embedding is the renormalized prefix of the full one
+    short = FakeEmbedding(dimensions=256).get_embedding(golden_queries[0]["query"])
+    np.testing.assert_allclose(short, truncate(query, 256), atol=1e-6)
+
+
+def test_filter_index_masks(filter_path):
+    from utils.filters import MetadataFilterIndex
+
+    filters = MetadataFilterIndex.load(filter_path)
+    allowed = lambda mask: sorted(np.array(filters.ids)[mask])
+
+    assert filters.mask() is None
+    assert allowed(filters.mask(sources=["Expresso", "Publico"])) == [
+        "doc_269",
+        "doc_543",
+    ]
+    assert allowed(filters.mask(start="2016", end="2020")) == ["doc_543"]
+    assert allowed(filters.mask(sources=["Publico"], start="2016")) == []
+    # Chunks of pages missing from the table count as undated
+    undated = [doc_id for doc_id in filters.ids if not doc_id.startswith("doc_")]
+    assert allowed(filters.mask(end="20150101")) == sorted(["doc_269"] + undated)
+    assert len(undated) == len(SAMPLE_DOCS) + N_DISTRACTORS
+
+
+@pytest.mark.parametrize("index", [None, "quantized"])
+@pytest.mark.parametrize("bm25", [False, True])
+def test_filtered_retrieval(index, bm25, db_path, filter_path, request, tmp_path):
+    bm25_path = None
+    if bm25:
+        bm25_path = str(tmp_path / "bm25_index.npz")
+        build_from_collection(request.getfixturevalue("retriever").collection).save(
+            bm25_path
+        )
+    filtered = ChromaDBRetriever(
+        db_path=db_path,
+        collection_name=COLLECTION_NAME,
+        embedding=FakeEmbedding(),
+        bm25_path=bm25_path,
+        vector_index_path=index and request.getfixturevalue(f"{index}_path"),
+        filter_index_path=filter_path,
+    )
+    query = "O que foi a Revolução dos Cravos?"
+
+    assert filtered.retrieve(query, top_k=3)[0]["id"] == "doc_50"
+
+    docs = filtered.retrieve(query, top_k=3, sources=["Expresso", "Publico"])
+    assert {doc["id"] for doc in docs} == {"doc_543", "doc_269"}
+
+    docs = filtered.retrieve(query, top_k=3, start="2016", end="2020")
+    assert [doc["id"] for doc in docs] == ["doc_543"]
+
+    assert filtered.retrieve(query, sources=["Publico"], start="2016") == []
+
+
+def test_missing_filter_index_warns_once(db_path, tmp_path, caplog):
+    unfiltered = ChromaDBRetriever(
+        db_path=db_path,
+        collection_name=COLLECTION_NAME,
+        embedding=FakeEmbedding(),
+        filter_index_path=str(tmp_path / "missing"),
+    )
+    assert "Filter index not found" in caplog.text
+
+    query = "O que foi a Revolução dos Cravos?"
+    caplog.clear()
+    for _ in range(3):
+        docs = unfiltered.retrieve(query, top_k=3, sources=["Publico"])
+        assert docs[0]["id"] == "doc_50"
+    ignored = [r for r in caplog.records if "No filter index" in r.getMessage()]
+    assert len(ignored) == 1
+
+
+def test_missing_topics_warn_once(db_path, filter_path, tmp_path, caplog):
+    untopical = ChromaDBRetriever(
+        db_path=db_path,
+        collection_name=COLLECTION_NAME,
+        embedding=FakeEmbedding(),
+        filter_index_path=filter_path,
+        topics_path=str(tmp_path / "missing"),
+    )
+    assert "Topics not found" in caplog.text
+
+    query = "O que foi a Revolução dos Cravos?"
+    caplog.clear()
+    for _ in range(3):
+        docs = untopical.retrieve(query, top_k=3, topics=[0])
+        assert docs[0]["id"] == "doc_50"
+    ignored = [r for r in caplog.records if "No topics loaded" in r.getMessage()]
+    assert len(ignored) == 1
+
+
+@pytest.mark.parametrize("index", [None, "quantized"])
+def test_topic_facet_retrieval(index, db_path, filter_path, request, tmp_path):
+    collection = request.getfixturevalue("retriever").collection
+    labeled = []
+
+    def labeler(keywords, examples):
+        labeled.append(keywords)
+        return " ".join(keywords[:2]).title()
+
+    path = str(tmp_path / "topics")
+    model = build_topics(collection, n_topics=3, labeler=labeler)
+    model.save(path)
+    assert len(labeled) == 3
+    assert set(model.assignments) == {0, 1, 2}
+
+    # Unchanged topics keep their cached labels
+    rebuilt = build_topics(
+        collection,
+        n_topics=3,
+        labeler=labeler,
+        label_cache=TopicModel.load_label_cache(path),
+    )
+    assert len(labeled) == 3
+    assert rebuilt.labels == model.labels
+
+    loaded = TopicModel.load(path)
+    assert loaded.labels == model.labels
+    umap_df = pd.DataFrame({"x": [0.0, 2.0, 4.0], "y": [1.0, 1.0, 1.0]})
+    row_index = {doc_id: row for row, doc_id in enumerate(loaded.ids[:3])}
+    row_topics = loaded.row_topics(row_index, len(umap_df))
+    assert list(row_topics) == list(loaded.assignments[:3])
+    positions = loaded.label_positions(umap_df["x"], umap_df["y"], row_topics)
+    assert positions.shape == (3, 2)
+
+    filtered = ChromaDBRetriever(
+        db_path=db_path,
+        collection_name=COLLECTION_NAME,
+        embedding=FakeEmbedding(),
+        vector_index_path=index and request.getfixturevalue(f"{index}_path"),
+        filter_index_path=filter_path,
+        topics_path=path,
+    )
+    query = "O que foi a Revolução dos Cravos?"
+    topic = int(loaded.topics_of(["doc_50"])[0])
+    members = {
+        doc_id for doc_id, t in zip(loaded.ids, loaded.assignments) if t == topic
+    }
+
+    docs = filtered.retrieve(query, top_k=3, topics=[topic])
+    assert docs[0]["id"] == "doc_50"
+    assert {doc["id"] for doc in docs} <= members
+
+    others = [t for t in range(3) if t != topic]
+    docs = filtered.retrieve(query, top_k=3, topics=others)
+    assert docs and not {doc["id"] for doc in docs} & members
+
+
+def test_highlight_rows_from_chroma_ids():
+    ids = ["doc_0", "doc_1", "doc_2", "doc_3"]
+    # Projection rows listing their chunk's position in collection.get() order
+    umap_df = pd.DataFrame({"index": [2, 0, 3, 1], "x": [0.0, 1.0, 2.0, 3.0]})
+    before = umap_df.copy()
+
+    row_index = build_row_index(umap_df, ids)
+    rows = rows_for_ids(["doc_3", "doc_2", "doc_3", "unknown"], row_index)
+
+    assert rows.tolist() == [2, 0]
+    assert rows.dtype == np.int64
+    assert umap_df.iloc[rows]["index"].tolist() == [3, 2]
+    pd.testing.assert_frame_equal(umap_df, before)
+
+    # Tables without the position column follow the doc_<row> naming
+    legacy = build_row_index(umap_df.drop(columns="index"), ids + ["doc_9"])
+    assert legacy == {"doc_0": 0, "doc_1": 1, "doc_2": 2, "doc_3": 3}
+
+    # Tables updated incrementally name the chunk of every row
+    updated = build_row_index(pd.DataFrame({"chunk_id": ["doc_3", "doc_7"]}), ids)
+    assert updated == {"doc_3": 0}
+
+
+def test_similar_documents_from_neighbour_table():
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(50, 16))
+    ids = [f"doc_{i}" for i in range(50)]
+    graph = KNNGraph.build(ids, vectors, k=6)
+
+    # Projection rows in another order, one chunk not projected
+    order = rng.permutation(50)[:49]
+    umap_df = pd.DataFrame({"index": order})
+    row_index = build_row_index(umap_df, ids)
+    table = NeighbourTable.from_graph(graph, row_index, len(umap_df), k=3)
+
+    row = 10
+    rows, distances = table.lookup(row)
+    expected = [
+        row_index[ids[i]] for i in graph.indices[order[row], 1:] if ids[i] in row_index
+    ][:3]
+    assert rows.tolist() == expected
+    assert row not in rows.tolist()
+    assert np.all(np.diff(distances) >= 0)
+    assert table.lookup(99)[0].size == 0
+
+    positions = row_positions(row_index, ids, len(umap_df))
+    assert positions.tolist() == order.tolist()
+
+
+def test_hierarchy_expands_within_parent_and_budget():
+    sentences = [f"Frase número {i} sobre a revolução." for i in range(10)]
+    index = HierarchyIndex.build(
+        ["doc_1", "doc_2", "doc_3"],
+        [" ".join(sentences[:6]), " ".join(sentences[6:]), "Outra página."],
+        [7, 7, 8],
+        "children",
+        child_tokens=8,
+    )
+
+    # Children of one page are contiguous, across its chunks
+    assert index.parent_offsets.tolist() == [0, 10, 11]
+    assert index.child_ids[6] == "doc_2#0"
+
+    # A page that fits the budget comes back whole
+    assert index.expand(3, token_budget=1000) == (0, 10)
+
+    # Otherwise the window grows around the match, inside its page
+    start, end = index.expand(9, token_budget=30)
+    assert end == 10 and start < 9
+    assert index.tokens(start, end) <= 30
+
+    docs = index.expand_documents(
+        [
+            {"id": "doc_1#3", "metadata": {}, "distance": 0.1},
+            {"id": "doc_1#4", "metadata": {}, "distance": 0.2},
+            {"id": "doc_3#0", "metadata": {}, "distance": 0.3},
+        ],
+        token_budget=60,
+    )
+    # doc_1#4 is in a page that was already expanded
+    assert [doc["id"] for doc in docs] == ["doc_1", "doc_3"]
+    assert "Frase número 3 " in docs[0]["content"]
+    assert docs[0]["metadata"]["m_id"] == 7
+
+
+def test_hierarchy_retrieval_matches_children(hierarchy_retriever, golden_queries):
+    def search_fn(query, k):
+        return [doc["id"] for doc in hierarchy_retriever.retrieve(query, top_k=k)]
+
+    report = evaluate_search(golden_queries, search_fn, k=TOP_K)
+    assert report["recall"] >= MIN_RECALL
+
+    docs = hierarchy_retriever.retrieve(golden_queries[0]["query"], top_k=TOP_K)
+    assert all("#" in doc["child_id"] for doc in docs)
+    assert len({doc["id"] for doc in docs}) == len(docs)
+
+
+def test_hierarchy_rejects_indexes_of_the_parent_chunks(
+    db_path, hierarchy_path, filter_path, caplog
+):
+    # The filter index is keyed by parent chunk ids, not child ids
+    with pytest.raises(ValueError, match="Filter index ids"):
+        ChromaDBRetriever(
+            db_path=db_path,
+            collection_name=COLLECTION_NAME,
+            embedding=FakeEmbedding(),
+            hierarchy_path=hierarchy_path,
+            filter_index_path=filter_path,
+        )
+
+    # Children of a few chunks only: a stale index is logged
+    from utils.filters import MetadataFilterIndex
+
+    child_ids = HierarchyIndex.load(hierarchy_path).child_ids
+    stale = MetadataFilterIndex.build(
+        child_ids[:10] + [f"gone_{i}" for i in range(10)],
+        [0] * 20,
+        ["Publico"] * 20,
+        ["20200101"] * 20,
+    )
+    stale_path = os.path.join(os.path.dirname(filter_path), "stale_filters.npz")
+    stale.save(stale_path)
+    ChromaDBRetriever(
+        db_path=db_path,
+        collection_name=COLLECTION_NAME,
+        embedding=FakeEmbedding(),
+        hierarchy_path=hierarchy_path,
+        filter_index_path=stale_path,
+    )
+    assert "index is stale" in caplog.text
+
+
+def test_ivf_nprobe_sweep():
+    # Clustered synthetic corpus, like chunks from a handful of domains
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(20, 32))
+    vectors = centers[rng.integers(0, 20, size=4000)] + rng.normal(
+        scale=0.3, size=(4000, 32)
+    )
+    ids = [f"doc_{i}" for i in range(len(vectors))]
+    queries = vectors[:50] + rng.normal(scale=0.05, size=(50, 32))
+
+    report = ivf_sweep(ids, vectors, queries, n_lists=32, top_k=10, workers=2)
+    print("\nIVF sweep:", json.dumps(report))
+
+    recalls = [row["recall"] for row in report["nprobe"]]
+    assert recalls == sorted(recalls)
+    assert recalls[-1] == 1.0  # nprobe == n_lists is exhaustive
+    assert report["memory_bytes"]["posting_lists"] == vectors.size * 4
+
+
+def test_ivf_build_starts_one_pool(monkeypatch):
+    from utils import ivf
+
+    pools = []
+
+    class CountingPool(ivf.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(ivf, "ProcessPoolExecutor", CountingPool)
+    monkeypatch.setattr(ivf, "ASSIGN_BLOCK", 1000)
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(4000, 16)).astype(np.float32)
+    ids = [f"doc_{i}" for i in range(len(vectors))]
+
+    pooled = IVFIndex.build(ids, vectors, n_lists=16, iterations=5, workers=2)
+    inline = IVFIndex.build(ids, vectors, n_lists=16, iterations=5)
+
+    assert len(pools) == 1
+    # Pooled assignment clusters exactly as inline assignment does
+    np.testing.assert_allclose(pooled.centroids, inline.centroids)
+    np.testing.assert_array_equal(pooled.offsets, inline.offsets)
+    assert pooled.ids == inline.ids
+
+
+@pytest.mark.parametrize("mode", ["vector", "hybrid", "quantized", "matryoshka", "ivf"])
+def test_retrieval_quality_and_latency(mode, request, golden_queries):
+    active = request.getfixturevalue(
+        "retriever" if mode == "vector" else f"{mode}_retriever"
+    )
+
+    def search_fn(query, k):
+        return [doc["id"] for doc in active.retrieve(query, top_k=k)]
+
+    report = evaluate_search(golden_queries * BENCHMARK_ROUNDS, search_fn, k=TOP_K)
+    print(f"\n{mode} retrieval benchmark:", json.dumps(report))
+
+    assert report["recall"] >= MIN_RECALL
+    assert report["mrr"] >= MIN_MRR
+    if MAX_P95_MS:
+        assert report["p95_ms"] <= float(MAX_P95_MS)
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import numpy as np
+
+# Add the app directory to path to import modules
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "app"))
+
+from utils.spatial import GridIndex
+from utils.spatial import benchmark as spatial_benchmark
+from utils.spatial import points_in_polygon
+
+
+def test_grid_index_matches_brute_force():
+    rng = np.random.default_rng(0)
+    centers = rng.uniform(-10, 10, size=(10, 2))
+    points = centers[rng.integers(0, 10, size=20000)] + rng.normal(size=(20000, 2))
+    x, y = points[:, 0], points[:, 1]
+    visible = rng.random(len(x)) < 0.7
+    index = GridIndex.build(x, y)
+
+    box = (-2.0, 3.0, -1.0, 4.0)
+    expected = np.flatnonzero((x >= -2) & (x <= 3) & (y >= -1) & (y <= 4) & visible)
+    assert np.array_equal(index.query_box(box, visible), expected)
+    assert len(index.query_box((50, 60, 50, 60))) == 0
+
+    lasso_x, lasso_y = [-5.0, 5.0, 0.0], [-5.0, -5.0, 5.0]
+    expected = np.flatnonzero(points_in_polygon(x, y, lasso_x, lasso_y) & visible)
+    assert np.array_equal(index.query_lasso(lasso_x, lasso_y, visible), expected)
+
+    for px, py in rng.uniform(-15, 15, size=(50, 2)):
+        distances = np.where(visible, (x - px) ** 2 + (y - py) ** 2, np.inf)
+        assert index.nearest(px, py, visible) == np.argmin(distances)
+
+    culled = index.cull(box, max_points=100, mask=visible)
+    assert len(culled) == 100
+    assert set(culled) <= set(index.query_box(box, visible))
+    assert index.bounds(culled)[0] >= box[0]
+
+    # Timings are machine-dependent: compare them with the spatial.py CLI
+    (report,) = spatial_benchmark(sizes=[2000], queries=5)
+    assert {"box_ms", "box_brute_ms", "nearest_ms", "nearest_brute_ms"} <= set(report)
@@ -0,0 +1,71 @@
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Add the app directory to path to import modules
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT_DIR, "app"))
+
+from utils.tiles import AGGREGATE_TILE, POINT_TILE, QUANT, decode_tile, export_tiles
+
+
+def test_tile_pyramid_stores_every_point_once(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 20000
+    umap_df = pd.DataFrame(
+        {
+            "x": rng.normal(size=n),
+            "y": rng.normal(scale=3, size=n),
+            "source_name": rng.choice(["Expresso", "Publico", "Web"], size=n),
+            "title": [f"Página {i}" for i in range(n)],
+            "tstamp": "19740425000000",
+            "linkToArchive": "https://arquivo.pt/wayback/",
+        }
+    )
+    manifest = export_tiles(umap_df, str(tmp_path), max_points=500)
+    x0, y0, size = manifest["bounds"]
+
+    def read(z, x, y):
+        return decode_tile(
+            (tmp_path / "tiles" / str(z) / str(x) / f"{y}.bin").read_bytes()
+        )
+
+    root = read(0, 0, 0)
+    assert root["kind"] == AGGREGATE_TILE
+    expected = umap_df["source_name"].value_counts()
+    for c, category in enumerate(manifest["categories"]):
+        assert root["counts"][:, c].sum() == expected[category]
+
+    # Walk the quadtree like the static client: only non-empty children
+    seen, pending, tiles = [], [(0, 0, 0)], 0
+    while pending:
+        z, x, y = pending.pop()
+        tile = read(z, x, y)
+        tiles += 1
+        if tile["kind"] == POINT_TILE:
+            assert len(tile["rows"]) <= 500
+            tile_size = size / 2**z
+            px = x0 + (x + tile["x"] / QUANT) * tile_size
+            py = y0 + (y + tile["y"] / QUANT) * tile_size
+            rows = tile["rows"].astype(np.int64)
+            assert np.allclose(
+                px, umap_df["x"].to_numpy()[rows], atol=tile_size / QUANT
+            )
+            assert np.allclose(
+                py, umap_df["y"].to_numpy()[rows], atol=tile_size / QUANT
+            )
+            seen.extend(rows)
+            continue
+        half = tile["bins"] // 2
+        bx, by = tile["cells"] % tile["bins"], tile["cells"] // tile["bins"]
+        for q in set(((by >= half) * 2 + (bx >= half)).tolist()):
+            pending.append((z + 1, 2 * x + q % 2, 2 * y + q // 2))
+
+    assert sorted(seen) == list(range(n))
+    assert tiles == manifest["tiles"]
+
+    shard = json.loads((tmp_path / "meta" / "1.json").read_text(encoding="utf-8"))
+    assert shard[234][0] == "Página 1234"